@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+if __name__ == "__main__" and __package__ is None:
+    rootdir=os.path.abspath('../..')
+    sys.path.append(rootdir)
+
+from loom.client.common import get_settings_manager_from_parsed_args
+from loom.client.common import add_settings_options_to_parser
+from loom.client.exceptions import *
+from loom.common import objecthandler
+
+
+class ResultCache:
+    """Sets up and executes commands under "cache" on the main parser.
+
+    The server reuses the outputs of a completed TaskRun for later TaskRuns
+    with the same TaskDefinition. These commands show the cached TaskRuns
+    and remove them, e.g. if a result is known to be bad.
+    """
+
+    def __init__(self, args=None):
+
+        # Args may be given as an input argument for testing purposes.
+        # Otherwise get them from the parser.
+        if args is None:
+            args = self._get_args()
+        self.args = args
+        self.settings_manager = get_settings_manager_from_parsed_args(self.args)
+        self.master_url = self.settings_manager.get_server_url_for_client()
+        self.objecthandler = objecthandler.ObjectHandler(self.master_url)
+
+    def _get_args(self):
+        parser = self.get_parser()
+        return parser.parse_args()
+
+    @classmethod
+    def get_parser(cls, parser=None):
+
+        # If called from main, use the subparser provided.
+        # Otherwise create a top-level parser here.
+        if parser is None:
+            parser = argparse.ArgumentParser(__file__)
+
+        parser.add_argument('command', choices=['show', 'invalidate'])
+        parser.add_argument('task_definition_id', metavar='TASK_DEFINITION_ID', nargs='?',
+                            help='Limit to one TaskDefinition. "invalidate" without an ID removes all entries.')
+        parser = add_settings_options_to_parser(parser)
+        return parser
+
+    def run(self):
+        if self.args.command == 'show':
+            self.show()
+        else:
+            self.invalidate()
+
+    def show(self):
+        response = self.objecthandler.get_result_cache(self.args.task_definition_id)
+        stats = response['result_cache']
+        if not stats['enabled']:
+            print 'The result cache is disabled on the server.'
+        print 'Hits: %s, misses: %s, entries: %s' % (
+            stats['hits'], stats['misses'], stats['entries'])
+        for entry in response['entries']:
+            print '%s  TaskDefinition %s  TaskRun %s  hits: %s' % (
+                entry['datetime_created'], entry['task_definition_id'],
+                entry['task_run_id'], entry['hit_count'])
+
+    def invalidate(self):
+        count = self.objecthandler.invalidate_result_cache(self.args.task_definition_id)
+        print 'Removed %s result cache entries.' % count
+
+
+if __name__=='__main__':
+    response = ResultCache().run()
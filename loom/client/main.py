@@ -9,13 +9,16 @@ if __name__ == "__main__" and __package__ is None:
     sys.path.append(rootdir)
 
 from loom.client import browser
+from loom.client import cache
 from loom.client import config
 from loom.client import download
 from loom.client import run
 from loom.client import server
 from loom.client import show
 from loom.client import upload
+from loom.client import verify
 from loom.client import test_runner
+from loom.common import objecthandler
 
 
 class Main(object):
@@ -28,6 +31,8 @@ class Main(object):
 
     def get_parser(cls):
         parser = argparse.ArgumentParser('loom')
+        parser.add_argument('--profile', action='store_true',
+                            help='print the number and latency of requests to the server, by endpoint')
         subparsers = parser.add_subparsers(help='select a subcommand')
 
         run_subparser = subparsers.add_parser('run', help='run a workflow')
@@ -58,6 +63,14 @@ class Main(object):
         browser.Browser.get_parser(browser_subparser)
         browser_subparser.set_defaults(SubcommandClass=browser.Browser)
 
+        verify_subparser = subparsers.add_parser('verify', help='check that stored objects match their ids')
+        verify.Verifier.get_parser(verify_subparser)
+        verify_subparser.set_defaults(SubcommandClass=verify.Verifier)
+
+        cache_subparser = subparsers.add_parser('cache', help='show or invalidate reused TaskRun results')
+        cache.ResultCache.get_parser(cache_subparser)
+        cache_subparser.set_defaults(SubcommandClass=cache.ResultCache)
+
         test_subparser = subparsers.add_parser('test', help='run all unit tests')
         test_runner.TestRunner.get_parser(test_subparser)
         test_subparser.set_defaults(SubcommandClass=test_runner.TestRunner)
@@ -65,7 +78,11 @@ class Main(object):
         return parser
 
     def run(self):
-        self.args.SubcommandClass(self.args).run()
+        try:
+            self.args.SubcommandClass(self.args).run()
+        finally:
+            if self.args.profile:
+                print >> sys.stderr, objecthandler.request_stats.format()
 
 # pip entrypoint requires a function with no arguments 
 def main():
@@ -276,6 +276,8 @@ class WorkflowRunner(object):
         parser.add_argument('workflow', metavar='WORKFLOW', help='Workflow ID or file path')
         parser.add_argument('input_values', metavar='INPUT_NAME=DATA_ID',  nargs='*', help='Data object ID or file path for inputs')
         parser.add_argument('--inputs', metavar='INPUT_FILE', help='File containing input values (JSON or YAML), an alternative to giving inputs as command line arguments')
+        parser.add_argument('--no_cache', action='store_true', help='Run every step, even if results from identical analysis already exist')
+        parser.add_argument('--no_hash_cache', action='store_true', help='Hash every input file, even if its hash was saved on an earlier upload')
         parser = add_settings_options_to_parser(parser)
         return parser
 
@@ -318,7 +320,8 @@ class WorkflowRunner(object):
         self.objecthandler = ObjectHandler(self.master_url)
 
     def _get_filehandler(self):
-        self.filehandler = FileHandler(self.master_url, logger=self.logger)
+        self.filehandler = FileHandler(self.master_url, logger=self.logger,
+                                       use_hash_cache=not self.args.no_hash_cache)
 
     def _get_workflow(self):
         workflow_from_server = self._get_workflow_from_server()
@@ -372,7 +375,8 @@ class WorkflowRunner(object):
     def _initialize_workflow_run(self):
         self.workflow_run = {
             'workflow': self.workflow,
-            'workflow_run_inputs': []
+            'workflow_run_inputs': [],
+            'use_result_cache': not self.args.no_cache
         }
 
     def _process_predefined_inputs(self):
@@ -55,7 +55,11 @@ class ShowFileHandler(AbstractShowHandler):
         self.objecthandler = objecthandler.ObjectHandler(self.master_url)
 
     def _get_files(self):
-        self.files = self.objecthandler.get_file_data_object_index(self.args.file_id)
+        if self.args.detail:
+            fields = ['_id', 'file_name', 'file_contents']
+        else:
+            fields = ['_id', 'file_name']
+        self.files = self.objecthandler.iter_file_data_object_index(self.args.file_id, fields=fields)
 
     def _show_files(self):
         for file in self.files:
@@ -100,7 +104,11 @@ class ShowWorkflowHandler(AbstractShowHandler):
         self.objecthandler = objecthandler.ObjectHandler(self.master_url)
 
     def _get_workflows(self):
-        self.workflows = self.objecthandler.get_workflow_index(self.args.workflow_id)
+        if self.args.detail:
+            fields = None
+        else:
+            fields = ['_id', 'workflow_name']
+        self.workflows = self.objecthandler.iter_workflow_index(self.args.workflow_id, fields=fields)
 
     def _show_workflows(self):
         for workflow in self.workflows:
@@ -142,7 +150,11 @@ class ShowWorkflowRunHandler(AbstractShowHandler):
         self.objecthandler = objecthandler.ObjectHandler(self.master_url)
 
     def _get_workflow_runs(self):
-        self.workflow_runs = self.objecthandler.get_workflow_run_index(self.args.workflow_run_id)
+        if self.args.detail:
+            fields = None
+        else:
+            fields = ['_id', 'workflow.workflow_name']
+        self.workflow_runs = self.objecthandler.iter_workflow_run_index(self.args.workflow_run_id, fields=fields)
 
     def _show_workflow_runs(self):
         for workflow_run in self.workflow_runs:
@@ -10,7 +10,7 @@ from loom.client.common import add_settings_options_to_parser
 from loom.client.common import read_as_json_or_yaml
 from loom.client.exceptions import *
 from loom.common import exceptions as common_exceptions
-from loom.common.filehandler import FileHandler
+from loom.common.filehandler import AbstractFileHandler, FileHandler
 from loom.common.helper import get_console_logger
 from loom.common.objecthandler import ObjectHandler
 
@@ -53,6 +53,15 @@ class FileUploader(AbstractUploader):
             '--skip_source_record',
             help='Do not prompt for source record.',
             action='store_true')
+        parser.add_argument(
+            '--jobs', '-j',
+            metavar='N', type=int,
+            help='Number of files to hash, and to transfer, at the same time. '\
+            'Defaults to %s.' % AbstractFileHandler.UPLOAD_JOBS)
+        parser.add_argument(
+            '--no_hash_cache',
+            help='Hash every file, even if its hash was saved on an earlier upload.',
+            action='store_true')
         return parser
 
     def run(self):
@@ -91,7 +100,8 @@ class FileUploader(AbstractUploader):
         return paths_minus_dirs
 
     def _get_filehandler(self):
-        self.filehandler = FileHandler(self.master_url, logger=self.logger)
+        self.filehandler = FileHandler(self.master_url, logger=self.logger,
+                                       use_hash_cache=not self.args.no_hash_cache)
 
     def _get_source_record_text(self):
         if self.args.skip_source_record:
@@ -123,7 +133,8 @@ class FileUploader(AbstractUploader):
     def _upload_files(self):
         return self.filehandler.upload_files_from_local_paths(
             self.local_paths,
-            source_record=self.source_record_text
+            source_record=self.source_record_text,
+            jobs=self.args.jobs
         )
 
 
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+if __name__ == "__main__" and __package__ is None:
+    rootdir=os.path.abspath('../..')
+    sys.path.append(rootdir)
+
+from loom.client.common import get_settings_manager_from_parsed_args
+from loom.client.common import add_settings_options_to_parser
+from loom.client.exceptions import *
+from loom.common import objecthandler
+
+
+class Verifier:
+    """Sets up and executes commands under "verify" on the main parser.
+
+    The server trusts stored ids when rendering immutable objects, unless
+    LOOM_ID_VERIFICATION_RATE is set. This runs a full scan instead, one
+    page of objects per request.
+    """
+
+    def __init__(self, args=None):
+
+        # Args may be given as an input argument for testing purposes.
+        # Otherwise get them from the parser.
+        if args is None:
+            args = self._get_args()
+        self.args = args
+        self.settings_manager = get_settings_manager_from_parsed_args(self.args)
+        self.master_url = self.settings_manager.get_server_url_for_client()
+
+    def _get_args(self):
+        parser = self.get_parser()
+        return parser.parse_args()
+
+    @classmethod
+    def get_parser(cls, parser=None):
+
+        # If called from main, use the subparser provided.
+        # Otherwise create a top-level parser here.
+        if parser is None:
+            parser = argparse.ArgumentParser(__file__)
+
+        parser = add_settings_options_to_parser(parser)
+        return parser
+
+    def run(self):
+        handler = objecthandler.ObjectHandler(self.master_url)
+        mismatch_count = 0
+        for model in handler.get_verifiable_models():
+            print 'Checking %s...' % model
+            for mismatch in handler.verify_ids(model):
+                mismatch_count += 1
+                print 'Mismatch: %s@%s hashes to %s' % (
+                    mismatch['model'], mismatch['_id'], mismatch['calculated_id'])
+        print 'Found %s objects whose _id does not match their contents.' \
+            % mismatch_count
+
+
+if __name__=='__main__':
+    response = Verifier().run()
@@ -25,6 +25,9 @@ class WrongNumberOfFileNamesError(Error):
 class FileAlreadyExistsError(Error):
     pass
 
+class NoStorageLocationError(Error):
+    pass
+
 class NoFilesMatchError(Error):
     pass
 
@@ -39,3 +42,15 @@ class IdMatchedTooManyFileDataObjectsError(Error):
     
 class ValidationError(Error):
     pass
+
+class UnrecognizedHashFunctionError(Error):
+    pass
+
+class ObjectStoreError(Error):
+    pass
+
+class HashMismatchError(Error):
+    pass
+
+class TaskRunStoppedError(Error):
+    pass
@@ -2,19 +2,41 @@
 
 import abc
 from copy import copy
+import ctypes
+import ctypes.util
 import datetime
 import errno
+import fcntl
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
 import subprocess
-
-import gcloud.storage
-import requests
-
-from loom.common import md5calc
+import sys
+import threading
+import time
+import uuid
+
+from loom.common import gcs
+from loom.common import hashes
+from loom.common.hashcache import HashCache
 from loom.common.exceptions import *
 from loom.common.objecthandler import ObjectHandler
 
+# ioctl request that clones a file's extents on btrfs and XFS
+FICLONE = 0x40049409
+
+# sendfile(2) copies between files in the kernel on Linux. Elsewhere it only
+# writes to sockets, and copies fall back to reading and writing.
+_sendfile = None
+if sys.platform.startswith('linux'):
+    try:
+        _sendfile = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).sendfile
+        _sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+        _sendfile.restype = ctypes.c_ssize_t
+    except (OSError, AttributeError):
+        _sendfile = None
+SENDFILE_SIZE = 1024*1024*1024
+
 # Google Storage JSON API imports
 from apiclient.http import MediaIoBaseDownload
 from oauth2client.client import GoogleCredentials
@@ -36,20 +58,73 @@ def FileHandler(master_url, *args, **kwargs):
         raise UnrecognizedFileServerTypeError(
             'Unrecognized file server type: %s' % settings['FILE_SERVER_TYPE'])
 
+def copy_file(source_file, destination_file):
+    """Copy the rest of source_file to destination_file. Both are open
+    files that have not been read from or written to through Python yet.
+    """
+    if _sendfile is not None:
+        while True:
+            sent = _sendfile(destination_file.fileno(), source_file.fileno(),
+                             None, SENDFILE_SIZE)
+            if sent > 0:
+                continue
+            if sent == 0:
+                return
+            error = ctypes.get_errno()
+            if error == errno.EINTR:
+                continue
+            if error in (errno.EINVAL, errno.ENOSYS) and destination_file.tell() == 0:
+                # Not supported for these files. Nothing was copied.
+                break
+            raise OSError(error, os.strerror(error))
+    shutil.copyfileobj(source_file, destination_file, hashes.READ_SIZE)
+
 def _get_settings(master_url):
-    url = master_url + '/api/filehandlerinfo/'
     try:
-        response = requests.get(url)
-    except requests.exceptions.ConnectionError:
+        return ObjectHandler(master_url).get_filehandler_info()
+    except ServerConnectionError:
         raise ServerConnectionError(
             'No response from server at %s. Do you need to run "loom server start"?' \
             % master_url)
-    try:
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        raise BadResponseError("%s\n%s" % (e.message, response.text))
-    settings = response.json()['filehandlerinfo']
-    return settings
+
+
+class UploadProgress(object):
+    """Thread-safe count of files and bytes transferred, logged as each
+    transfer finishes.
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.expected_files = 0
+        self.expected_bytes = 0
+        self.transferred_files = 0
+        self.transferred_bytes = 0
+
+    def expect(self, local_path):
+        with self.lock:
+            self.expected_files += 1
+            self.expected_bytes += os.path.getsize(local_path)
+
+    def add(self, local_path):
+        with self.lock:
+            self.transferred_files += 1
+            self.transferred_bytes += os.path.getsize(local_path)
+            message = '...uploaded %s (%s of %s files, %s)' % (
+                local_path, self.transferred_files, self.expected_files,
+                self._format_throughput())
+        self.log(message)
+
+    def finish(self):
+        if self.transferred_files:
+            self.log('Uploaded %s files, %s' % (
+                self.transferred_files, self._format_throughput()))
+
+    def _format_throughput(self):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        megabytes = self.transferred_bytes / (1024.0 * 1024)
+        return '%.1f MB at %.1f MB/s' % (megabytes, megabytes / elapsed)
 
 
 class AbstractFileHandler:
@@ -59,10 +134,30 @@ class AbstractFileHandler:
     """
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, master_url, settings, logger=None):
+    # Number of files registered with the server per request
+    UPLOAD_BATCH_SIZE = 500
+    # Default number of files hashed, and transferred, at the same time
+    UPLOAD_JOBS = 4
+    # Default number of files downloaded at the same time
+    DOWNLOAD_JOBS = 4
+    # Values of bind_mount for stage(). Mount if nothing else avoids a copy,
+    # or mount whenever the file can be reached in place.
+    BIND_MOUNT_FALLBACK = 'fallback'
+    BIND_MOUNT_FIRST = 'first'
+
+    def __init__(self, master_url, settings, logger=None, use_hash_cache=True,
+                 node_cache=None):
+        """node_cache is a NodeCache that downloads are staged through, so
+        that files shared by tasks on a worker node are downloaded once.
+        """
         self.objecthandler = ObjectHandler(master_url)
         self.settings = settings
         self.logger = logger
+        if use_hash_cache:
+            self.hash_cache = HashCache()
+        else:
+            self.hash_cache = None
+        self.node_cache = node_cache
 
     @abc.abstractmethod
     def upload(self, local_path, destination_location):
@@ -93,15 +188,86 @@ class AbstractFileHandler:
             "%s_%s_%s" % (timestamp, file_id[0:10], file_object['file_name']),
         )
 
-    def download_by_file_id(self, file_id, local_path):
+    def stage(self, source_location, local_path, bind_mount=None, cache_holder=None):
+        """Make the file at source_location available at local_path. Returns
+        {'strategy': ..., 'bytes_copied': ..., 'source_path': ...}. Handlers
+        that can reach the file directly override this to avoid copying it.
+
+        bind_mount is None, BIND_MOUNT_FALLBACK or BIND_MOUNT_FIRST, and says
+        whether the file may instead be left in place for the caller to
+        mount into a container.
+
+        With a node cache, the file is downloaded into the cache and held
+        there for cache_holder, e.g. a TaskRun ID, until the holder releases
+        it with node_cache.release().
+        """
+        if self.node_cache is not None and cache_holder is not None:
+            return self._stage_from_node_cache(
+                source_location, local_path, bind_mount, cache_holder)
+        self.download(source_location, local_path)
+        return {
+            'strategy': 'download',
+            'bytes_copied': os.path.getsize(local_path),
+            'source_path': None,
+        }
+
+    def _stage_from_node_cache(self, source_location, local_path, bind_mount, cache_holder):
+        (cache_path, hit) = self.node_cache.acquire(
+            source_location['file_contents'],
+            lambda path: self.download(source_location, path),
+            cache_holder)
+        if hit:
+            bytes_copied = 0
+        else:
+            bytes_copied = os.path.getsize(cache_path)
+        result = {'bytes_copied': bytes_copied,
+                  'source_path': cache_path,
+                  'cache_hit': hit}
+        # Cache entries are shared by every task on the node, and tasks can
+        # write to their working dir as root, so entries are never
+        # hardlinked into it. Mounts are read-only, and clones and copies
+        # are separate files.
+        if bind_mount == self.BIND_MOUNT_FIRST:
+            result['strategy'] = 'bind_mount'
+            return result
+        try:
+            self._reflink(cache_path, local_path)
+            result['strategy'] = 'reflink'
+            return result
+        except (OSError, IOError):
+            pass
+        if bind_mount == self.BIND_MOUNT_FALLBACK:
+            result['strategy'] = 'bind_mount'
+            return result
+        result['strategy'] = 'copy'
+        result['bytes_copied'] += self._copy(cache_path, local_path)
+        return result
+
+    def _reflink(self, source_path, local_path):
+        with open(source_path, 'rb') as source_file:
+            with open(local_path, 'wb') as local_file:
+                try:
+                    fcntl.ioctl(local_file.fileno(), FICLONE, source_file.fileno())
+                except:
+                    os.remove(local_path)
+                    raise
+
+    def _copy(self, source_path, local_path):
+        with open(source_path, 'rb') as source_file:
+            with open(local_path, 'wb') as local_file:
+                copy_file(source_file, local_file)
+        return os.path.getsize(local_path)
+
+    def download_by_file_id(self, file_id, local_path, bind_mount=None, cache_holder=None):
         storage_locations = self.objecthandler.get_file_storage_locations_by_file(file_id)
-        # Attempt to download from each location
-        for location in storage_locations:
-            if os.path.exists(local_path):
-                raise FileAlreadyExistsError('File "%s" already exists' % local_path)
-            self.download(location, local_path)
-            # TODO handle download failures
-            break
+        if not storage_locations:
+            raise NoStorageLocationError(
+                'File %s has no storage location to download from' % file_id)
+        if os.path.exists(local_path):
+            raise FileAlreadyExistsError('File "%s" already exists' % local_path)
+        # TODO handle download failures by trying the other locations
+        return self.stage(storage_locations[0], local_path, bind_mount=bind_mount,
+                          cache_holder=cache_holder)
     
     def _get_step_output_path(self, local_path):
         """Step outputs are placed in directories of the same name as the
@@ -122,32 +288,179 @@ class AbstractFileHandler:
         )
 
     @classmethod
-    def create_file_data_object_from_local_path(cls, file_path):
+    def create_file_data_object_from_local_path(cls, file_path, hash_function='md5', hash_value=None):
+        if hash_value is None:
+            hash_value = hashes.calculate_hashes(file_path, [hash_function])[hash_function]
         file_data_object = {
             'file_contents': {
-                'hash_value': md5calc.calculate_md5sum(file_path),
-                'hash_function': 'md5',
+                'hash_value': hash_value,
+                'hash_function': hash_function,
             },
             'file_name': os.path.basename(file_path)
         }
         return file_data_object
 
+    def _get_hash_functions(self):
+        """The server's HASH_FUNCTION identifies FileContents. Hashes from
+        ALIAS_HASH_FUNCTIONS are calculated in the same pass and recorded as
+        aliases, so that files stored under an older hash function are still
+        found.
+        """
+        hash_function = self.settings.get('HASH_FUNCTION') or 'md5'
+        alias_hash_functions = [alias for alias in self.settings.get('ALIAS_HASH_FUNCTIONS') or []
+                                if alias != hash_function]
+        return [hash_function] + alias_hash_functions
+
+    def _create_staged_file(self, local_path, hash_values, staged_path=None):
+        """Returns (file_object, aliases, staged_path)"""
+        hash_functions = self._get_hash_functions()
+        file_object = self.create_file_data_object_from_local_path(
+            local_path, hash_function=hash_functions[0],
+            hash_value=hash_values[hash_functions[0]])
+        aliases = [{'hash_function': hash_function, 'hash_value': hash_values[hash_function]}
+                   for hash_function in hash_functions[1:]]
+        return (file_object, aliases, staged_path)
+
+    def _stage_file(self, local_path):
+        """Hash a file before it is registered with the server. Returns the
+        file object, its aliases, and a staged copy of the file, or None if
+        the handler does not stage files. Subclasses that can write to the
+        file server cheaply override this to copy the file while hashing it.
+        """
+        (file_stat, hash_values) = self._get_cached_hashes(local_path)
+        if hash_values is None:
+            hash_values = hashes.calculate_hashes(local_path, self._get_hash_functions())
+            self._cache_hashes(local_path, file_stat, hash_values)
+        return self._create_staged_file(local_path, hash_values)
+
+    def _get_cached_hashes(self, local_path):
+        """Returns the file's stat key for the hash cache, and its cached
+        hashes or None.
+        """
+        if self.hash_cache is None:
+            return (None, None)
+        file_stat = HashCache.stat(local_path)
+        return (file_stat, self.hash_cache.get(file_stat, self._get_hash_functions()))
+
+    def _cache_hashes(self, local_path, file_stat, hash_values):
+        if self.hash_cache is None:
+            return
+        # Skip files that changed while they were read
+        if HashCache.stat(local_path) == file_stat:
+            self.hash_cache.set(file_stat, hash_values)
+
+    def _upload_staged(self, local_path, staged_path, destination_location):
+        self.upload(local_path, destination_location)
+
+    def _discard_staged(self, staged_path):
+        pass
+
     def _log(self, message):
         if not self.logger:
             return
         self.logger.info(message)
     
-    def upload_files_from_local_paths(self, local_paths, source_record=None, source_directory=None):
+    def upload_files_from_local_paths(self, local_paths, source_record=None, source_directory=None, jobs=None):
+        """Upload files, create FileDataObjects and StorageLocations.
+
+        Files are hashed and transferred by separate pools of 'jobs' threads.
+        Each batch of files is registered with the server as soon as it is
+        hashed, and its transfers start while later files are still being
+        hashed. Batches start small so that transfers begin quickly, and grow
+        up to UPLOAD_BATCH_SIZE to keep the number of requests low.
+        """
+        if jobs is None:
+            jobs = self.UPLOAD_JOBS
         upload_request_time = self.objecthandler.get_server_time()
-        file_objects = []
-        destination_locations = []
-        # Upload files, create FileDataObjects and StorageLocations
-        for local_path in local_paths:
-            file_objects.append(self.upload_file_from_local_path(local_path, source_directory=source_directory, upload_request_time=upload_request_time))
+        local_paths = [self._add_directory(source_directory, local_path)
+                       for local_path in local_paths]
+        progress = UploadProgress(log=self._log)
+        hash_pool = ThreadPool(jobs)
+        transfer_pool = ThreadPool(jobs)
+        # Staged copies that have not been moved into place, by position in
+        # local_paths, since a path may be listed more than once
+        staged_paths = {}
+        try:
+            staged_files = hash_pool.imap(self._stage_file, local_paths)
+            file_objects = []
+            transfers = []
+            uploaded_contents = set()
+            batch_size = jobs
+            i = 0
+            while i < len(local_paths):
+                batch_paths = local_paths[i:i+batch_size]
+                batch_objects = []
+                batch_aliases = []
+                for j in range(len(batch_paths)):
+                    (file_object, aliases, staged_path) = staged_files.next()
+                    batch_objects.append(file_object)
+                    batch_aliases.append(aliases)
+                    if staged_path is not None:
+                        staged_paths[i+j] = staged_path
+                batch_objects = self._register_files(batch_objects, batch_aliases)
+                file_objects.extend(batch_objects)
+                for (j, destination_location) in self._get_uploads_needed(
+                        batch_objects, upload_request_time, uploaded_contents):
+                    local_path = batch_paths[j]
+                    progress.expect(local_path)
+                    transfers.append((destination_location, transfer_pool.apply_async(
+                        self._upload_with_progress,
+                        (local_path, staged_paths.pop(i+j, None), destination_location, progress))))
+                i += len(batch_paths)
+                batch_size = min(batch_size*2, self.UPLOAD_BATCH_SIZE)
+            for (destination_location, result) in transfers:
+                # Raises the error from a failed transfer
+                result.get()
+            destination_locations = [destination_location for (destination_location, result)
+                                     in transfers]
+        finally:
+            hash_pool.close()
+            transfer_pool.close()
+            hash_pool.join()
+            transfer_pool.join()
+            # Copies of files whose contents were already stored
+            for staged_path in staged_paths.values():
+                self._discard_staged(staged_path)
+        for j in range(0, len(destination_locations), self.UPLOAD_BATCH_SIZE):
+            self.objecthandler.post_file_storage_locations(
+                destination_locations[j:j+self.UPLOAD_BATCH_SIZE])
+        progress.finish()
         # Create source_record if one exists
         self._create_source_record(file_objects, source_record=source_record)
         return file_objects
-            
+
+    def _register_files(self, file_objects, aliases_by_file):
+        file_objects = self.objecthandler.post_data_objects(file_objects)
+        for file_object in file_objects:
+            self._log("Created file %s@%s" % (file_object['file_name'], file_object['_id']))
+        file_contents_aliases = [{'file_contents': file_object['file_contents'], 'alias': alias}
+                                 for (file_object, aliases) in zip(file_objects, aliases_by_file)
+                                 for alias in aliases]
+        if file_contents_aliases:
+            self.objecthandler.post_file_contents_aliases(file_contents_aliases)
+        return file_objects
+
+    def _get_uploads_needed(self, file_objects, upload_request_time, uploaded_contents):
+        """Returns (index in file_objects, destination_location) for files
+        whose contents are not already stored.
+        """
+        storage_locations = self.objecthandler.get_file_storage_locations_by_files(
+            [file_object['_id'] for file_object in file_objects])
+        uploads = []
+        for (j, file_object) in enumerate(file_objects):
+            # Files with the same contents only need to be stored once
+            contents_id = file_object['file_contents']['_id']
+            if storage_locations[file_object['_id']] or contents_id in uploaded_contents:
+                continue
+            uploaded_contents.add(contents_id)
+            uploads.append((j, self.get_import_location(file_object, upload_request_time)))
+        return uploads
+
+    def _upload_with_progress(self, local_path, staged_path, destination_location, progress):
+        self._log("Uploading %s ..." % local_path)
+        self._upload_staged(local_path, staged_path, destination_location)
+        progress.add(local_path)
+
     def upload_file_from_local_path(self, local_path, source_directory=None, source_record=None, upload_request_time=None):
         """Upload files, create FileDataObjects and StorageLocations
         """
@@ -156,18 +469,22 @@ class AbstractFileHandler:
         if upload_request_time is None:
             upload_request_time = self.objecthandler.get_server_time()
         self._log("Uploading %s ..." % local_path)
-        file_object = self.create_file_data_object_from_local_path(local_path)
-        file_object = self.objecthandler.post_data_object(file_object)
-
-        # Create source_record if one exists
-        self._create_source_record([file_object], source_record=source_record)
-        self._log("Created file %s@%s" % (file_object['file_name'], file_object['_id']))
-
-        storage_locations = self.objecthandler.get_file_storage_locations_by_file(file_object['_id'])
-        if len(storage_locations) == 0:
-            destination_location = self.get_import_location(file_object, upload_request_time)
-            self.upload(local_path, destination_location)
-            self.objecthandler.post_file_storage_location(destination_location)
+        (file_object, aliases, staged_path) = self._stage_file(local_path)
+        try:
+            file_object = self._register_files([file_object], [aliases])[0]
+
+            # Create source_record if one exists
+            self._create_source_record([file_object], source_record=source_record)
+
+            storage_locations = self.objecthandler.get_file_storage_locations_by_file(file_object['_id'])
+            if len(storage_locations) == 0:
+                destination_location = self.get_import_location(file_object, upload_request_time)
+                self._upload_staged(local_path, staged_path, destination_location)
+                staged_path = None
+                self.objecthandler.post_file_storage_location(destination_location)
+        finally:
+            if staged_path is not None:
+                self._discard_staged(staged_path)
 
         return file_object
 
@@ -185,31 +502,53 @@ class AbstractFileHandler:
                  'source_description': source_record}
             )
 
-    def download_files(self, file_ids, local_names=None, target_directory=None):
+    def download_files(self, file_ids, local_names=None, target_directory=None,
+                       bind_mount=None, jobs=None, cache_holder=None):
+        """Download files concurrently. Returns a staging result from stage()
+        for each file, with its 'local_path' added.
+
+        With bind_mount, a file may be left in place to be mounted read-only
+        into a container, and nothing is written to local_path. With a node
+        cache, files are held in the cache for cache_holder.
+        """
         if local_names is None:
             local_names = [None] * len(file_ids)
         if len(local_names) != len(file_ids):
             raise WrongNumberOfFileNamesError('Cannot process %s file_names for %s files. '\
                                               'The lengths must match.' % (len(local_names), len(file_ids)))
-
-        for (file_id, local_name) in zip(file_ids, local_names):
-            file = self.objecthandler.get_file_data_object_index(file_id, max=1, min=1)[0]
-            # If no local name specified, use the file name from the object.
-            if local_name is None:
-                local_name = file['file_name']
-                # Don't overwrite anyone's root directory based on a file path from the server.
-                self._verify_not_absolute(local_name)
-            if target_directory is not None:
-                # We should never use target directory along with absolute paths.
-                if self._is_absolute_path(local_name):
-                    raise AbsolutePathInFileNameError('Cannot set download directory since the file name "%s" '\
-                                                      'uses an absolute path.' % local_name)
-                local_path = os.path.join(os.path.expanduser(target_directory), local_name)
-            else:
-                local_path = local_name
-            self._log('Downloading file %s@%s to %s...' % (file['file_name'], file['_id'], local_path))
-            self.download_by_file_id(file['_id'], local_path)
-            self._log('...complete.')
+        if jobs is None:
+            jobs = self.DOWNLOAD_JOBS
+        pool = ThreadPool(max(1, min(jobs, len(file_ids))))
+        try:
+            return pool.map(
+                lambda (file_id, local_name): self._download_file(
+                    file_id, local_name, target_directory, bind_mount, cache_holder),
+                zip(file_ids, local_names))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _download_file(self, file_id, local_name, target_directory, bind_mount, cache_holder):
+        file = self.objecthandler.get_file_data_object_index(file_id, max=1, min=1)[0]
+        # If no local name specified, use the file name from the object.
+        if local_name is None:
+            local_name = file['file_name']
+            # Don't overwrite anyone's root directory based on a file path from the server.
+            self._verify_not_absolute(local_name)
+        if target_directory is not None:
+            # We should never use target directory along with absolute paths.
+            if self._is_absolute_path(local_name):
+                raise AbsolutePathInFileNameError('Cannot set download directory since the file name "%s" '\
+                                                  'uses an absolute path.' % local_name)
+            local_path = os.path.join(os.path.expanduser(target_directory), local_name)
+        else:
+            local_path = local_name
+        self._log('Downloading file %s@%s to %s...' % (file['file_name'], file['_id'], local_path))
+        result = self.download_by_file_id(file['_id'], local_path, bind_mount=bind_mount,
+                                          cache_holder=cache_holder)
+        result['local_path'] = local_path
+        self._log('...complete (%s, %s bytes copied).' % (result['strategy'], result['bytes_copied']))
+        return result
 
     def _verify_not_absolute(self, file_name):
         if self._is_absolute_path(file_name):
@@ -244,7 +583,24 @@ class AbstractPosixPathFileHandler(AbstractFileHandler):
 
 class LocalFileHandler(AbstractPosixPathFileHandler):
     """Subclass of FileHandler that uses cp or ln to 'copy' files.
+
+    Imports are copied into a staging file in IMPORT_DIR while they are
+    hashed, so the source is read only once. The staging file is renamed
+    into place once the server has assigned the file an ID, or removed if
+    its contents are already stored.
     """
+
+    STAGING_PREFIX = '.loom-staging-'
+
+    def _makedirs(self, path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                pass
+            else:
+                raise e
+
     def upload(self, local_path, destination_location):
         """For imports, create imports directory and copy file.
         For step outputs, don't need to do anything, because the working 
@@ -252,46 +608,128 @@ class LocalFileHandler(AbstractPosixPathFileHandler):
         """
         destination_path = destination_location['file_path']
         if local_path != destination_path:
+            destination_dir = os.path.dirname(destination_path)
+            self._makedirs(destination_dir)
+            (staged_path, staged_file) = self._create_staging_file(destination_dir)
             try:
-                os.makedirs(os.path.dirname(destination_path))
-            except OSError as e:
-                if e.errno == errno.EEXIST:
-                    pass
-                else:
-                    raise e
-            shutil.copyfile(local_path, destination_path)
+                with staged_file:
+                    with open(local_path, 'rb') as source_file:
+                        copy_file(source_file, staged_file)
+            except:
+                os.remove(staged_path)
+                raise
+            os.rename(staged_path, destination_path)
         return
 
+    def _stage_file(self, local_path):
+        """Files whose hashes are cached are copied only if the server needs
+        them. Others are copied into a staging file while they are hashed.
+        """
+        (file_stat, hash_values) = self._get_cached_hashes(local_path)
+        if hash_values is not None:
+            return self._create_staged_file(local_path, hash_values)
+        staging_dir = os.path.join(self.settings['FILE_ROOT'], self.settings['IMPORT_DIR'])
+        self._makedirs(staging_dir)
+        (staged_path, staged_file) = self._create_staging_file(staging_dir)
+        try:
+            with staged_file:
+                hash_values = hashes.copy_and_calculate_hashes(
+                    local_path, staged_file, self._get_hash_functions())
+        except:
+            os.remove(staged_path)
+            raise
+        self._cache_hashes(local_path, file_stat, hash_values)
+        return self._create_staged_file(local_path, hash_values, staged_path=staged_path)
+
+    def _upload_staged(self, local_path, staged_path, destination_location):
+        if staged_path is None:
+            return self.upload(local_path, destination_location)
+        destination_path = destination_location['file_path']
+        self._makedirs(os.path.dirname(destination_path))
+        # Atomic, since the staging file is on the same filesystem
+        os.rename(staged_path, destination_path)
+
+    def _discard_staged(self, staged_path):
+        os.remove(staged_path)
+
+    def _create_staging_file(self, directory):
+        """Returns (path, file). The file gets the mode a plain copy would,
+        0666 less the umask, so imports stay readable by other users.
+        """
+        staged_path = os.path.join(directory, self.STAGING_PREFIX + uuid.uuid4().hex)
+        fd = os.open(staged_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+        return (staged_path, os.fdopen(fd, 'wb'))
+
     def download(self, source_location, local_path):
-        """Save space by hardlinking file into the working dir instead of 
-        copying. However, won't work if the two locations are on different 
-        filesystems.
+        self.stage(source_location, local_path)
+
+    def stage(self, source_location, local_path, bind_mount=None, cache_holder=None):
+        """Save space by trying, in order, to clone the file into the
+        working dir on a copy-on-write filesystem, or to leave it in place
+        to be bind-mounted read-only, and only then copying it. Clones fail
+        if the two locations are on different filesystems. The file is never
+        hardlinked, since tasks can rewrite files in their working dir and
+        would change the stored file. With BIND_MOUNT_FIRST the file is
+        always left in place. The file is already on this node, so the node
+        cache is not used.
         """
-        cmd = ['ln', source_location['file_path'], local_path]
-        subprocess.check_call(cmd)
+        source_path = source_location['file_path']
+        if bind_mount == self.BIND_MOUNT_FIRST:
+            return {'strategy': 'bind_mount', 'bytes_copied': 0, 'source_path': source_path}
+        try:
+            self._reflink(source_path, local_path)
+            return {'strategy': 'reflink', 'bytes_copied': 0, 'source_path': source_path}
+        except (OSError, IOError):
+            pass
+        if bind_mount == self.BIND_MOUNT_FALLBACK:
+            # Nothing is written. The caller mounts source_path at local_path.
+            return {'strategy': 'bind_mount', 'bytes_copied': 0, 'source_path': source_path}
+        return {'strategy': 'copy',
+                'bytes_copied': self._copy(source_path, local_path),
+                'source_path': source_path}
 
 class RemoteFileHandler(AbstractPosixPathFileHandler):
-    """Subclass of FileHandler that uses ssh and scp to copy files."""
+    """Subclass of FileHandler that uses ssh and scp to copy files.
+
+    Each file is copied by its own scp, but they all share one SSH
+    connection per host, so only the first pays for the handshake.
+    """
+
+    # Shared connections close this many seconds after they were last used
+    SSH_CONTROL_PERSIST_SECONDS = 60
+
+    def _get_ssh_options(self):
+        # Not in /tmp, where another user could create the directory first
+        control_dir = os.path.expanduser(os.path.join('~', '.ssh', 'loom-control'))
+        try:
+            os.makedirs(control_dir, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        return ['-o', 'ControlMaster=auto',
+                '-o', 'ControlPath=%s' % os.path.join(control_dir, '%r@%h:%p'),
+                '-o', 'ControlPersist=%s' % self.SSH_CONTROL_PERSIST_SECONDS]
 
     def upload(self, local_path, destination_location):
         destination_path = destination_location['file_path']
+        ssh_options = self._get_ssh_options()
         subprocess.check_call(
-            ['ssh',
-             self.fileserver,
+            ['ssh'] + ssh_options +
+            [self.fileserver,
              'mkdir',
              '-p',
              os.path.dirname(destination_path)]
         )
         subprocess.check_call(
-            ['scp',
-             local_path,
+            ['scp'] + ssh_options +
+            [local_path,
              ':'.join([self.fileserver, destination_path])]
         )
 
     def download(self, source_location, local_path):
         subprocess.check_call(
-            ['scp',
-             ':'.join(
+            ['scp'] + self._get_ssh_options() +
+            [':'.join(
                  [source_location['host_url'],
                   source_location['file_path']]
              ),
@@ -344,15 +782,37 @@ class ElasticlusterFileHandler(AbstractPosixPathFileHandler):
 
 
 class GoogleCloudFileHandler(AbstractFileHandler):
-    """Subclass of FileHandler that uses the gcloud module to copy files to and from Google Storage."""
+    """Subclass of FileHandler that uses the gcloud module to copy files to and from Google Storage.
+    Large files are transferred in parallel parts, and resume after an interruption.
+    """
+
+    def __init__(self, master_url, settings, object_store=None, **kwargs):
+        """object_store replaces Google Storage, e.g. with a
+        gcs.FakeObjectStore in tests.
+        """
+        AbstractFileHandler.__init__(self, master_url, settings, **kwargs)
+        self.object_store = object_store
+
+    def _get_object_store(self, location):
+        if self.object_store is not None:
+            return self.object_store
+        return gcs.GoogleCloudStore(location['project_id'])
 
     def upload(self, local_path, destination_location):
-        blob = self._get_blob(destination_location)
-        blob.upload_from_filename(local_path)
+        gcs.upload_file(
+            self._get_object_store(destination_location),
+            local_path,
+            destination_location['bucket_id'],
+            destination_location['blob_path'],
+            part_key=destination_location['file_contents']['hash_value'])
 
     def download(self, source_location, local_path):
-        blob = self._get_blob(source_location)
-        blob.download_to_filename(local_path)
+        gcs.download_file(
+            self._get_object_store(source_location),
+            source_location['bucket_id'],
+            source_location['blob_path'],
+            local_path,
+            file_contents=source_location['file_contents'])
 
     def download_with_json_api(self, destination_location, local_path):
         """Download using Google Storage JSON API instead of gcloud-python."""
@@ -362,25 +822,11 @@ class GoogleCloudFileHandler(AbstractFileHandler):
         service = apiclient.discovery.build('storage', 'v1', credentials=credentials)
         file_request = service.objects().get_media(bucket=bucket_id, object=blob_path)
         with open(local_path, 'w') as local_file:
-            downloader = MediaIoBaseDownload(local_file, file_request, chunksize=1024*1024)
+            downloader = MediaIoBaseDownload(local_file, file_request, chunksize=gcs.PART_SIZE)
             done = False
             while not done:
                 status, done = downloader.next_chunk()
-                if status:
-                    print 'Download %d%%.' % int(status.progress() * 100)
-                print 'Download Complete!'
-
-    def _get_blob(self, location):
-        """Instantiate, configure, and return a gcloud blob."""
-        blob_path = location['blob_path']
-        project_id = location['project_id']
-        bucket_id = location['bucket_id']
-        client = gcloud.storage.client.Client(project_id)
-        bucket = client.get_bucket(bucket_id)
-        blob = bucket.get_blob(blob_path)
-        if blob is None:
-            blob = gcloud.storage.blob.Blob(blob_path, bucket)
-        return blob
+        self._log('Download complete.')
 
     def get_step_output_location(self, local_path, file_object=None):
         if file_object is None:
@@ -0,0 +1,389 @@
+"""Chunked, parallel and resumable transfers to and from Google Storage,
+through GoogleCloudStore or, for tests without a network, FakeObjectStore.
+"""
+
+import errno
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import Queue
+import tempfile
+import threading
+import time
+import urllib
+
+import gcloud.exceptions
+import gcloud.storage
+
+from loom.common import hashes
+from loom.common.exceptions import HashMismatchError, ObjectStoreError
+
+
+# Files larger than this are transferred in parts
+PARALLEL_THRESHOLD = 64*1024*1024
+PART_SIZE = 64*1024*1024
+# Google Storage limits on compose requests and composite objects
+MAX_COMPOSE_SOURCES = 32
+MAX_COMPONENTS = 1024
+TRANSFER_JOBS = 8
+
+
+class StorageClientPool(object):
+    """Reusable storage clients, by project. A client's connection is not
+    thread-safe, so each transfer thread borrows one for its request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle_clients = {}
+
+    def _get_queue(self, project_id):
+        with self.lock:
+            return self.idle_clients.setdefault(project_id, Queue.Queue())
+
+    def get(self, project_id):
+        try:
+            return self._get_queue(project_id).get_nowait()
+        except Queue.Empty:
+            return gcloud.storage.client.Client(project_id)
+
+    def put(self, project_id, client):
+        self._get_queue(project_id).put(client)
+
+
+_client_pool = StorageClientPool()
+
+
+class GoogleCloudStore(object):
+
+    def __init__(self, project_id, client_pool=None):
+        if client_pool is None:
+            client_pool = _client_pool
+        self.project_id = project_id
+        self.client_pool = client_pool
+
+    def _call(self, function):
+        client = self.client_pool.get(self.project_id)
+        try:
+            return function(client)
+        finally:
+            self.client_pool.put(self.project_id, client)
+
+    def get_size(self, bucket_id, blob_path):
+        """Returns the size of the object, or None if it does not exist"""
+        info = self.get_info(bucket_id, blob_path)
+        if info is None:
+            return None
+        return info['size']
+
+    def get_info(self, bucket_id, blob_path):
+        """Returns {'size': ..., 'generation': ...} for the object, or None
+        if it does not exist. The generation changes whenever the object is
+        replaced.
+        """
+        def get_info(client):
+            blob = client.bucket(bucket_id).get_blob(blob_path, client=client)
+            if blob is None:
+                return None
+            return {'size': blob.size, 'generation': blob.generation}
+        return self._call(get_info)
+
+    def upload_part(self, bucket_id, blob_path, local_path, offset, size):
+        def upload_part(client):
+            blob = gcloud.storage.blob.Blob(blob_path, client.bucket(bucket_id))
+            with open(local_path, 'rb') as f:
+                f.seek(offset)
+                blob.upload_from_file(f, size=size, client=client)
+        self._call(upload_part)
+
+    def compose(self, bucket_id, source_paths, blob_path):
+        def compose(client):
+            client.connection.api_request(
+                method='POST',
+                path='/b/%s/o/%s/compose' % (bucket_id, urllib.quote(blob_path, safe='')),
+                data={'sourceObjects': [{'name': path} for path in source_paths],
+                      'destination': {'contentType': 'application/octet-stream'}})
+        self._call(compose)
+
+    def delete(self, bucket_id, blob_path):
+        def delete(client):
+            try:
+                client.bucket(bucket_id).delete_blob(blob_path, client=client)
+            except gcloud.exceptions.NotFound:
+                pass
+        self._call(delete)
+
+    def download_range(self, bucket_id, blob_path, start, end):
+        """Returns bytes start to end-1 of the object"""
+        def download_range(client):
+            blob = client.bucket(bucket_id).get_blob(blob_path, client=client)
+            if blob is None:
+                raise ObjectStoreError('Object gs://%s/%s not found' % (bucket_id, blob_path))
+            (response, content) = client.connection.http.request(
+                blob.media_link, 'GET',
+                headers={'Range': 'bytes=%d-%d' % (start, end-1)})
+            if response.status not in (200, 206):
+                raise ObjectStoreError('Failed to download gs://%s/%s: %s %s'
+                                       % (bucket_id, blob_path, response.status, content))
+            return content
+        return self._call(download_range)
+
+
+class FakeObjectStore(object):
+    """An object store in a local directory, with the interface of
+    GoogleCloudStore. latency_seconds is added to each request, to model
+    round trips. Requests and bytes sent and received are counted.
+    """
+
+    def __init__(self, root, latency_seconds=0):
+        self.root = root
+        self.latency_seconds = latency_seconds
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+
+    def _request(self, bytes_uploaded=0, bytes_downloaded=0):
+        with self.lock:
+            self.request_count += 1
+            self.bytes_uploaded += bytes_uploaded
+            self.bytes_downloaded += bytes_downloaded
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def _get_path(self, bucket_id, blob_path):
+        return os.path.join(self.root, bucket_id, blob_path)
+
+    def _write(self, bucket_id, blob_path, chunks):
+        # Objects are replaced atomically, as in Google Storage
+        path = self._get_path(bucket_id, blob_path)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.rename(tmp_path, path)
+
+    def get_size(self, bucket_id, blob_path):
+        info = self.get_info(bucket_id, blob_path)
+        if info is None:
+            return None
+        return info['size']
+
+    def get_info(self, bucket_id, blob_path):
+        self._request()
+        path = self._get_path(bucket_id, blob_path)
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        # Objects are replaced by renaming a new file into place
+        return {'size': stat.st_size,
+                'generation': '%s-%r' % (stat.st_ino, stat.st_mtime)}
+
+    def upload_part(self, bucket_id, blob_path, local_path, offset, size):
+        self._request(bytes_uploaded=size)
+        with open(local_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(size)
+        self._write(bucket_id, blob_path, [data])
+
+    def compose(self, bucket_id, source_paths, blob_path):
+        self._request()
+        if len(source_paths) > MAX_COMPOSE_SOURCES:
+            raise ObjectStoreError('Cannot compose more than %s objects' % MAX_COMPOSE_SOURCES)
+        chunks = []
+        for source_path in source_paths:
+            with open(self._get_path(bucket_id, source_path), 'rb') as f:
+                chunks.append(f.read())
+        self._write(bucket_id, blob_path, chunks)
+
+    def delete(self, bucket_id, blob_path):
+        self._request()
+        path = self._get_path(bucket_id, blob_path)
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        # Google Storage has no directories, so remove any left empty
+        bucket_path = self._get_path(bucket_id, '')
+        path = os.path.dirname(path)
+        while path.startswith(bucket_path) and path != bucket_path.rstrip('/'):
+            try:
+                os.rmdir(path)
+            except OSError:
+                break
+            path = os.path.dirname(path)
+
+    def download_range(self, bucket_id, blob_path, start, end):
+        path = self._get_path(bucket_id, blob_path)
+        if not os.path.exists(path):
+            raise ObjectStoreError('Object gs://%s/%s not found' % (bucket_id, blob_path))
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        self._request(bytes_downloaded=len(data))
+        return data
+
+
+def _get_parts(size, part_size):
+    """Returns [(offset, size)] covering a file of the given size"""
+    # Composite objects may only have MAX_COMPONENTS parts
+    part_size = max(part_size, -(-size // MAX_COMPONENTS))
+    return [(offset, min(part_size, size - offset))
+            for offset in range(0, size, part_size)] or [(0, 0)]
+
+def _map(function, items, jobs):
+    pool = ThreadPool(max(1, min(jobs, len(items))))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+def upload_file(store, local_path, bucket_id, blob_path, part_key,
+                part_size=PART_SIZE, threshold=PARALLEL_THRESHOLD, jobs=TRANSFER_JOBS):
+    """Upload local_path to blob_path. part_key identifies the file's
+    contents, e.g. its hash, so that parts left by an interrupted upload of
+    the same file are reused.
+    """
+    size = os.path.getsize(local_path)
+    if size <= threshold:
+        store.upload_part(bucket_id, blob_path, local_path, 0, size)
+        return
+    parts_prefix = '%s.loom-parts/%s' % (blob_path, part_key)
+    parts = _get_parts(size, part_size)
+    part_paths = ['%s/%05d' % (parts_prefix, i) for i in range(len(parts))]
+
+    def upload_part((part_path, (offset, part_size))):
+        if store.get_size(bucket_id, part_path) == part_size:
+            # Uploaded before the transfer was interrupted
+            return
+        store.upload_part(bucket_id, part_path, local_path, offset, part_size)
+
+    _map(upload_part, zip(part_paths, parts), jobs)
+    _compose(store, bucket_id, part_paths, blob_path, parts_prefix, jobs)
+    _map(lambda part_path: store.delete(bucket_id, part_path), part_paths, jobs)
+
+def _compose(store, bucket_id, source_paths, blob_path, parts_prefix, jobs):
+    """Compose in rounds, since each request takes at most
+    MAX_COMPOSE_SOURCES objects.
+    """
+    round_number = 0
+    while len(source_paths) > MAX_COMPOSE_SOURCES:
+        groups = [source_paths[i:i+MAX_COMPOSE_SOURCES]
+                  for i in range(0, len(source_paths), MAX_COMPOSE_SOURCES)]
+        composed_paths = ['%s/round%s-%05d' % (parts_prefix, round_number, i)
+                          for i in range(len(groups))]
+        _map(lambda (group, composed_path): store.compose(bucket_id, group, composed_path),
+             zip(groups, composed_paths), jobs)
+        if round_number > 0:
+            _map(lambda path: store.delete(bucket_id, path), source_paths, jobs)
+        source_paths = composed_paths
+        round_number += 1
+    store.compose(bucket_id, source_paths, blob_path)
+    if round_number > 0:
+        _map(lambda path: store.delete(bucket_id, path), source_paths, jobs)
+
+def download_file(store, bucket_id, blob_path, local_path, file_contents=None,
+                  range_size=PART_SIZE, threshold=PARALLEL_THRESHOLD, jobs=TRANSFER_JOBS):
+    """Download the object to local_path. If file_contents is given, the
+    download is checked against its hash.
+    """
+    info = store.get_info(bucket_id, blob_path)
+    if info is None:
+        raise ObjectStoreError('Object gs://%s/%s not found' % (bucket_id, blob_path))
+    size = info['size']
+    partial_path = local_path + '.part'
+    progress = DownloadProgress(partial_path + '.progress', {
+        'bucket_id': bucket_id,
+        'blob_path': blob_path,
+        'size': size,
+        'generation': info['generation'],
+    })
+    if not progress.ranges or not (
+            os.path.exists(partial_path) and os.path.getsize(partial_path) == size):
+        progress.reset()
+        with open(partial_path, 'wb') as f:
+            f.truncate(size)
+    if size <= threshold:
+        ranges = [(0, size)]
+    else:
+        ranges = [(start, min(start + range_size, size))
+                  for start in range(0, size, range_size)]
+
+    def download_range((start, end)):
+        if start == end or progress.is_done(start, end):
+            return
+        data = store.download_range(bucket_id, blob_path, start, end)
+        if len(data) != end - start:
+            raise ObjectStoreError('Expected %s bytes from gs://%s/%s but received %s'
+                                   % (end - start, bucket_id, blob_path, len(data)))
+        with open(partial_path, 'r+b') as f:
+            f.seek(start)
+            f.write(data)
+            # The range is only recorded as done once it is on disk
+            f.flush()
+            os.fsync(f.fileno())
+        progress.add(start, end)
+
+    _map(download_range, ranges, jobs)
+    if file_contents is not None:
+        try:
+            _check_hash(partial_path, file_contents)
+        except HashMismatchError:
+            # Start over next time
+            progress.reset()
+            os.remove(partial_path)
+            raise
+    os.rename(partial_path, local_path)
+    progress.reset()
+
+def _check_hash(path, file_contents):
+    hash_function = file_contents['hash_function']
+    hash_value = hashes.calculate_hashes(path, [hash_function])[hash_function]
+    if hash_value != file_contents['hash_value']:
+        raise HashMismatchError(
+            'Downloaded file has %s hash %s, expected %s'
+            % (hash_function, hash_value, file_contents['hash_value']))
+
+
+class DownloadProgress(object):
+    """The byte ranges of a ".part" file that have been downloaded, saved
+    so that a download can resume after an interruption. Ranges saved for
+    any other source, e.g. another object or an older generation of the
+    same one, are ignored.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.lock = threading.Lock()
+        self.ranges = set()
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved['source'] == source:
+                self.ranges = set(tuple(r) for r in saved['ranges'])
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def is_done(self, start, end):
+        return (start, end) in self.ranges
+
+    def add(self, start, end):
+        with self.lock:
+            self.ranges.add((start, end))
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'source': self.source, 'ranges': sorted(self.ranges)}, f)
+            os.rename(tmp_path, self.path)
+
+    def reset(self):
+        self.ranges = set()
+        if os.path.exists(self.path):
+            os.remove(self.path)
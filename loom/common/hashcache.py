@@ -0,0 +1,96 @@
+"""A persistent cache of file hashes, so that files uploaded again are not read
+again.
+"""
+
+import errno
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_HASH_CACHE_FILE = os.path.join(os.getenv('HOME'), '.loom', 'hash_cache.sqlite3')
+
+
+class HashCache(object):
+    """Entries are keyed by device, inode and hash function, and are only used
+    while the file's size and modification time are unchanged.
+    """
+
+    # Least recently used entries beyond this are removed
+    MAX_ENTRIES = 100000
+
+    def __init__(self, path=DEFAULT_HASH_CACHE_FILE, max_entries=None):
+        if max_entries is None:
+            max_entries = self.MAX_ENTRIES
+        self.max_entries = max_entries
+        self._makedirs(os.path.dirname(path))
+        # Hashing runs in a thread pool, so the connection is shared and
+        # guarded by a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS hashes ('
+                'device INTEGER, inode INTEGER, hash_function TEXT, '
+                'size INTEGER, mtime_ns INTEGER, hash_value TEXT, last_used REAL, '
+                'PRIMARY KEY (device, inode, hash_function))')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)')
+
+    def _makedirs(self, path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @classmethod
+    def stat(cls, file_path):
+        """Returns the key that identifies this version of the file"""
+        stat = os.stat(file_path)
+        # Python 2 has no st_mtime_ns. The float keeps microseconds.
+        return (stat.st_dev, stat.st_ino, stat.st_size, int(stat.st_mtime * 1e9))
+
+    def get(self, file_stat, hash_functions):
+        """Returns {hash_function: hash_value} if all are cached for this
+        version of the file, otherwise None.
+        """
+        (device, inode, size, mtime_ns) = file_stat
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                'SELECT hash_function, hash_value FROM hashes '
+                'WHERE device=? AND inode=? AND size=? AND mtime_ns=?',
+                (device, inode, size, mtime_ns)).fetchall()
+            hash_values = dict((hash_function, hash_value) for (hash_function, hash_value) in rows
+                               if hash_function in hash_functions)
+            if len(hash_values) < len(hash_functions):
+                return None
+            self.connection.execute(
+                'UPDATE hashes SET last_used=? WHERE device=? AND inode=?',
+                (time.time(), device, inode))
+        return hash_values
+
+    def set(self, file_stat, hash_values):
+        (device, inode, size, mtime_ns) = file_stat
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(device, inode, hash_function, size, mtime_ns, hash_value, now)
+                 for (hash_function, hash_value) in hash_values.iteritems()])
+            self._evict()
+
+    def _evict(self):
+        (count,) = self.connection.execute('SELECT COUNT(*) FROM hashes').fetchone()
+        if count <= self.max_entries:
+            return
+        # Remove an extra 10% so that eviction does not run on every insert
+        self.connection.execute(
+            'DELETE FROM hashes WHERE rowid IN '
+            '(SELECT rowid FROM hashes ORDER BY last_used LIMIT ?)',
+            (count - self.max_entries + self.max_entries/10,))
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM hashes')
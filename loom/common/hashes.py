@@ -0,0 +1,154 @@
+"""Content hashes for FileContents. The name of each hash function is stored in
+FileContents.hash_function, so the definition of a name must never change.
+"""
+
+import hashlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+
+from loom.common.exceptions import UnrecognizedHashFunctionError
+
+try:
+    import pyblake2
+except ImportError:
+    pyblake2 = None
+
+
+# Large reads keep the number of system calls low on multi-gigabyte files
+READ_SIZE = 1024*1024
+# Tree hashes hash each chunk, then the concatenated chunk digests, so that
+# chunks can be hashed on several threads. hashlib releases the GIL while
+# hashing large buffers.
+TREE_CHUNK_SIZE = 64*1024*1024
+
+
+def _blake2b():
+    if hasattr(hashlib, 'blake2b'):
+        return hashlib.blake2b()
+    if pyblake2 is not None:
+        return pyblake2.blake2b()
+    raise UnrecognizedHashFunctionError(
+        'blake2b requires Python 3.6 or the "pyblake2" package')
+
+
+class TreeHash(object):
+    """Incremental tree hash, for when the file is read once from start to
+    end, e.g. while it is copied.
+    """
+
+    def __init__(self, new_hash):
+        self.new_hash = new_hash
+        self.root = new_hash()
+        self.chunk = new_hash()
+        self.chunk_bytes = 0
+
+    def update(self, data):
+        while data:
+            take = min(len(data), TREE_CHUNK_SIZE - self.chunk_bytes)
+            self.chunk.update(data[:take])
+            self.chunk_bytes += take
+            data = data[take:]
+            if self.chunk_bytes == TREE_CHUNK_SIZE:
+                self._finish_chunk()
+
+    def _finish_chunk(self):
+        self.root.update(self.chunk.digest())
+        self.chunk = self.new_hash()
+        self.chunk_bytes = 0
+
+    def hexdigest(self):
+        if self.chunk_bytes > 0:
+            self._finish_chunk()
+        return self.root.hexdigest()
+
+
+HASH_FUNCTIONS = {
+    'md5': hashlib.md5,
+    'sha256': hashlib.sha256,
+    'blake2b': _blake2b,
+}
+
+TREE_HASH_FUNCTIONS = {
+    'md5-tree': hashlib.md5,
+    'blake2b-tree': _blake2b,
+}
+
+
+def get_hash_function_names():
+    return sorted(HASH_FUNCTIONS.keys() + TREE_HASH_FUNCTIONS.keys())
+
+def new_hash(hash_function):
+    if hash_function in HASH_FUNCTIONS:
+        return HASH_FUNCTIONS[hash_function]()
+    if hash_function in TREE_HASH_FUNCTIONS:
+        return TreeHash(TREE_HASH_FUNCTIONS[hash_function])
+    raise UnrecognizedHashFunctionError(
+        'Unrecognized hash function "%s". Choose from %s'
+        % (hash_function, ', '.join(get_hash_function_names())))
+
+def calculate_hashes(file_path, hash_functions):
+    """Returns {hash_function: hash_value}, reading the file once. A single
+    tree hash is calculated in parallel instead.
+    """
+    if len(hash_functions) == 1 and hash_functions[0] in TREE_HASH_FUNCTIONS:
+        return {hash_functions[0]: calculate_tree_hash(file_path, hash_functions[0])}
+    hashes = dict((hash_function, new_hash(hash_function))
+                  for hash_function in hash_functions)
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            for h in hashes.values():
+                h.update(data)
+    return dict((hash_function, h.hexdigest())
+                for (hash_function, h) in hashes.iteritems())
+
+def copy_and_calculate_hashes(file_path, destination_file, hash_functions):
+    """Copy the file to an open destination_file and return
+    {hash_function: hash_value}, reading the source only once.
+    """
+    hashes = dict((hash_function, new_hash(hash_function))
+                  for hash_function in hash_functions)
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            for h in hashes.values():
+                h.update(data)
+            destination_file.write(data)
+    return dict((hash_function, h.hexdigest())
+                for (hash_function, h) in hashes.iteritems())
+
+def calculate_tree_hash(file_path, hash_function, threads=None):
+    new_chunk_hash = TREE_HASH_FUNCTIONS[hash_function]
+    offsets = range(0, os.path.getsize(file_path), TREE_CHUNK_SIZE)
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+    pool = ThreadPool(max(1, min(threads, len(offsets))))
+    try:
+        chunk_digests = pool.map(
+            lambda offset: _hash_chunk(file_path, offset, new_chunk_hash),
+            offsets)
+    finally:
+        pool.close()
+        pool.join()
+    root = new_chunk_hash()
+    for digest in chunk_digests:
+        root.update(digest)
+    return root.hexdigest()
+
+def _hash_chunk(file_path, offset, new_chunk_hash):
+    h = new_chunk_hash()
+    remaining = TREE_CHUNK_SIZE
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        while remaining > 0:
+            data = f.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            h.update(data)
+            remaining -= len(data)
+    return h.digest()
@@ -1,10 +1,13 @@
 import hashlib
 
+# Large reads keep the number of system calls low on multi-gigabyte files
+CHUNK_SIZE = 1024*1024
+
 def calculate_md5sum(file_path):
     with open(file_path, 'rb') as f:
         m = hashlib.md5()
         while True:
-            data = f.read(8192)
+            data = f.read(CHUNK_SIZE)
             if not data:
                 break
             m.update(data)
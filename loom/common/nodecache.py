@@ -0,0 +1,210 @@
+"""A cache of input files shared by all tasks on a worker node, so that a file
+used by several tasks is downloaded to the node once.
+"""
+
+from contextlib import contextmanager
+import errno
+import fcntl
+import os
+import re
+import sqlite3
+import tempfile
+import time
+
+from loom.common import hashes
+from loom.common.exceptions import HashMismatchError
+
+
+class NodeCache(object):
+    """Entries are named by the hash of their FileContents, so a file is one
+    entry whatever its name or storage location. Several processes may use
+    the cache at once. An entry is populated under an exclusive lock on its
+    key, checked against its hash and renamed into place, so only the first
+    task that needs a file downloads it while the others wait. Entries held
+    by a task are not evicted until it releases them. The least recently
+    used of the others are removed once the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, 'objects')
+        self.locks_dir = os.path.join(root, 'locks')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        for path in [self.objects_dir, self.locks_dir, self.tmp_dir]:
+            self._makedirs(path)
+        self.index_path = os.path.join(root, 'index.sqlite3')
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, size INTEGER, last_used REAL)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS refs ('
+                'key TEXT, holder TEXT, pid INTEGER, '
+                'PRIMARY KEY (key, holder))')
+
+    def _makedirs(self, path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call, since the cache is shared by threads and
+        # by processes.
+        connection = sqlite3.connect(self.index_path, timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def _lock(self, key, blocking=True):
+        """Exclusive lock on one key, held while the entry is populated or
+        evicted. Yields False if blocking is False and the lock is taken.
+        """
+        with open(os.path.join(self.locks_dir, key), 'a') as lock_file:
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except IOError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    yield False
+                    return
+                raise
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @classmethod
+    def get_key(cls, file_contents):
+        key = '%s-%s' % (file_contents['hash_function'], file_contents['hash_value'])
+        # The key is used as a file name
+        if not re.match(r'^[A-Za-z0-9_.-]+$', key):
+            raise ValueError('Cannot cache file contents with key "%s"' % key)
+        return key
+
+    def get_path(self, key):
+        return os.path.join(self.objects_dir, key)
+
+    def acquire(self, file_contents, populate, holder):
+        """Returns (path, hit) for the cached copy of file_contents, calling
+        populate(path) to download it first if it is not cached. The entry
+        is held for holder until release(holder) is called.
+        """
+        key = self.get_key(file_contents)
+        path = self.get_path(key)
+        with self._lock(key):
+            with self._connect() as connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO refs VALUES (?, ?, ?)',
+                    (key, holder, os.getpid()))
+                hit = connection.execute(
+                    'SELECT 1 FROM entries WHERE key=?', (key,)).fetchone() is not None
+            if hit and not os.path.exists(path):
+                hit = False
+            if hit:
+                with self._connect() as connection:
+                    connection.execute(
+                        'UPDATE entries SET last_used=? WHERE key=?', (time.time(), key))
+            else:
+                try:
+                    self._populate(path, populate, file_contents)
+                except:
+                    self.release(holder, key=key)
+                    raise
+                with self._connect() as connection:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                        (key, os.path.getsize(path), time.time()))
+        if not hit:
+            self.evict()
+        return (path, hit)
+
+    def _populate(self, path, populate, file_contents):
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        # Downloaders expect to create the file
+        os.remove(tmp_path)
+        try:
+            populate(tmp_path)
+            # A bad download would be served to every later task
+            self._check_hash(tmp_path, file_contents)
+            # Entries are shared, so discourage tasks from changing them
+            os.chmod(tmp_path, 0444)
+            os.rename(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _check_hash(self, path, file_contents):
+        hash_function = file_contents['hash_function']
+        hash_value = hashes.calculate_hashes(path, [hash_function])[hash_function]
+        if hash_value != file_contents['hash_value']:
+            raise HashMismatchError(
+                'Downloaded file has %s hash %s, expected %s'
+                % (hash_function, hash_value, file_contents['hash_value']))
+
+    def release(self, holder, key=None):
+        with self._connect() as connection:
+            if key is None:
+                connection.execute('DELETE FROM refs WHERE holder=?', (holder,))
+            else:
+                connection.execute(
+                    'DELETE FROM refs WHERE holder=? AND key=?', (holder, key))
+
+    def evict(self):
+        """Remove least recently used entries that are not held until the
+        cache is no larger than max_bytes. Returns the number of bytes freed.
+        """
+        self._release_dead_holders()
+        with self._connect() as connection:
+            (total_bytes,) = connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()
+            candidates = connection.execute(
+                'SELECT key, size FROM entries WHERE key NOT IN '
+                '(SELECT key FROM refs) ORDER BY last_used').fetchall()
+        freed_bytes = 0
+        for (key, size) in candidates:
+            if total_bytes - freed_bytes <= self.max_bytes:
+                break
+            # Skip entries being populated or acquired right now
+            with self._lock(key, blocking=False) as locked:
+                if not locked:
+                    continue
+                with self._connect() as connection:
+                    if connection.execute(
+                            'SELECT 1 FROM refs WHERE key=?', (key,)).fetchone() is not None:
+                        continue
+                    connection.execute('DELETE FROM entries WHERE key=?', (key,))
+                try:
+                    os.remove(self.get_path(key))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                freed_bytes += size
+        return freed_bytes
+
+    def _release_dead_holders(self):
+        """Drop references left by processes that exited without releasing
+        them.
+        """
+        with self._connect() as connection:
+            pids = [pid for (pid,) in connection.execute('SELECT DISTINCT pid FROM refs')]
+            for pid in pids:
+                if not self._is_running(pid):
+                    connection.execute('DELETE FROM refs WHERE pid=?', (pid,))
+
+    def _is_running(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.EPERM
+        return True
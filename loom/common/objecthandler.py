@@ -1,33 +1,225 @@
+from collections import OrderedDict
+import gzip
 import json
+import re
+import StringIO
+import threading
+import time
+import urllib
+
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
 from loom.common.exceptions import *
 
+
+class RequestStats(object):
+    """Counts requests and their latency by endpoint. Endpoints are grouped
+    by method and URL, with IDs replaced by "<id>".
+    """
+
+    ID_PATTERN = re.compile(r'(?<=/)(@?[0-9a-f]{8,}(-[0-9a-f]+)*|[0-9]+)(?=/|$)')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def get_endpoint(self, method, relative_url):
+        path = self.ID_PATTERN.sub('<id>', relative_url.split('?')[0])
+        return '%s %s' % (method, path)
+
+    def add(self, endpoint, seconds, bytes_sent, bytes_received):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'count': 0,
+                'total_seconds': 0.0,
+                'max_seconds': 0.0,
+                'bytes_sent': 0,
+                'bytes_received': 0,
+            })
+            stats['count'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_received'] += bytes_received
+
+    def format(self):
+        lines = ['%-50s %7s %9s %9s %9s %11s %11s' % (
+            'endpoint', 'count', 'total_s', 'mean_ms', 'max_ms', 'sent', 'received')]
+        with self.lock:
+            endpoints = sorted(self.endpoints.items(),
+                               key=lambda (endpoint, stats): -stats['total_seconds'])
+            for (endpoint, stats) in endpoints:
+                lines.append('%-50s %7d %9.3f %9.1f %9.1f %11d %11d' % (
+                    endpoint,
+                    stats['count'],
+                    stats['total_seconds'],
+                    1000 * stats['total_seconds'] / stats['count'],
+                    1000 * stats['max_seconds'],
+                    stats['bytes_sent'],
+                    stats['bytes_received']))
+        return '\n'.join(lines)
+
+
+# Shared by all ObjectHandlers, so that "loom --profile" can report on every
+# request a command made
+request_stats = RequestStats()
+
+
+class ResponseCache(object):
+    """GET responses that have an ETag, by URL, so that they can be
+    revalidated with a conditional request. The least recently used are
+    dropped beyond max_entries.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.responses = OrderedDict()
+
+    def get(self, url):
+        with self.lock:
+            response = self.responses.pop(url, None)
+            if response is not None:
+                self.responses[url] = response
+            return response
+
+    def set(self, url, response):
+        with self.lock:
+            self.responses.pop(url, None)
+            self.responses[url] = response
+            while len(self.responses) > self.max_entries:
+                self.responses.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.responses.clear()
+
+    @classmethod
+    def is_immutable(cls, response):
+        cache_control = response.headers.get('Cache-Control', '')
+        return 'immutable' in [directive.strip() for directive in cache_control.split(',')]
+
+
 class ObjectHandler(object):
     """ObjectHandler provides functions to create and work with objects in the 
     Loom database via the HTTP API
     """
 
-    def __init__(self, master_url):
+    # (connect, read) timeouts in seconds
+    TIMEOUT = (10, 300)
+    # Retries on failures to connect, and on 5xx responses to requests that
+    # are safe to repeat. Errors after a request is sent are not retried,
+    # since a POST such as a lease may have taken effect.
+    RETRIES = 5
+    RETRY_BACKOFF_SECONDS = 0.5
+    RETRY_STATUSES = [500, 502, 503, 504]
+    # Request bodies larger than this are sent gzipped
+    GZIP_MIN_BYTES = 64*1024
+    # Concurrent connections kept open to the server
+    POOL_SIZE = 16
+    # GET responses kept for conditional requests. 0 disables the cache.
+    RESPONSE_CACHE_SIZE = 1000
+
+    def __init__(self, master_url, timeout=None, retries=None, gzip_requests=True,
+                 response_cache_size=None):
         self.api_root_url = master_url + '/api/'
+        if timeout is None:
+            timeout = self.TIMEOUT
+        if retries is None:
+            retries = self.RETRIES
+        if response_cache_size is None:
+            response_cache_size = self.RESPONSE_CACHE_SIZE
+        self.timeout = timeout
+        self.gzip_requests = gzip_requests
+        self.session = self._create_session(retries)
+        if response_cache_size > 0:
+            self.response_cache = ResponseCache(response_cache_size)
+        else:
+            self.response_cache = None
+
+    def _create_session(self, retries):
+        """A session reuses connections to the server. It is safe to share
+        between threads, as the upload pipeline does.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.POOL_SIZE,
+            max_retries=Retry(
+                total=retries,
+                read=False,
+                backoff_factor=self.RETRY_BACKOFF_SECONDS,
+                status_forcelist=self.RETRY_STATUSES))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     # ---- General methods ----
     
     def _post(self, data, relative_url, raise_for_status=False):
-        url = self.api_root_url + relative_url
-        return self._make_request_to_server(lambda: requests.post(url, data=json.dumps(data)), raise_for_status=raise_for_status)
+        body = json.dumps(data)
+        headers = {'Content-Type': 'application/json'}
+        if self.gzip_requests and len(body) > self.GZIP_MIN_BYTES:
+            body = self._gzip(body)
+            headers['Content-Encoding'] = 'gzip'
+        return self._make_request_to_server('POST', relative_url, data=body, headers=headers,
+                                            raise_for_status=raise_for_status)
 
     def _get(self, relative_url, raise_for_status=False):
-        url = self.api_root_url + relative_url
-        return self._make_request_to_server(lambda: requests.get(url), raise_for_status=raise_for_status)
-    
-    def _make_request_to_server(self, query_function, raise_for_status=False):
+        """Responses with an ETag are cached. Immutable ones are reused
+        without a request, and others are revalidated with If-None-Match, so
+        that an unchanged object is not sent again.
+        """
+        if self.response_cache is None:
+            return self._make_request_to_server('GET', relative_url,
+                                                raise_for_status=raise_for_status)
+        cached_response = self.response_cache.get(relative_url)
+        if cached_response is not None and ResponseCache.is_immutable(cached_response):
+            request_stats.add(request_stats.get_endpoint('GET (cached)', relative_url), 0, 0, 0)
+            return cached_response
+        headers = None
+        if cached_response is not None:
+            headers = {'If-None-Match': cached_response.headers['ETag']}
+        response = self._make_request_to_server('GET', relative_url, headers=headers,
+                                                raise_for_status=raise_for_status)
+        if response.status_code == 304 and cached_response is not None:
+            return cached_response
+        if response.status_code == 200 and 'ETag' in response.headers:
+            self.response_cache.set(relative_url, response)
+        return response
+
+    def _gzip(self, body):
+        buffer = StringIO.StringIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) as f:
+            f.write(body)
+        return buffer.getvalue()
+
+    def _make_request_to_server(self, method, relative_url, data=None, headers=None,
+                                raise_for_status=False):
         """Verifies server connection and handles response errors
         for either get or post requests
         """
+        url = self.api_root_url + relative_url
+        start_time = time.time()
         try:
-            response = query_function()
+            response = self.session.request(method, url, data=data, headers=headers,
+                                            timeout=self.timeout)
         except requests.exceptions.ConnectionError as e:
             raise ServerConnectionError("No response from server.\n%s" % e.message)
+        except requests.exceptions.Timeout as e:
+            raise ServerConnectionError("Timed out waiting for server.\n%s" % e.message)
+        except requests.exceptions.RetryError as e:
+            raise BadResponseError("Server error, retries exhausted.\n%s" % e.message)
+        request_stats.add(request_stats.get_endpoint(method, relative_url),
+                          time.time() - start_time,
+                          len(data or ''),
+                          len(response.content))
         if raise_for_status:
             try:
                 response.raise_for_status()
@@ -38,6 +230,9 @@ class ObjectHandler(object):
     def _post_object(self, object_data, relative_url):
         return self._post(object_data, relative_url, raise_for_status=True).json()['object']
 
+    def _post_objects(self, object_data_list, relative_url):
+        return self._post(object_data_list, relative_url, raise_for_status=True).json()['objects']
+
     def _get_object(self, relative_url, raise_for_status=False):
         response = self._get(relative_url)
         if response.status_code == 404:
@@ -54,12 +249,70 @@ class ObjectHandler(object):
         else:
             raise BadResponseError("Status code %s." % response.status_code)
 
+    def _iter_index(self, relative_url, key, query_string='', fields=None, page_size=None,
+                    params=None):
+        """Yields every object in an index, fetching a page at a time so
+        that memory use does not grow with the size of the index.
+        """
+        params = dict(params or {})
+        if query_string:
+            params['q'] = query_string
+        if fields is not None:
+            params['fields'] = ','.join(fields)
+        if page_size is not None:
+            params['limit'] = page_size
+        while True:
+            page = self._get_object_index(relative_url + '?' + urllib.urlencode(params))
+            for item in page[key]:
+                yield item
+            if page.get('next_cursor') is None:
+                return
+            params['cursor'] = page['next_cursor']
+
+    def _get_index(self, relative_url, key, query_string, min, max, fields=None):
+        """Returns the objects in an index, after fetching at most one more
+        than max.
+        """
+        page_size = None
+        if max != float('inf'):
+            page_size = int(max) + 1
+        items = []
+        for item in self._iter_index(relative_url, key, query_string=query_string,
+                                     fields=fields, page_size=page_size):
+            items.append(item)
+            if len(items) > max:
+                break
+        return items
+
+    def _count_index(self, relative_url, query_string=''):
+        params = {'count': 'true'}
+        if query_string:
+            params['q'] = query_string
+        return self._get_object_index(relative_url + '?' + urllib.urlencode(params))['count']
+
     def get_server_time(self):
         """Use this, not local system time,  when generating a time stamp in the client
         """
         response = self._get('servertime/')
         return response.json()['time']
 
+    def get_filehandler_info(self):
+        return self._get('filehandlerinfo/', raise_for_status=True).json()['filehandlerinfo']
+
+    def get_worker_info(self):
+        return self._get('workerinfo/', raise_for_status=True).json()['workerinfo']
+
+    def get_verifiable_models(self):
+        """Labels of the model classes that verify_ids can check."""
+        return self._get_object_index('controls/verify/')['models']
+
+    def verify_ids(self, model):
+        """Ask the server to check every immutable object of one model class
+        against the hash of its contents, a page per request. Yields each
+        mismatch.
+        """
+        return self._iter_index('controls/verify/', 'mismatches', params={'model': model})
+
     # ---- Post/Get [object_type] methods ----
 
     def post_data_object(self, data_object):
@@ -67,6 +320,13 @@ class ObjectHandler(object):
             data_object,
             'data_objects/')
 
+    def post_data_objects(self, data_objects):
+        """Create many data objects with a single request
+        """
+        return self._post_objects(
+            data_objects,
+            'data_objects/bulk/')
+
     def get_data_object_array(self, array_id):
         return self._get_object(
             'data_object_arrays/'+array_id)
@@ -80,18 +340,22 @@ class ObjectHandler(object):
         return self._get_object(
             'file_data_objects/'+file_id)
 
-    def get_file_data_object_index(self, query_string='', min=0, max=float('inf')):
-        if query_string:
-            url = 'file_data_objects/?q='+query_string
-        else:
-            url = 'file_data_objects/'
-        file_data_objects =  self._get_object_index(url)['file_data_objects']
+    def get_file_data_object_index(self, query_string='', min=0, max=float('inf'), fields=None):
+        file_data_objects = self._get_index(
+            'file_data_objects/', 'file_data_objects', query_string, min, max, fields=fields)
         if len(file_data_objects) < min:
             raise IdMatchedTooFewFileDataObjectsError('Found %s File Data Objects, expected at least %s' %(len(file_data_objects), min))
         if len(file_data_objects) > max:
-            raise IdMatchedTooManyFileDataObjectsError('Found %s File Data Objects, expected at most %s' %(len(file_data_objects), max))
+            raise IdMatchedTooManyFileDataObjectsError('Found more than %s File Data Objects, expected at most %s' %(max, max))
         return file_data_objects
 
+    def iter_file_data_object_index(self, query_string='', fields=None):
+        return self._iter_index('file_data_objects/', 'file_data_objects',
+                                query_string=query_string, fields=fields)
+
+    def count_file_data_objects(self, query_string=''):
+        return self._count_index('file_data_objects/', query_string)
+
     def get_file_storage_locations_by_file(self, file_id):
         return self._get_object(
             'file_data_objects/'+file_id+'/file_storage_locations/'
@@ -102,6 +366,27 @@ class ObjectHandler(object):
             file_storage_location,
             'file_storage_locations/')
 
+    def get_file_storage_locations_by_files(self, file_ids):
+        """Returns {file_id: [file_storage_locations]} with a single request
+        """
+        return self._post(
+            file_ids,
+            'file_data_objects/file_storage_locations/',
+            raise_for_status=True
+        ).json()['file_storage_locations']
+
+    def post_file_contents_aliases(self, file_contents_aliases):
+        return self._post_objects(
+            file_contents_aliases,
+            'file_contents_aliases/bulk/')
+
+    def post_file_storage_locations(self, file_storage_locations):
+        """Create many storage locations with a single request
+        """
+        return self._post_objects(
+            file_storage_locations,
+            'file_storage_locations/bulk/')
+
     def post_data_source_record(self, data_source_record):
         return self._post_object(
             data_source_record,
@@ -118,18 +403,22 @@ class ObjectHandler(object):
             'workflows/'+workflow_id
         )
 
-    def get_workflow_index(self, query_string='', min=0, max=float('inf')):
-        if query_string:
-            url = 'workflows/?q='+query_string
-        else:
-            url = 'workflows/'
-        workflows = self._get_object_index(url)['workflows']
+    def get_workflow_index(self, query_string='', min=0, max=float('inf'), fields=None):
+        workflows = self._get_index(
+            'workflows/', 'workflows', query_string, min, max, fields=fields)
         if len(workflows) < min:
             raise Error('Found %s workflows, expected at least %s' %(len(workflows), min))
         if len(workflows) > max:
-            raise Error('Found %s workflows, expected at most %s' %(len(workflows), max))
+            raise Error('Found more than %s workflows, expected at most %s' %(max, max))
         return workflows
 
+    def iter_workflow_index(self, query_string='', fields=None):
+        return self._iter_index('workflows/', 'workflows',
+                                query_string=query_string, fields=fields)
+
+    def count_workflows(self, query_string=''):
+        return self._count_index('workflows/', query_string)
+
     def post_workflow(self, workflow):
         return self._post_object(
             workflow,
@@ -140,24 +429,75 @@ class ObjectHandler(object):
             'workflow_runss/'+workflow_run_id
         )
 
-    def get_workflow_run_index(self, query_string='', min=0, max=float('inf')):
-        if query_string:
-            url = 'workflow_runs/?q='+query_string
-        else:
-            url = 'workflow_runs/'
-        workflow_runs = self._get_object_index(url)['workflow_runs']
+    def get_workflow_run_index(self, query_string='', min=0, max=float('inf'), fields=None):
+        workflow_runs = self._get_index(
+            'workflow_runs/', 'workflow_runs', query_string, min, max, fields=fields)
         if len(workflow_runs) < min:
             raise Error('Found %s workflow runs, expected at least %s' %(len(workflow_runs), min))
         if len(workflow_runs) > max:
-            raise Error('Found %s workflow runs, expected at most %s' %(len(workflow_runs), max))
+            raise Error('Found more than %s workflow runs, expected at most %s' %(max, max))
         return workflow_runs
 
+    def iter_workflow_run_index(self, query_string='', fields=None):
+        return self._iter_index('workflow_runs/', 'workflow_runs',
+                                query_string=query_string, fields=fields)
+
+    def count_workflow_runs(self, query_string=''):
+        return self._count_index('workflow_runs/', query_string)
+
     def post_workflow_run(self, workflow_run):
         return self._post_object(
             workflow_run,
             'workflow_runs/')
 
+    def get_task_run(self, task_run_id):
+        return self._get('task_runs/' + task_run_id, raise_for_status=True).json()
+
     def update_task_run(self, task_run):
         return self._post_object(
             task_run,
             'task_runs/' + task_run['_id'])
+
+    def get_result_cache(self, task_definition_id=None):
+        url = 'result_cache/'
+        if task_definition_id is not None:
+            url += '?task_definition_id=%s' % task_definition_id
+        return self._get_object_index(url)
+
+    def invalidate_result_cache(self, task_definition_id=None):
+        data = {}
+        if task_definition_id is not None:
+            data['task_definition_id'] = task_definition_id
+        return self._post(
+            data,
+            'result_cache/invalidate/',
+            raise_for_status=True).json()['invalidated']
+
+    def lease_task_runs(self, worker_id, count, cores):
+        return self._post(
+            {'worker_id': worker_id, 'count': count, 'cores': cores},
+            'task_runs/lease/',
+            raise_for_status=True).json()['leases']
+
+    def submit_task_run_result(self, task_run_id, task_run_location_id, outputs):
+        return self._post(
+            {'task_run_location_id': task_run_location_id, 'outputs': outputs},
+            'task_runs/%s/result/' % task_run_id,
+            raise_for_status=True).json()
+
+    def post_task_run_error(self, task_run_id, task_run_location_id):
+        return self._post(
+            {'task_run_location_id': task_run_location_id},
+            'task_runs/%s/error/' % task_run_id,
+            raise_for_status=True).json()
+
+    def post_worker(self, worker):
+        return self._post_object(
+            worker,
+            'workers/')
+
+    def post_worker_heartbeat(self, worker_id, task_run_location_ids):
+        return self._post(
+            {'task_run_location_ids': task_run_location_ids},
+            'workers/%s/heartbeat/' % worker_id,
+            raise_for_status=True).json()['lost_task_run_location_ids']
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import uuid
+
+from loom.common.exceptions import NoStorageLocationError
+from loom.common.filehandler import LocalFileHandler
+from loom.common.hashcache import HashCache
+
+
+class FakeObjectHandler(object):
+    """Stands in for the server. Contents are stored once a storage location
+    is posted for them.
+    """
+
+    def __init__(self):
+        self.file_contents_ids = {}
+        self.posted_locations = []
+
+    def get_server_time(self):
+        return '20000101000000'
+
+    def post_data_objects(self, file_objects):
+        registered = []
+        for file_object in file_objects:
+            file_object = dict(file_object)
+            file_object['_id'] = uuid.uuid4().hex
+            file_object['file_contents'] = dict(
+                file_object['file_contents'],
+                _id=file_object['file_contents']['hash_value'])
+            self.file_contents_ids[file_object['_id']] = file_object['file_contents']['_id']
+            registered.append(file_object)
+        return registered
+
+    def post_file_contents_aliases(self, aliases):
+        pass
+
+    def get_file_storage_locations_by_files(self, file_ids):
+        return dict((file_id, self.get_file_storage_locations_by_file(file_id))
+                    for file_id in file_ids)
+
+    def get_file_storage_locations_by_file(self, file_id):
+        return [location for location in self.posted_locations
+                if location['file_contents']['_id'] == self.file_contents_ids[file_id]]
+
+    def post_file_storage_locations(self, locations):
+        self.posted_locations.extend(locations)
+
+    def post_file_storage_location(self, location):
+        self.posted_locations.append(location)
+
+
+class TestLocalFileHandlerUploads(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.settings = {
+            'FILE_ROOT': os.path.join(self.tmp_dir, 'root'),
+            'IMPORT_DIR': 'imports',
+            'FILE_SERVER_FOR_WORKER': 'localhost',
+        }
+        self.import_dir = os.path.join(self.settings['FILE_ROOT'], 'imports')
+        self.source_paths = []
+        for data in ['one', 'two']:
+            path = os.path.join(self.tmp_dir, data)
+            with open(path, 'w') as f:
+                f.write(data)
+            self.source_paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_filehandler(self):
+        filehandler = LocalFileHandler(
+            'http://127.0.0.1:8000', self.settings, use_hash_cache=False)
+        filehandler.objecthandler = FakeObjectHandler()
+        return filehandler
+
+    def testUpload(self):
+        filehandler = self._get_filehandler()
+        file_objects = filehandler.upload_files_from_local_paths(self.source_paths)
+        self.assertEqual(len(file_objects), 2)
+        self.assertEqual(len(filehandler.objecthandler.posted_locations), 2)
+        self.assertEqual(
+            sorted(open(os.path.join(self.import_dir, name)).read()
+                   for name in os.listdir(self.import_dir)),
+            ['one', 'two'])
+
+    def testUploadedFilesAreReadable(self):
+        umask = os.umask(022)
+        try:
+            filehandler = self._get_filehandler()
+            filehandler.upload_files_from_local_paths(self.source_paths)
+        finally:
+            os.umask(umask)
+        for name in os.listdir(self.import_dir):
+            self.assertEqual(
+                stat.S_IMODE(os.stat(os.path.join(self.import_dir, name)).st_mode), 0644)
+
+    def testUploadCopiesFileWithCachedHashes(self):
+        filehandler = self._get_filehandler()
+        filehandler.hash_cache = HashCache(os.path.join(self.tmp_dir, 'hash_cache.sqlite3'))
+        hash_value = hashlib.md5('one').hexdigest()
+        filehandler.hash_cache.set(HashCache.stat(self.source_paths[0]), {'md5': hash_value})
+        (file_object, aliases, staged_path) = filehandler._stage_file(self.source_paths[0])
+        self.assertIsNone(staged_path)
+        self.assertEqual(file_object['file_contents']['hash_value'], hash_value)
+        self.assertFalse(os.path.exists(self.import_dir))
+        filehandler.upload_files_from_local_paths(self.source_paths[:1])
+        self.assertEqual(
+            [open(os.path.join(self.import_dir, name)).read()
+             for name in os.listdir(self.import_dir)],
+            ['one'])
+
+    def _get_staged_names(self):
+        return [name for name in os.listdir(self.import_dir)
+                if name.startswith(LocalFileHandler.STAGING_PREFIX)]
+
+    def testDuplicatePathsLeaveNoStagedFiles(self):
+        filehandler = self._get_filehandler()
+        file_objects = filehandler.upload_files_from_local_paths(
+            [self.source_paths[0], self.source_paths[0], self.source_paths[1]])
+        self.assertEqual(len(file_objects), 3)
+        # Contents are uploaded once, and the other staged copy discarded
+        self.assertEqual(len(os.listdir(self.import_dir)), 2)
+        self.assertEqual(self._get_staged_names(), [])
+
+    def testStoredContentsLeaveNoStagedFiles(self):
+        filehandler = self._get_filehandler()
+        filehandler.upload_files_from_local_paths(self.source_paths[:1])
+        filehandler.upload_files_from_local_paths(self.source_paths[:1])
+        filehandler.upload_file_from_local_path(self.source_paths[0])
+        self.assertEqual(len(filehandler.objecthandler.posted_locations), 1)
+        self.assertEqual(len(os.listdir(self.import_dir)), 1)
+        self.assertEqual(self._get_staged_names(), [])
+
+    def testNegDownloadWithoutStorageLocation(self):
+        filehandler = self._get_filehandler()
+        file_object = filehandler.objecthandler.post_data_objects(
+            [filehandler.create_file_data_object_from_local_path(self.source_paths[0])])[0]
+        with self.assertRaises(NoStorageLocationError):
+            filehandler.download_by_file_id(
+                file_object['_id'], os.path.join(self.tmp_dir, 'download'))
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from loom.common import gcs
+from loom.common.exceptions import HashMismatchError, ObjectStoreError
+from loom.common.filehandler import GoogleCloudFileHandler
+
+
+class FailingObjectStore(gcs.FakeObjectStore):
+    """Fails after a number of part uploads or range downloads, as an
+    interrupted transfer would.
+    """
+
+    def __init__(self, root, transfers_before_failure):
+        gcs.FakeObjectStore.__init__(self, root)
+        self.transfers_before_failure = transfers_before_failure
+
+    def _transfer(self):
+        with self.lock:
+            if self.transfers_before_failure == 0:
+                raise ObjectStoreError('Connection lost')
+            self.transfers_before_failure -= 1
+
+    def upload_part(self, *args):
+        self._transfer()
+        gcs.FakeObjectStore.upload_part(self, *args)
+
+    def download_range(self, *args):
+        self._transfer()
+        return gcs.FakeObjectStore.download_range(self, *args)
+
+
+class TestGoogleCloudTransfers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store_root = os.path.join(self.tmp_dir, 'store')
+        self.store = gcs.FakeObjectStore(self.store_root)
+        self.local_path = os.path.join(self.tmp_dir, 'file')
+        self.data = os.urandom(1000)
+        with open(self.local_path, 'wb') as f:
+            f.write(self.data)
+        self.download_path = os.path.join(self.tmp_dir, 'downloaded')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _upload(self, store, **kwargs):
+        gcs.upload_file(store, self.local_path, 'bucket', 'path/file', 'hash',
+                        part_size=10, threshold=100, **kwargs)
+
+    def _download(self, store):
+        gcs.download_file(store, 'bucket', 'path/file', self.download_path,
+                          range_size=100, threshold=100)
+
+    def testCompositeUpload(self):
+        # 100 parts need two rounds of compose requests
+        self._upload(self.store)
+        self.assertEqual(self._read(os.path.join(self.store_root, 'bucket', 'path/file')), self.data)
+        # Parts are deleted once composed
+        self.assertEqual(os.listdir(os.path.join(self.store_root, 'bucket', 'path')), ['file'])
+
+    def testUploadResumesAfterInterruption(self):
+        with self.assertRaises(ObjectStoreError):
+            self._upload(FailingObjectStore(self.store_root, 60), jobs=1)
+        self._upload(self.store)
+        self.assertEqual(self.store.bytes_uploaded, 400)
+        self.assertEqual(self._read(os.path.join(self.store_root, 'bucket', 'path/file')), self.data)
+
+    def testRangedDownload(self):
+        self._upload(self.store)
+        self._download(self.store)
+        self.assertEqual(self._read(self.download_path), self.data)
+        self.assertFalse(os.path.exists(self.download_path + '.part.progress'))
+
+    def testDownloadResumesAfterInterruption(self):
+        self._upload(self.store)
+        with self.assertRaises(ObjectStoreError):
+            gcs.download_file(FailingObjectStore(self.store_root, 6), 'bucket', 'path/file',
+                              self.download_path, range_size=100, threshold=100, jobs=1)
+        self.assertFalse(os.path.exists(self.download_path))
+        self._download(self.store)
+        self.assertEqual(self.store.bytes_downloaded, 400)
+        self.assertEqual(self._read(self.download_path), self.data)
+
+    def testResumeIgnoresProgressOfOtherObject(self):
+        self._upload(self.store)
+        with self.assertRaises(ObjectStoreError):
+            gcs.download_file(FailingObjectStore(self.store_root, 6), 'bucket', 'path/file',
+                              self.download_path, range_size=100, threshold=100, jobs=1)
+        # Replace the object with another of the same size
+        self.data = os.urandom(1000)
+        with open(self.local_path, 'wb') as f:
+            f.write(self.data)
+        self._upload(self.store)
+        self.store.bytes_downloaded = 0
+        self._download(self.store)
+        self.assertEqual(self.store.bytes_downloaded, 1000)
+        self.assertEqual(self._read(self.download_path), self.data)
+
+    def testNegDownloadHashMismatch(self):
+        self._upload(self.store)
+        with self.assertRaises(HashMismatchError):
+            gcs.download_file(self.store, 'bucket', 'path/file', self.download_path,
+                              file_contents={'hash_function': 'md5', 'hash_value': 'wrong'},
+                              range_size=100, threshold=100)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['file', 'store'])
+        gcs.download_file(self.store, 'bucket', 'path/file', self.download_path,
+                          file_contents={'hash_function': 'md5',
+                                         'hash_value': hashlib.md5(self.data).hexdigest()},
+                          range_size=100, threshold=100)
+        self.assertEqual(self._read(self.download_path), self.data)
+
+    def testFileHandler(self):
+        filehandler = GoogleCloudFileHandler(
+            'http://127.0.0.1:8000', {}, object_store=self.store, use_hash_cache=False)
+        location = {
+            'file_contents': {'hash_value': hashlib.md5(self.data).hexdigest(),
+                              'hash_function': 'md5'},
+            'project_id': 'project',
+            'bucket_id': 'bucket',
+            'blob_path': 'path/file',
+        }
+        filehandler.upload(self.local_path, location)
+        filehandler.download(location, self.download_path)
+        self.assertEqual(self._read(self.download_path), self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from loom.common.hashcache import HashCache
+
+
+class TestHashCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = HashCache(os.path.join(self.tmp_dir, 'cache', 'hash_cache.sqlite3'))
+        self.file_path = os.path.join(self.tmp_dir, 'file')
+        self._write(self.file_path, 'abc')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, path, data):
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def testGet(self):
+        file_stat = HashCache.stat(self.file_path)
+        self.cache.set(file_stat, {'md5': 'hash1', 'sha256': 'hash2'})
+        self.assertEqual(self.cache.get(HashCache.stat(self.file_path), ['md5']),
+                         {'md5': 'hash1'})
+        self.assertEqual(self.cache.get(file_stat, ['md5', 'sha256']),
+                         {'md5': 'hash1', 'sha256': 'hash2'})
+
+    def testPersists(self):
+        self.cache.set(HashCache.stat(self.file_path), {'md5': 'hash1'})
+        cache = HashCache(os.path.join(self.tmp_dir, 'cache', 'hash_cache.sqlite3'))
+        self.assertEqual(cache.get(HashCache.stat(self.file_path), ['md5']),
+                         {'md5': 'hash1'})
+
+    def testNegMissingHashFunction(self):
+        self.cache.set(HashCache.stat(self.file_path), {'md5': 'hash1'})
+        self.assertIsNone(self.cache.get(HashCache.stat(self.file_path), ['md5', 'sha256']))
+
+    def testNegChangedFile(self):
+        self.cache.set(HashCache.stat(self.file_path), {'md5': 'hash1'})
+        self._write(self.file_path, 'abcd')
+        self.assertIsNone(self.cache.get(HashCache.stat(self.file_path), ['md5']))
+
+    def testNegChangedModificationTime(self):
+        file_stat = HashCache.stat(self.file_path)
+        self.cache.set(file_stat, {'md5': 'hash1'})
+        os.utime(self.file_path, (time.time(), file_stat[3]/1e9 + 10))
+        self.assertIsNone(self.cache.get(HashCache.stat(self.file_path), ['md5']))
+
+    def testEvictsLeastRecentlyUsed(self):
+        cache = HashCache(os.path.join(self.tmp_dir, 'small.sqlite3'), max_entries=10)
+        file_stats = []
+        for i in range(11):
+            path = os.path.join(self.tmp_dir, 'file%s' % i)
+            self._write(path, str(i))
+            file_stats.append(HashCache.stat(path))
+            cache.set(file_stats[-1], {'md5': str(i)})
+            # Keep the first entry in use
+            cache.get(file_stats[0], ['md5'])
+            time.sleep(0.01)
+        self.assertEqual(cache.get(file_stats[0], ['md5']), {'md5': '0'})
+        self.assertIsNone(cache.get(file_stats[1], ['md5']))
+        self.assertEqual(cache.get(file_stats[10], ['md5']), {'md5': '10'})
@@ -0,0 +1,105 @@
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from loom.common import hashes
+from loom.common.exceptions import UnrecognizedHashFunctionError
+
+
+# Known answers. Hash function definitions must never change, since their
+# names are stored with FileContents.
+MD5_ABC = '900150983cd24fb0d6963f7d28e17f72'
+SHA256_ABC = 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'
+# RFC 7693, Appendix A
+BLAKE2B_ABC = 'ba80a53f981c4d0d6a2797b69f12f6e94c212f14685ac4b74b12bb6fdbffa2d1'\
+              '7d87c5392aab792dc252d5de4533cc9518d38aa8dbf1925ab92386edd4009923'
+# md5 of the md5 digest of the only chunk
+MD5_TREE_ABC = 'af5da9f45af7a300e3aded972f8ff687'
+# md5 of the concatenated md5 digests of "abcd", "efgh" and "ij"
+MD5_TREE_ABCDEFGHIJ_CHUNK_SIZE_4 = '446feba4c1b5cc7ad93bf4d44a0e36ac'
+# No chunks, so md5 of nothing
+MD5_TREE_EMPTY = 'd41d8cd98f00b204e9800998ecf8427e'
+
+
+class TestHashes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tree_chunk_size = hashes.TREE_CHUNK_SIZE
+
+    def tearDown(self):
+        hashes.TREE_CHUNK_SIZE = self.tree_chunk_size
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, data):
+        path = os.path.join(self.tmp_dir, 'file')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _get_all_hashes(self, path, hash_function):
+        """Returns the hash of the file from each way of calculating it"""
+        copied = StringIO.StringIO()
+        tree_hash = hashes.new_hash(hash_function)
+        with open(path, 'rb') as f:
+            tree_hash.update(f.read())
+        return [
+            hashes.calculate_hashes(path, [hash_function])[hash_function],
+            hashes.calculate_hashes(path, [hash_function, 'md5'])[hash_function],
+            hashes.copy_and_calculate_hashes(path, copied, [hash_function])[hash_function],
+            tree_hash.hexdigest(),
+        ]
+
+    def testMd5(self):
+        path = self._write('abc')
+        self.assertEqual(self._get_all_hashes(path, 'md5'), [MD5_ABC]*4)
+
+    def testSha256(self):
+        path = self._write('abc')
+        self.assertEqual(self._get_all_hashes(path, 'sha256'), [SHA256_ABC]*4)
+
+    def testBlake2b(self):
+        try:
+            hashes.new_hash('blake2b')
+        except UnrecognizedHashFunctionError:
+            self.skipTest('blake2b needs Python 3.6 or pyblake2')
+        path = self._write('abc')
+        self.assertEqual(self._get_all_hashes(path, 'blake2b'), [BLAKE2B_ABC]*4)
+
+    def testMd5Tree(self):
+        path = self._write('abc')
+        self.assertEqual(hashes.calculate_tree_hash(path, 'md5-tree'), MD5_TREE_ABC)
+        self.assertEqual(self._get_all_hashes(path, 'md5-tree'), [MD5_TREE_ABC]*4)
+
+    def testMd5TreeMultipleChunks(self):
+        hashes.TREE_CHUNK_SIZE = 4
+        path = self._write('abcdefghij')
+        for threads in [1, 3]:
+            self.assertEqual(hashes.calculate_tree_hash(path, 'md5-tree', threads=threads),
+                             MD5_TREE_ABCDEFGHIJ_CHUNK_SIZE_4)
+        self.assertEqual(self._get_all_hashes(path, 'md5-tree'),
+                         [MD5_TREE_ABCDEFGHIJ_CHUNK_SIZE_4]*4)
+
+    def testMd5TreeChunkBoundaries(self):
+        # Updates that end inside, at, and across chunk boundaries
+        hashes.TREE_CHUNK_SIZE = 4
+        tree_hash = hashes.new_hash('md5-tree')
+        for data in ['ab', 'cd', 'efghi', 'j']:
+            tree_hash.update(data)
+        self.assertEqual(tree_hash.hexdigest(), MD5_TREE_ABCDEFGHIJ_CHUNK_SIZE_4)
+
+    def testMd5TreeEmptyFile(self):
+        path = self._write('')
+        self.assertEqual(self._get_all_hashes(path, 'md5-tree'), [MD5_TREE_EMPTY]*4)
+
+    def testCopyAndCalculateHashesCopies(self):
+        path = self._write('abc')
+        copied = StringIO.StringIO()
+        hashes.copy_and_calculate_hashes(path, copied, ['md5', 'md5-tree'])
+        self.assertEqual(copied.getvalue(), 'abc')
+
+    def testNegUnrecognizedHashFunction(self):
+        with self.assertRaises(UnrecognizedHashFunctionError):
+            hashes.new_hash('md4')
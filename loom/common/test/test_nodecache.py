@@ -0,0 +1,124 @@
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from loom.common import gcs
+from loom.common.exceptions import HashMismatchError
+from loom.common.filehandler import GoogleCloudFileHandler
+from loom.common.nodecache import NodeCache
+
+
+def file_contents(data):
+    return {'hash_function': 'md5', 'hash_value': hashlib.md5(data).hexdigest()}
+
+
+class TestNodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = NodeCache(os.path.join(self.tmp_dir, 'cache'), 10)
+        self.populated = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _populate_with(self, data):
+        def populate(path):
+            self.populated.append(data)
+            with open(path, 'wb') as f:
+                f.write(data)
+        return populate
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def testAcquire(self):
+        (path, hit) = self.cache.acquire(
+            file_contents('abc'), self._populate_with('abc'), 'task1')
+        self.assertFalse(hit)
+        self.assertEqual(self._read(path), 'abc')
+        (path_2, hit) = self.cache.acquire(
+            file_contents('abc'), self._populate_with('abc'), 'task2')
+        self.assertTrue(hit)
+        self.assertEqual(path_2, path)
+        self.assertEqual(self.populated, ['abc'])
+
+    def testEntriesAreReadOnly(self):
+        (path, hit) = self.cache.acquire(
+            file_contents('abc'), self._populate_with('abc'), 'task1')
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0444)
+
+    def testNegHashMismatch(self):
+        with self.assertRaises(HashMismatchError):
+            self.cache.acquire(
+                file_contents('abc'), self._populate_with('abd'), 'task1')
+        self.assertEqual(os.listdir(self.cache.objects_dir), [])
+        self.assertEqual(os.listdir(self.cache.tmp_dir), [])
+        # The next task downloads it again
+        (path, hit) = self.cache.acquire(
+            file_contents('abc'), self._populate_with('abc'), 'task1')
+        self.assertFalse(hit)
+        self.assertEqual(self._read(path), 'abc')
+
+    def testEvictSkipsHeldEntries(self):
+        (held_path, hit) = self.cache.acquire(
+            file_contents('0123456789'), self._populate_with('0123456789'), 'task1')
+        # Both are held, so the cache stays over max_bytes
+        (path, hit) = self.cache.acquire(
+            file_contents('abcdefghij'), self._populate_with('abcdefghij'), 'task2')
+        self.assertTrue(os.path.exists(held_path))
+        self.cache.release('task2')
+        self.assertEqual(self.cache.evict(), 10)
+        self.assertTrue(os.path.exists(held_path))
+        self.assertFalse(os.path.exists(path))
+
+
+class TestStageFromNodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        store = gcs.FakeObjectStore(os.path.join(self.tmp_dir, 'store'))
+        self.data = os.urandom(1000)
+        source_path = os.path.join(self.tmp_dir, 'source')
+        with open(source_path, 'wb') as f:
+            f.write(self.data)
+        contents = file_contents(self.data)
+        gcs.upload_file(store, source_path, 'bucket', 'path/file', contents['hash_value'])
+        self.location = {
+            'file_contents': contents,
+            'project_id': 'project',
+            'bucket_id': 'bucket',
+            'blob_path': 'path/file',
+        }
+        self.cache = NodeCache(os.path.join(self.tmp_dir, 'cache'), 10**6)
+        self.filehandler = GoogleCloudFileHandler(
+            'http://127.0.0.1:8000', {}, object_store=store, use_hash_cache=False,
+            node_cache=self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testStageIsNotLinkedToEntry(self):
+        local_path = os.path.join(self.tmp_dir, 'input')
+        result = self.filehandler.stage(self.location, local_path, cache_holder='task1')
+        self.assertIn(result['strategy'], ['reflink', 'copy'])
+        self.assertNotEqual(os.stat(local_path).st_ino,
+                            os.stat(result['source_path']).st_ino)
+        # A task that rewrites its input leaves the entry intact
+        os.chmod(local_path, 0644)
+        with open(local_path, 'wb') as f:
+            f.write('changed')
+        with open(result['source_path'], 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def testStageBindMount(self):
+        local_path = os.path.join(self.tmp_dir, 'input')
+        result = self.filehandler.stage(
+            self.location, local_path, bind_mount=self.filehandler.BIND_MOUNT_FIRST,
+            cache_holder='task1')
+        self.assertEqual(result['strategy'], 'bind_mount')
+        self.assertFalse(os.path.exists(local_path))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis.scheduler import Scheduler
+from loomdaemon import loom_daemon_logger
+
+
+class Command(BaseCommand):
+    help = 'Runs the scheduler, which updates StepRuns and dispatches TaskRuns as events arrive'
+
+    def add_arguments(self, parser):
+        # Named (optional) arguments
+        parser.add_argument('--logfile',
+            dest='logfile',
+            default=None,
+            help='Log file path')
+
+    def handle(self, *args, **options):
+        logfile = options.get('logfile')
+        logger = loom_daemon_logger.get_logger(logfile)
+        logger.info('Starting scheduler')
+        try:
+            Scheduler().run_forever()
+        except Exception as e:
+            logger.exception(e)
+            raise
@@ -0,0 +1,34 @@
+import zlib
+
+from django.conf import settings
+from django.http import JsonResponse
+
+
+class GzipRequestMiddleware(object):
+    """Decompress request bodies sent with "Content-Encoding: gzip". Clients
+    compress large structs, such as bulk uploads of file data objects.
+    Bodies that expand beyond MAX_DECOMPRESSED_REQUEST_BYTES are rejected
+    without being expanded further.
+    """
+
+    def process_request(self, request):
+        if request.META.get('HTTP_CONTENT_ENCODING', '').lower() != 'gzip':
+            return None
+        max_bytes = settings.MAX_DECOMPRESSED_REQUEST_BYTES
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(request.body, max_bytes)
+            # Input is left over only if the output reached max_bytes
+            if not decompressor.unconsumed_tail:
+                body += decompressor.flush()
+        except zlib.error as e:
+            return JsonResponse({'message': 'Invalid gzip request body. %s' % e}, status=400)
+        if decompressor.unconsumed_tail or len(body) > max_bytes:
+            return JsonResponse(
+                {'message': 'Decompressed request body is larger than %s bytes' % max_bytes},
+                status=413)
+        # Views read request.body, which is cached in _body
+        request._body = body
+        del request.META['HTTP_CONTENT_ENCODING']
+        request.META['CONTENT_LENGTH'] = str(len(request._body))
+        return None
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import universalmodels.fields
+
+
+SUBCLASSES = {
+    'DataObject': [
+        'DataObjectArray',
+        'FileDataObject',
+        'JSONDataObject',
+        'StringDataObject',
+        'BooleanDataObject',
+        'IntegerDataObject',
+    ],
+    'FileStorageLocation': [
+        'ServerStorageLocation',
+        'GoogleCloudStorageLocation',
+    ],
+    'RequestedEnvironment': [
+        'RequestedDockerEnvironment',
+    ],
+    'TaskDefinitionEnvironment': [
+        'TaskDefinitionDockerEnvironment',
+    ],
+}
+
+
+def backfill_concrete_type(apps, schema_editor):
+    for (base_name, subclass_names) in SUBCLASSES.iteritems():
+        Base = apps.get_model('analysis', base_name)
+        for subclass_name in subclass_names:
+            Subclass = apps.get_model('analysis', subclass_name)
+            Base.objects.filter(pk__in=Subclass.objects.values('pk'))\
+                .update(_concrete_type='analysis.%s' % subclass_name.lower())
+        Base.objects.filter(_concrete_type='')\
+            .update(_concrete_type='analysis.%s' % base_name.lower())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataobject',
+            name='_concrete_type',
+            field=universalmodels.fields.ConcreteTypeField(default=b'', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='filestoragelocation',
+            name='_concrete_type',
+            field=universalmodels.fields.ConcreteTypeField(default=b'', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='requestedenvironment',
+            name='_concrete_type',
+            field=universalmodels.fields.ConcreteTypeField(default=b'', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='taskdefinitionenvironment',
+            name='_concrete_type',
+            field=universalmodels.fields.ConcreteTypeField(default=b'', max_length=255, editable=False, blank=True),
+        ),
+        migrations.RunPython(backfill_concrete_type,
+                             migrations.RunPython.noop),
+    ]
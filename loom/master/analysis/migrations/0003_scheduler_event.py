@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import analysis.models.base
+import universalmodels.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0002_concrete_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerEvent',
+            fields=[
+                ('_id', models.UUIDField(default=universalmodels.models.uuid_str, serialize=False, editable=False, primary_key=True)),
+                ('datetime_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('datetime_updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('event_type', models.CharField(max_length=255, choices=[(b'workflow_run_created', b'WorkflowRun created'), (b'data_object_added', b'Channel received a DataObject'), (b'task_run_result', b'TaskRun result submitted')])),
+                ('target_id', models.CharField(max_length=255)),
+                ('status', models.CharField(default=b'pending', max_length=255, db_index=True, choices=[(b'pending', b'Pending'), (b'processed', b'Processed')])),
+                ('datetime_processed', models.DateTimeField(null=True)),
+                ('dispatch_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, analysis.models.base._ModelMixin),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import universalmodels.fields
+
+
+def backfill_counters(apps, schema_editor):
+    Channel = apps.get_model('analysis', 'Channel')
+    Subchannel = apps.get_model('analysis', 'Subchannel')
+    StepRun = apps.get_model('analysis', 'StepRun')
+    for subchannel in Subchannel.objects.all():
+        subchannel.data_object_count = subchannel.data_objects.count()
+        subchannel.save(update_fields=['data_object_count'])
+    closed_subchannel_ids = set(
+        Subchannel.objects.filter(
+            pk__in=Channel.objects.filter(is_closed_to_new_data=True)\
+            .values('subchannels')).values_list('pk', flat=True))
+    for step_run in StepRun.objects.all():
+        step_run.nonempty_input_count = 0
+        step_run.closed_input_count = 0
+        for step_run_input in step_run.step_run_inputs.all():
+            subchannel = step_run_input.subchannel
+            if subchannel is None:
+                continue
+            if subchannel.data_object_count > 0:
+                step_run.nonempty_input_count += 1
+            elif subchannel.pk in closed_subchannel_ids:
+                step_run.closed_input_count += 1
+        step_run.outstanding_task_run_count = step_run.task_runs.exclude(
+            status='completed').count()
+        step_run.save(update_fields=['nonempty_input_count',
+                                     'closed_input_count',
+                                     'outstanding_task_run_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0003_scheduler_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='steprun',
+            name='closed_input_count',
+            field=universalmodels.fields.CounterField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='steprun',
+            name='nonempty_input_count',
+            field=universalmodels.fields.CounterField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='steprun',
+            name='outstanding_task_run_count',
+            field=universalmodels.fields.CounterField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subchannel',
+            name='data_object_count',
+            field=universalmodels.fields.CounterField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import universalmodels.models
+import django.utils.timezone
+import analysis.models.base
+import universalmodels.fields
+
+
+def backfill_subchannel_items(apps, schema_editor):
+    # Until now, data_objects held only the items not yet popped
+    Subchannel = apps.get_model('analysis', 'Subchannel')
+    SubchannelItem = apps.get_model('analysis', 'SubchannelItem')
+    for subchannel in Subchannel.objects.all():
+        data_objects = list(subchannel.data_objects.all())
+        SubchannelItem.objects.bulk_create([
+            SubchannelItem(subchannel=subchannel, data_object=data_object,
+                           position=position)
+            for (position, data_object) in enumerate(data_objects)])
+        subchannel.next_position = len(data_objects)
+        subchannel.consumed_position = 0
+        subchannel.save(update_fields=['next_position', 'consumed_position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0004_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubchannelItem',
+            fields=[
+                ('_id', models.UUIDField(default=universalmodels.models.uuid_str, serialize=False, editable=False, primary_key=True)),
+                ('datetime_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('datetime_updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('position', models.IntegerField()),
+                ('data_object', models.ForeignKey(related_name='+', to='analysis.DataObject')),
+            ],
+            bases=(models.Model, analysis.models.base._ModelMixin),
+        ),
+        migrations.AddField(
+            model_name='subchannel',
+            name='consumed_position',
+            field=universalmodels.fields.CounterField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subchannel',
+            name='next_position',
+            field=universalmodels.fields.CounterField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subchannelitem',
+            name='subchannel',
+            field=models.ForeignKey(related_name='items', to='analysis.Subchannel'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='subchannelitem',
+            unique_together=set([('subchannel', 'position')]),
+        ),
+        migrations.RunPython(backfill_subchannel_items,
+                             migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='subchannel',
+            name='data_object_count',
+        ),
+    ]
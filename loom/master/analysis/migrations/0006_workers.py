@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import analysis.models.base
+import universalmodels.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0005_subchannel_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Worker',
+            fields=[
+                ('_id', models.UUIDField(default=universalmodels.models.uuid_str, serialize=False, editable=False, primary_key=True)),
+                ('datetime_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('datetime_updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('worker_name', models.CharField(max_length=255)),
+                ('cores', models.IntegerField()),
+                ('memory', models.CharField(max_length=255, blank=True)),
+                ('disk_space', models.CharField(max_length=255, blank=True)),
+                ('datetime_heartbeat', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, analysis.models.base._ModelMixin),
+        ),
+        migrations.AddField(
+            model_name='taskrunlocation',
+            name='lease_expires',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='taskrunlocation',
+            name='worker',
+            field=models.ForeignKey(related_name='task_run_locations', to='analysis.Worker', null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import universalmodels.models
+import django.utils.timezone
+import analysis.models.base
+import universalmodels.fields
+
+
+def add_completed_task_runs(apps, schema_editor):
+    TaskRun = apps.get_model('analysis', 'TaskRun')
+    ResultCacheEntry = apps.get_model('analysis', 'ResultCacheEntry')
+    for task_run in TaskRun.objects.filter(status='completed'):
+        ResultCacheEntry.objects.create(
+            task_definition_id=task_run.task_definition_id,
+            task_run=task_run)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0006_workers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultCacheEntry',
+            fields=[
+                ('_id', models.UUIDField(default=universalmodels.models.uuid_str, serialize=False, editable=False, primary_key=True)),
+                ('datetime_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('datetime_updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('hit_count', universalmodels.fields.CounterField(default=0, editable=False)),
+                ('task_definition', models.ForeignKey(related_name='result_cache_entries', to='analysis.TaskDefinition')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, analysis.models.base._ModelMixin),
+        ),
+        migrations.AddField(
+            model_name='taskrun',
+            name='result_cache_status',
+            field=models.CharField(max_length=255, null=True, choices=[(b'hit', b'Outputs copied from a cached TaskRun'), (b'miss', b'No cached TaskRun was available')]),
+        ),
+        migrations.AddField(
+            model_name='workflowrun',
+            name='use_result_cache',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='resultcacheentry',
+            name='task_run',
+            field=models.ForeignKey(related_name='result_cache_entries', to='analysis.TaskRun'),
+        ),
+        migrations.RunPython(add_completed_task_runs,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import analysis.models.base
+import universalmodels.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0007_result_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileContentsAlias',
+            fields=[
+                ('_id', models.UUIDField(default=universalmodels.models.uuid_str, serialize=False, editable=False, primary_key=True)),
+                ('datetime_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('datetime_updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('alias', models.ForeignKey(related_name='aliased_by', to='analysis.FileContents')),
+                ('file_contents', models.ForeignKey(related_name='aliases', to='analysis.FileContents')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, analysis.models.base._ModelMixin),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0008_file_contents_alias'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='subchannel',
+            name='data_objects',
+        ),
+    ]
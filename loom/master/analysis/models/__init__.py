@@ -2,4 +2,7 @@ from .data_objects import *
 from .workflows import *
 from .workflow_runs import *
 from .task_runs import *
+from .workers import *
 from .task_definitions import *
+from .scheduler import *
+from .result_cache import *
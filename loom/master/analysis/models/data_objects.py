@@ -1,3 +1,5 @@
+from django.db.models import Q
+
 from analysis.exceptions import DataObjectValidationError
 from analysis.models.base import AnalysisAppInstanceModel, \
     AnalysisAppImmutableModel
@@ -9,7 +11,8 @@ class DataObject(AnalysisAppImmutableModel):
     This may be a file, an array of files, a JSON data object, 
     or an array of JSON objects.
     """
-    pass
+
+    _concrete_type = fields.ConcreteTypeField()
 
 
 class DataSourceRecord(AnalysisAppInstanceModel):
@@ -62,13 +65,45 @@ class FileDataObject(DataObject):
 
 class FileContents(AnalysisAppImmutableModel):
     """Represents file contents, identified by a hash. Ignores file name.
+    The same contents hashed with another function are a different
+    FileContents, unless a FileContentsAlias links the two.
     """
 
     hash_value = fields.CharField(max_length=100)
     hash_function = fields.CharField(max_length=100)
 
     def has_storage_location(self):
-        return self.file_storage_locations.exists()
+        return FileStorageLocation.objects.filter(
+            file_contents_id__in=self.get_equivalent_ids()).exists()
+
+    def get_equivalent_ids(self):
+        return self.get_equivalent_ids_by_contents([self._id])[self._id]
+
+    @classmethod
+    def get_equivalent_ids_by_contents(cls, contents_ids):
+        """Returns {contents_id: set of ids of the same contents under any
+        hash function, including contents_id}, with a single query.
+        """
+        equivalents = dict((contents_id, set([contents_id])) for contents_id in contents_ids)
+        links = FileContentsAlias.objects.filter(
+            Q(file_contents_id__in=contents_ids) | Q(alias_id__in=contents_ids))\
+            .values_list('file_contents_id', 'alias_id')
+        for (contents_id, alias_id) in links:
+            if contents_id in equivalents:
+                equivalents[contents_id].add(alias_id)
+            if alias_id in equivalents:
+                equivalents[alias_id].add(contents_id)
+        return equivalents
+
+
+class FileContentsAlias(AnalysisAppInstanceModel):
+    """Records that file_contents has the hash given by alias under another
+    hash function, so that the file need not be stored again when servers or
+    clients change hash functions.
+    """
+
+    file_contents = fields.ForeignKey('FileContents', related_name='aliases')
+    alias = fields.ForeignKey('FileContents', related_name='aliased_by')
 
 
 class FileStorageLocation(AnalysisAppInstanceModel):
@@ -76,11 +111,13 @@ class FileStorageLocation(AnalysisAppInstanceModel):
     of file contents can be found.
     """
 
+    _concrete_type = fields.ConcreteTypeField()
     file_contents = fields.ForeignKey('FileContents', null=True, related_name='file_storage_locations')
 
     @classmethod
     def get_by_file(self, file):
-        locations = self.objects.filter(file_contents=file.file_contents).all()
+        locations = self.objects.filter(
+            file_contents_id__in=file.file_contents.get_equivalent_ids()).all()
         return locations
 
     
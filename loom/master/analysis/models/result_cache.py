@@ -0,0 +1,78 @@
+"""The result cache. Identical analysis has the same TaskDefinition _id, so a
+completed TaskRun can stand in for later TaskRuns with that _id.
+"""
+
+from django.conf import settings
+
+from analysis.models.base import AnalysisAppInstanceModel
+from universalmodels import fields
+
+
+class ResultCacheEntry(AnalysisAppInstanceModel):
+    """ResultCacheEntry records a completed TaskRun whose outputs can be
+    reused by new TaskRuns with the same TaskDefinition. An entry is only used
+    while all of its outputs are still available.
+    """
+
+    task_definition = fields.ForeignKey('TaskDefinition', related_name='result_cache_entries')
+    task_run = fields.ForeignKey('TaskRun', related_name='result_cache_entries')
+    hit_count = fields.CounterField()
+
+    @classmethod
+    def is_enabled(cls):
+        return settings.RESULT_CACHE_ENABLED
+
+    @classmethod
+    def add(cls, task_run):
+        return cls.objects.create(
+            task_definition=task_run.task_definition,
+            task_run=task_run)
+
+    @classmethod
+    def lookup(cls, task_definition):
+        """Returns the newest entry for task_definition whose outputs are
+        all available, or None.
+        """
+        entries = cls.objects.filter(task_definition=task_definition)\
+            .order_by('-datetime_created')
+        for entry in entries:
+            if entry.is_available():
+                return entry
+        return None
+
+    @classmethod
+    def invalidate(cls, task_definition_id=None):
+        """Delete the entries for one TaskDefinition, or all entries if no
+        _id is given. Returns the number deleted.
+        """
+        entries = cls.objects.all()
+        if task_definition_id is not None:
+            entries = entries.filter(task_definition___id=task_definition_id)
+        count = entries.count()
+        entries.delete()
+        return count
+
+    def is_available(self):
+        for output in self.task_run.task_run_outputs.all():
+            if output.data_object is None:
+                return False
+            if not output.data_object.downcast().is_available():
+                return False
+        return True
+
+    def get_outputs(self):
+        """Returns {task_definition_output_id: data_object}"""
+        return dict((output.task_definition_output._id, output.data_object)
+                    for output in self.task_run.task_run_outputs.all())
+
+    def record_hit(self):
+        self.increment_counters(hit_count=1)
+
+    def get_summary(self):
+        return {
+            '_id': str(self._id),
+            'task_definition_id': self.task_definition._id,
+            'task_run_id': str(self.task_run._id),
+            'hit_count': self.hit_count,
+            'datetime_created': self.datetime_created.isoformat(),
+        }
@@ -0,0 +1,53 @@
+"""SchedulerEvent, the durable queue of work for the scheduler."""
+
+import uuid
+
+from analysis.models.base import AnalysisAppInstanceModel
+from universalmodels import fields
+
+
+class SchedulerEvent(AnalysisAppInstanceModel):
+    """SchedulerEvent records a state change that may allow new work to be
+    dispatched. Events are written in the same transaction as the change
+    itself, so none are lost if the scheduler is down, and are marked
+    processed once the StepRuns they affect have been evaluated.
+    """
+
+    WORKFLOW_RUN_CREATED = 'workflow_run_created'
+    DATA_OBJECT_ADDED = 'data_object_added'
+    TASK_RUN_RESULT = 'task_run_result'
+
+    event_type = fields.CharField(
+        max_length=255,
+        choices=((WORKFLOW_RUN_CREATED, 'WorkflowRun created'),
+                 (DATA_OBJECT_ADDED, 'Channel received a DataObject'),
+                 (TASK_RUN_RESULT, 'TaskRun result submitted'),
+        )
+    )
+    # _id of the WorkflowRun, Channel, or TaskRun that changed
+    target_id = fields.CharField(max_length=255)
+    status = fields.CharField(
+        max_length=255,
+        default='pending',
+        db_index=True,
+        choices=(('pending', 'Pending'),
+                 ('processed', 'Processed'),
+        )
+    )
+    datetime_processed = fields.DateTimeField(null=True)
+    # Number of TaskRuns dispatched while processing this event
+    dispatch_count = fields.IntegerField(default=0)
+
+    @classmethod
+    def enqueue(cls, event_type, target):
+        return cls.create({
+            'event_type': event_type,
+            'target_id': uuid.UUID(str(target._id)).hex
+        })
+
+    @classmethod
+    def get_pending(cls, count=None):
+        events = cls.objects.filter(status='pending').order_by('datetime_created')
+        if count is not None:
+            return events[:count]
+        return events
@@ -26,7 +26,7 @@ class TaskDefinition(AnalysisAppImmutableModel):
 
 class TaskDefinitionEnvironment(AnalysisAppImmutableModel):
 
-    pass
+    _concrete_type = fields.ConcreteTypeField()
 
 
 class TaskDefinitionDockerEnvironment(TaskDefinitionEnvironment):
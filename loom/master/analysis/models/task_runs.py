@@ -1,14 +1,26 @@
+import datetime
+from django.conf import settings
 from django.core import exceptions
+from django.db import transaction
+from django.utils import timezone
+import uuid
 
 from analysis.models.base import AnalysisAppInstanceModel, AnalysisAppImmutableModel
 from analysis.models.task_definitions import *
 from analysis.models.data_objects import DataObject
+from analysis.models.result_cache import ResultCacheEntry
+from analysis.models.scheduler import SchedulerEvent
+from analysis.models.workers import Worker, subtract_resources
 from analysis.models.workflows import Step
 from analysis.task_manager.factory import TaskManagerFactory
 from analysis.task_manager.dummy import DummyTaskManager
 from universalmodels import fields
 
 
+# Number of ready TaskRuns examined per TaskRun requested in a lease
+LEASE_SCAN_FACTOR = 10
+
+
 class TaskRun(AnalysisAppInstanceModel):
     """One instance of executing a TaskDefinition, i.e. executing a Step on a particular set
     of inputs.
@@ -30,11 +42,55 @@ class TaskRun(AnalysisAppInstanceModel):
             ('canceled', 'Canceled')
         )
     )
+    # Whether outputs were copied from an earlier TaskRun. Null if the
+    # result cache was not consulted.
+    result_cache_status = fields.CharField(
+        max_length=255,
+        null=True,
+        choices=(
+            ('hit', 'Outputs copied from a cached TaskRun'),
+            ('miss', 'No cached TaskRun was available'),
+        )
+    )
 
-    def update(self, *args, **kwargs):
-        super(TaskRun, self).update(*args, **kwargs)
-        for output in self.task_run_outputs.all():
-            output.send_data_object_to_channels()
+    def update(self, update_json):
+        update_struct = self._any_to_struct(update_json)
+        was_completed = self.status == 'completed'
+        # Outputs only receive results in an update that includes them, so
+        # other updates, e.g. of status, do not read the outputs at all
+        check_outputs = 'task_run_outputs' in update_struct
+        if check_outputs:
+            had_result = set(output._id for output in self.task_run_outputs.all()
+                             if output.has_result())
+        with transaction.atomic():
+            super(TaskRun, self).update(update_struct)
+            if was_completed != (self.status == 'completed'):
+                self._update_step_run_counters(was_completed)
+                if self.status == 'completed' and self.result_cache_status != 'hit':
+                    ResultCacheEntry.add(self)
+            if not check_outputs:
+                return
+            has_new_result = False
+            for output in self.task_run_outputs.all():
+                # Send each result only once, so that later updates to the
+                # TaskRun do not add it to the channels again.
+                if output.has_result() and output._id not in had_result:
+                    output.send_data_object_to_channels()
+                    has_new_result = True
+            if has_new_result:
+                self.update_status()
+                SchedulerEvent.enqueue(SchedulerEvent.TASK_RUN_RESULT, self)
+
+    def _update_step_run_counters(self, was_completed):
+        try:
+            step_run = self.steprun
+        except exceptions.ObjectDoesNotExist:
+            # Not part of a StepRun
+            return
+        if was_completed:
+            step_run.increment_counters(outstanding_task_run_count=1)
+        else:
+            step_run.increment_counters(outstanding_task_run_count=-1)
         
     @classmethod
     def run_all(cls):
@@ -43,6 +99,9 @@ class TaskRun(AnalysisAppInstanceModel):
 
 
     def run(self):
+        if TaskManagerFactory.uses_leases():
+            # Workers lease TaskRuns that are ready_to_run
+            return
         self._add_task_run_location()
         task_manager = TaskManagerFactory.get_task_manager()
         # TODO: if StepRun -> TaskRun becomes ManyToMany, use this instead:
@@ -63,12 +122,111 @@ class TaskRun(AnalysisAppInstanceModel):
             task_manager = TaskManagerFactory.get_task_manager(test=True)
             task_manager.run(self, self.active_task_run_location._id, with_error=with_error)
 
-    def _add_task_run_location(self):
-        task_run_location = TaskRunLocation.create({})
+    @classmethod
+    def lease(cls, worker, count, available_cores):
+        """Assign up to 'count' TaskRuns that are ready to run and fit the
+        available cores to 'worker', oldest first. Memory and disk space
+        requested by the TaskRuns the worker already holds are subtracted
+        from what it registered. Returns a list of
+        (task_run, task_run_location).
+        """
+        leased = []
+        with transaction.atomic():
+            (available_memory, available_disk_space) = \
+                worker.get_free_resources(cls._get_leased_resources(worker))
+            # Scan past TaskRuns that do not fit, but not the whole queue
+            candidates = TaskRun.objects.select_for_update()\
+                .filter(status='ready_to_run')\
+                .order_by('datetime_created')[:count*LEASE_SCAN_FACTOR]
+            for task_run in candidates:
+                if len(leased) == count:
+                    break
+                resources = task_run.get_requested_resources()
+                if not worker.can_run(resources, available_cores,
+                                      available_memory, available_disk_space):
+                    continue
+                (available_memory, available_disk_space) = subtract_resources(
+                    available_memory, available_disk_space, [resources])
+                if resources is not None and resources.cores is not None:
+                    available_cores -= resources.cores
+                task_run._add_task_run_location(worker=worker)
+                leased.append((task_run, task_run.active_task_run_location))
+        return leased
+
+    @classmethod
+    def _get_leased_resources(cls, worker):
+        """Returns the RequestedResourceSets of the TaskRuns that 'worker'
+        holds leases on.
+        """
+        return [task_run.get_requested_resources() for task_run
+                in TaskRun.objects.filter(
+                    status='running',
+                    active_task_run_location__worker=worker)]
+
+    @classmethod
+    def expire_leases(cls):
+        """Make TaskRuns whose worker stopped sending heartbeats available
+        to be leased again.
+        """
+        expired = TaskRun.objects.filter(
+            status='running',
+            active_task_run_location__lease_expires__lt=timezone.now())
+        for task_run in expired:
+            task_run.update({
+                'status': 'ready_to_run',
+                'active_task_run_location': None
+            })
+        return len(expired)
+
+    def use_cached_result(self):
+        """If a TaskRun with the same TaskDefinition has completed and its
+        outputs are still available, copy those outputs and mark this TaskRun
+        completed without running it. Returns True on a cache hit.
+        """
+        entry = ResultCacheEntry.lookup(self.task_definition)
+        if entry is None:
+            self.update({'result_cache_status': 'miss'})
+            return False
+        self.update({'result_cache_status': 'hit'})
+        cached_outputs = entry.get_outputs()
+        for output in self.task_run_outputs.all():
+            output.add_data_object(
+                cached_outputs[output.task_definition_output._id])
+        self.update_status()
+        entry.record_hit()
+        return True
+
+    @classmethod
+    def get_result_cache_stats(cls):
+        return {
+            'enabled': ResultCacheEntry.is_enabled(),
+            'entries': ResultCacheEntry.objects.count(),
+            'hits': cls.objects.filter(result_cache_status='hit').count(),
+            'misses': cls.objects.filter(result_cache_status='miss').count(),
+        }
+
+    def get_requested_resources(self):
+        try:
+            return self.steprun.step.resources
+        except exceptions.ObjectDoesNotExist:
+            # Not part of a StepRun
+            return None
+
+    def _add_task_run_location(self, worker=None):
+        if worker is None:
+            task_run_location = TaskRunLocation.create({})
+        else:
+            # The foreign key is set directly. A nested struct would rewrite
+            # the Worker row, which its heartbeat updates concurrently.
+            task_run_location = TaskRunLocation.objects.create(
+                worker=worker,
+                lease_expires=TaskRunLocation.get_lease_expiration())
         self.task_run_locations.add(task_run_location)
         self.update({
             'status': 'running',
-            'active_task_run_location': task_run_location.to_struct()
+            # Only the _id, so that neither the location nor its Worker is
+            # rewritten
+            'active_task_run_location': {'_id': task_run_location._id}
         })
 
     def submit_result(self, output_id, data_object, task_run_location_id):
@@ -77,6 +235,8 @@ class TaskRun(AnalysisAppInstanceModel):
 
         output = self.task_run_outputs.get(_id=output_id)
         output.add_data_object(DataObject.create(data_object))
+        self.update_status()
+        SchedulerEvent.enqueue(SchedulerEvent.TASK_RUN_RESULT, self)
         return True
 
     def cancel(self):
@@ -91,11 +251,13 @@ class TaskRun(AnalysisAppInstanceModel):
         if not self._is_location_active(task_run_location_id):
             return False # Reject error
         self.update({'status': 'error'})
+        SchedulerEvent.enqueue(SchedulerEvent.TASK_RUN_RESULT, self)
 
     def _is_location_active(self, task_run_location_id):
         if self.active_task_run_location is None:
             return False
-        return self.active_task_run_location._id == task_run_location_id
+        return uuid.UUID(str(self.active_task_run_location._id)) == \
+            uuid.UUID(str(task_run_location_id))
         
     def update_status(self):
         for output in self.task_run_outputs.all():
@@ -130,6 +292,32 @@ class TaskRunOutput(AnalysisAppInstanceModel):
                 step_run_output.channel.add_data_object(self.data_object)
     
 class TaskRunLocation(AnalysisAppInstanceModel):
+    """Where a TaskRun was sent to run. Locations leased by a Worker expire
+    unless renewed by its heartbeat.
+    """
+
+    worker = fields.ForeignKey('Worker', null=True, related_name='task_run_locations')
+    lease_expires = fields.DateTimeField(null=True)
+
+    @classmethod
+    def get_lease_expiration(cls):
+        return timezone.now() + datetime.timedelta(
+            seconds=settings.WORKER_LEASE_SECONDS)
+
+    @classmethod
+    def renew_leases(cls, worker, task_run_location_ids):
+        """Extend the leases that 'worker' still holds. Returns the ids from
+        task_run_location_ids whose leases were lost, e.g. because they
+        expired or the TaskRun was canceled.
+        """
+        active_locations = cls.objects.filter(
+            _id__in=task_run_location_ids,
+            worker=worker,
+            active_task_run__isnull=False)
+        active_ids = set(location._id for location in active_locations)
+        active_locations.update(lease_expires=cls.get_lease_expiration())
+        return [location_id for location_id in task_run_location_ids
+                if uuid.UUID(str(location_id)) not in active_ids]
 
     def cancel(self):
         # TODO
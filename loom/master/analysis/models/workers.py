@@ -0,0 +1,93 @@
+"""Worker, a long-lived agent that leases TaskRuns from the server."""
+
+import re
+
+from django.utils import timezone
+
+from analysis.models.base import AnalysisAppInstanceModel
+from universalmodels import fields
+
+
+SIZE_UNITS_IN_GB = {
+    'K': 1.0/(1024*1024),
+    'M': 1.0/1024,
+    'G': 1.0,
+    'T': 1024.0,
+}
+
+
+def parse_size_gb(size):
+    """Convert a memory or disk size like '5G' or '512MB' to gigabytes.
+    Returns None if the size is missing or not understood.
+    """
+    if size is None:
+        return None
+    match = re.match(r'^\s*([0-9.]+)\s*([KMGT])B?\s*$', str(size), re.IGNORECASE)
+    if match is None:
+        return None
+    return float(match.group(1)) * SIZE_UNITS_IN_GB[match.group(2).upper()]
+
+
+def subtract_resources(memory, disk_space, resource_sets):
+    """Subtract the memory and disk space requested by each
+    RequestedResourceSet in resource_sets from memory and disk_space, given
+    in gigabytes. Returns the new (memory, disk_space). A limit that is None
+    stays None.
+    """
+    for resources in resource_sets:
+        if resources is None:
+            continue
+        if memory is not None:
+            memory -= parse_size_gb(resources.memory) or 0
+        if disk_space is not None:
+            disk_space -= parse_size_gb(resources.disk_space) or 0
+    return (memory, disk_space)
+
+
+class Worker(AnalysisAppInstanceModel):
+    """Worker records the capacity of a worker agent. The agent leases
+    TaskRuns that fit its capacity and keeps the leases alive with heartbeats.
+    """
+
+    NAME_FIELD = 'worker_name'
+
+    worker_name = fields.CharField(max_length=255)
+    cores = fields.IntegerField()
+    memory = fields.CharField(max_length=255, blank=True)
+    disk_space = fields.CharField(max_length=255, blank=True)
+    datetime_heartbeat = fields.DateTimeField(default=timezone.now)
+
+    def get_free_resources(self, leased_resources):
+        """Returns (memory, disk_space) in gigabytes that is not requested
+        by leased_resources, the RequestedResourceSets of the TaskRuns this
+        worker holds. Either is None if the worker did not report it.
+        """
+        return subtract_resources(parse_size_gb(self.memory),
+                                  parse_size_gb(self.disk_space),
+                                  leased_resources)
+
+    def can_run(self, requested_resources, available_cores,
+                available_memory=None, available_disk_space=None):
+        """True if a TaskRun with the given RequestedResourceSet fits in
+        available_cores, and in available_memory and available_disk_space,
+        given in gigabytes. Limits that are None are not checked.
+        """
+        if requested_resources is None:
+            return True
+        if requested_resources.cores is not None and \
+           requested_resources.cores > available_cores:
+            return False
+        for (requested, available) in [
+                (requested_resources.memory, available_memory),
+                (requested_resources.disk_space, available_disk_space)]:
+            requested = parse_size_gb(requested)
+            if requested is not None and available is not None and \
+               requested > available:
+                return False
+        return True
+
+    def heartbeat(self):
+        # datetime_updated changes too, since it versions the rendered Worker
+        now = timezone.now()
+        Worker.objects.filter(_id=self._id).update(
+            datetime_heartbeat=now, datetime_updated=now)
@@ -1,7 +1,12 @@
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+import logging
+from django.db.models import F
 from analysis.exceptions import *
 from analysis.models.base import AnalysisAppInstanceModel, AnalysisAppImmutableModel
 from analysis.models.data_objects import DataObject
+from analysis.models.scheduler import SchedulerEvent
+from analysis.models.result_cache import ResultCacheEntry
 from analysis.models.task_definitions import TaskDefinition
 from analysis.models.task_runs import TaskRun, TaskRunInput, TaskRunOutput
 from jinja2 import DictLoader, Environment
@@ -13,6 +18,8 @@ This module defines WorkflowRun and other classes related to
 receiving and running a request for analysis.
 """
 
+logger = logging.getLogger('loom')
+
 
 class WorkflowRun(AnalysisAppInstanceModel):
     """WorkflowRun represents a request to execute a Workflow on a particular
@@ -34,6 +41,8 @@ class WorkflowRun(AnalysisAppInstanceModel):
                  ('completed', 'Completed')
         )
     )
+    # Set to False to run every TaskRun even if identical results exist
+    use_result_cache = fields.BooleanField(default=True)
 
     @classmethod
     def update_status_for_all(cls):
@@ -45,6 +54,12 @@ class WorkflowRun(AnalysisAppInstanceModel):
             step_run.update_status()
         for output in self.workflow_run_outputs.all():
             output.update_status()
+        self.update_status_from_step_runs()
+
+    def update_status_from_step_runs(self):
+        """Set status from the current StepRun statuses without
+        re-evaluating the StepRuns themselves.
+        """
         step_run_statuses = [step_run.status for step_run in self.step_runs.all()]
         if all([status == 'completed' for status in step_run_statuses]):
             self.update({'status': 'completed'})
@@ -72,6 +87,7 @@ class WorkflowRun(AnalysisAppInstanceModel):
         workflow_run._sync_step_runs()
         workflow_run._sync_channels()
         # TODO Assign workflow status (probably w/ default field)
+        SchedulerEvent.enqueue(SchedulerEvent.WORKFLOW_RUN_CREATED, workflow_run)
         return workflow_run
 
     def _sync_outputs(self):
@@ -164,7 +180,7 @@ class WorkflowRun(AnalysisAppInstanceModel):
             channel_name = workflow_run_input.workflow_input.to_channel
             channel = self._get_channel_by_name(channel_name)
             channel.add_data_object(workflow_run_input.data_object)
-            channel.update({'is_closed_to_new_data': True})
+            channel.close()
 
     def get_workflow_run_input_by_name(self, input_name):
         return self.workflow_run_inputs.get(input_name=input_name)
@@ -203,6 +219,7 @@ class Channel(AnalysisAppInstanceModel):
     def add_data_object(self, data_object):
         for subchannel in self.subchannels.all():
             subchannel.add_data_object(data_object)
+        SchedulerEvent.enqueue(SchedulerEvent.DATA_OBJECT_ADDED, self)
     
     def create_subchannel(self, workflow_run_output_or_step_run_input):
         subchannel = Subchannel.create({'channel_name': self.channel_name})
@@ -210,31 +227,113 @@ class Channel(AnalysisAppInstanceModel):
         workflow_run_output_or_step_run_input.add_subchannel(subchannel)
 
     def close(self):
-        self.update({'is_closed_to_new_data': True})
+        with transaction.atomic():
+            if self.is_closed_to_new_data:
+                return
+            self.update({'is_closed_to_new_data': True})
+            for subchannel in self.subchannels.all():
+                if subchannel.is_empty():
+                    subchannel.get_step_runs().update(
+                        closed_input_count=F('closed_input_count')+1)
 
 
 class Subchannel(AnalysisAppInstanceModel):
     """Every channel can have only one source but 0 or many destinations, representing
     the possibility that a file produce by one step can be used by 0 or many other 
     steps. Each of these destinations has its own queue, implemented as a Subchannel.
+
+    The queue is stored as SubchannelItems, numbered in the order they were added.
+    Items before consumed_position have been popped. data_objects is rendered
+    from the items not yet popped.
     """
 
+    DERIVED_STRUCT_FIELDS = ['data_objects']
+
     channel_name = fields.CharField(max_length=255)
-    data_objects = fields.ManyToManyField('DataObject')
+    # Position that the next item added will take
+    next_position = fields.CounterField()
+    # Position of the oldest item not yet popped
+    consumed_position = fields.CounterField()
 
     def add_data_object(self, data_object):
-        self.data_objects.add(data_object)
+        with transaction.atomic():
+            # Incrementing first locks the row until the end of the
+            # transaction, so positions are never reused.
+            self.increment_counters(next_position=1)
+            SubchannelItem.objects.create(
+                subchannel=self,
+                data_object=data_object,
+                position=self.next_position-1)
+            if self.get_pending_count() == 1:
+                self.get_step_runs().update(
+                    nonempty_input_count=F('nonempty_input_count')+1)
+
+    def get_pending_data_objects(self):
+        """Returns the queued DataObjects, in order, without popping them"""
+        return [item.data_object for item in SubchannelItem.objects.filter(
+            subchannel=self, position__gte=self.consumed_position)\
+                .order_by('position').select_related('data_object')]
+
+    def _render_derived_field(self, field_name):
+        return DataObject.to_structs(self.get_pending_data_objects())
+
+    def get_pending_count(self):
+        return self.next_position - self.consumed_position
 
     def is_empty(self):
-        return self.data_objects.count() == 0
+        return self.get_pending_count() == 0
 
     def is_dead(self):
         return self.channel.is_closed_to_new_data and self.is_empty()
 
     def pop(self):
-        data_object = self.data_objects.first()
-        self.data_objects = self.data_objects.all()[1:]
-        return data_object
+        data_objects = self.pop_many(1)
+        if not data_objects:
+            return None
+        return data_objects[0]
+
+    def pop_many(self, count):
+        """Remove up to 'count' DataObjects from the front of the queue and
+        return them in order.
+        """
+        with transaction.atomic():
+            # Lock the cursor, so that concurrent callers get different items
+            self.refresh_counters(for_update=True)
+            items = list(
+                SubchannelItem.objects.filter(
+                    subchannel=self,
+                    position__gte=self.consumed_position,
+                    position__lt=self.consumed_position+count)\
+                .order_by('position').select_related('data_object'))
+            if not items:
+                return []
+            self.increment_counters(consumed_position=len(items))
+            if self.is_empty():
+                step_runs = self.get_step_runs()
+                step_runs.update(
+                    nonempty_input_count=F('nonempty_input_count')-1)
+                if self.channel.is_closed_to_new_data:
+                    step_runs.update(
+                        closed_input_count=F('closed_input_count')+1)
+        return [item.data_object for item in items]
+
+    def get_step_runs(self):
+        """Returns a queryset of the StepRuns that read from this Subchannel.
+        """
+        return StepRun.objects.filter(step_run_inputs__subchannel=self)
+
+
+class SubchannelItem(AnalysisAppInstanceModel):
+    """One entry in the queue of a Subchannel. The same DataObject may be
+    queued more than once.
+    """
+
+    subchannel = fields.ForeignKey('Subchannel', related_name='items')
+    data_object = fields.ForeignKey('DataObject', related_name='+')
+    position = fields.IntegerField()
+
+    class Meta:
+        unique_together = (('subchannel', 'position'),)
 
 
 class StepRun(AnalysisAppInstanceModel):
@@ -253,23 +352,34 @@ class StepRun(AnalysisAppInstanceModel):
                  ('error', 'Error'),
         )
     )
+    # Inputs whose Subchannel has data waiting
+    nonempty_input_count = fields.CounterField()
+    # Inputs whose Subchannel is closed and empty
+    closed_input_count = fields.CounterField()
+    # TaskRuns that have not completed
+    outstanding_task_run_count = fields.CounterField()
 
     def update_status(self):
-        while True:
-            if not self._are_inputs_ready():
-                break
-            else:
+        # Counters are kept by Subchannels and TaskRuns, so none of these
+        # checks depend on the number of TaskRuns or queued DataObjects.
+        # TaskRuns mark themselves completed when their results arrive.
+        while self._are_inputs_ready():
+            if self.status != 'running':
                 self.update({'status': 'running'})
-                self._create_task_run()
-        for task_run in self.task_runs.filter(status='ready_to_run') | self.task_runs.filter(status='running'):
-            task_run.update_status()
+            task_inputs = self._pop_task_inputs()
+            if not task_inputs:
+                # Another caller took the inputs, or nonempty_input_count
+                # was wrong and has been corrected
+                break
+            for input_data_objects in task_inputs:
+                self._create_task_run(input_data_objects)
         # Are input sources all finished?
-        if all([input.subchannel.is_dead() for input in self.step_run_inputs.all()]):
+        if self._are_inputs_closed():
             # Are all the lingering runs finished?
-            if all([task_run.status == 'completed' for task_run in self.task_runs.all()]):
+            if self.outstanding_task_run_count == 0:
                 #Then mark the StepRun completed and close all the channels it feeds
                 self._mark_completed()
-        if any([task_run.status == 'error' for task_run in self.task_runs.all()]):
+        if self.task_runs.filter(status='error').exists():
             self.update({'status': 'error'})
 
     def cancel(self):
@@ -283,31 +393,71 @@ class StepRun(AnalysisAppInstanceModel):
         self.update({'status': 'completed'})
 
     def _get_task_inputs(self):
-        if not self._are_inputs_ready():
+        task_inputs = self._pop_task_inputs(max_count=1)
+        if not task_inputs:
             raise MissingInputsError('Inputs are missing')
-        input_data_objects = []
-        for step_run_input in self.step_run_inputs.all():
-            name = step_run_input.step_input.from_channel
-            data_object = step_run_input.subchannel.pop()
-            input_data_objects.append((name, data_object))
-        return input_data_objects
+        return task_inputs[0]
+
+    def _pop_task_inputs(self, max_count=None):
+        """Take inputs for as many TaskRuns as are ready, up to max_count,
+        with one pop_many per input. Returns a list with one entry of the form
+        [(channel_name, data_object), ...] per TaskRun.
+
+        Returns an empty list if another caller took the inputs first. If
+        nonempty_input_count says that every input has data but some
+        Subchannel is empty, the counter is corrected from the pending
+        counts and an empty list is returned.
+        """
+        with transaction.atomic():
+            # Lock the StepRun, so that inputs popped together stay together
+            self.refresh_counters(for_update=True)
+            if not self._are_inputs_ready():
+                return []
+            step_run_inputs = list(self.step_run_inputs.all())
+            if not step_run_inputs:
+                return [[]]
+            pending_counts = [step_run_input.subchannel.get_pending_count()
+                              for step_run_input in step_run_inputs]
+            count = min(pending_counts)
+            if count == 0:
+                self._correct_nonempty_input_count(pending_counts)
+                return []
+            if max_count is not None:
+                count = min(count, max_count)
+            inputs_by_channel = []
+            for step_run_input in step_run_inputs:
+                name = step_run_input.step_input.from_channel
+                inputs_by_channel.append(
+                    [(name, data_object) for data_object
+                     in step_run_input.subchannel.pop_many(count)])
+        return [list(inputs) for inputs in zip(*inputs_by_channel)]
+
+    def _correct_nonempty_input_count(self, pending_counts):
+        nonempty_input_count = len([pending_count for pending_count
+                                    in pending_counts if pending_count > 0])
+        logger.warning(
+            'StepRun %s has nonempty_input_count %s but %s of %s inputs have '
+            'data. Correcting the counter.' % (
+                self._id, self.nonempty_input_count, nonempty_input_count,
+                len(pending_counts)))
+        self.increment_counters(
+            nonempty_input_count=nonempty_input_count-self.nonempty_input_count)
 
     def _are_inputs_ready(self):
-        if self.step_run_inputs.count() == 0:
+        input_count = self.step_run_inputs.count()
+        if input_count == 0:
             # Special case: Task has no inputs. We can't determine if this has been processed by
             # checking for an empty queue.
             # If there exists a healthy TaskRun, say no.
-            return self.task_runs.count() == 0
+            return not self.task_runs.exists()
         # Return False if any input channel has 0 items in queue
-        for step_run_input in self.step_run_inputs.all():
-            if step_run_input.subchannel.data_objects.count() == 0:
-                return False
-        return True
-
-    def _create_task_run(self):
-        # This has the form [(channel_name, data_object), ...]
-        input_data_objects = self._get_task_inputs()
-        
+        return self.nonempty_input_count == input_count
+
+    def _are_inputs_closed(self):
+        return self.closed_input_count == self.step_run_inputs.count()
+
+    def _create_task_run(self, input_data_objects):
+        # input_data_objects has the form [(channel_name, data_object), ...]
         task_run_inputs = self._create_task_run_inputs(input_data_objects)
         task_run_outputs = self._create_task_run_outputs()
         task_definition = self._create_task_definition(task_run_inputs, task_run_outputs)
@@ -319,6 +469,14 @@ class StepRun(AnalysisAppInstanceModel):
         })
         
         self.task_runs.add(task_run)
+        # Also reloads the input counters changed by popping the inputs
+        self.increment_counters(outstanding_task_run_count=1)
+        if self._use_result_cache() and task_run.use_cached_result():
+            # The TaskRun completed, and updated our counters
+            self.refresh_counters()
+
+    def _use_result_cache(self):
+        return ResultCacheEntry.is_enabled() and self.workflow_run.use_result_cache
 
     def _create_task_run_inputs(self, input_data_objects):
         task_run_inputs = []
@@ -42,7 +42,7 @@ class Step(AnalysisAppImmutableModel):
 
 class RequestedEnvironment(AnalysisAppImmutableModel):
 
-    pass
+    _concrete_type = fields.ConcreteTypeField()
 
 
 class RequestedDockerEnvironment(RequestedEnvironment):
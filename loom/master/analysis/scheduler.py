@@ -0,0 +1,198 @@
+"""The scheduler, which dispatches TaskRuns in response to SchedulerEvents."""
+
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from analysis.models import SchedulerEvent, StepRun, TaskRun, WorkflowRun
+
+
+logger = logging.getLogger('LoomDaemon')
+
+ACTIVE_STEP_RUN_STATUSES = ['waiting', 'running']
+
+
+class Scheduler(object):
+    """Events are recorded when a WorkflowRun is created, a Channel receives a
+    DataObject, or a TaskRun result is submitted, and only the StepRuns they
+    affect are evaluated. A full sweep is still made at a low frequency, to
+    recover from anything events missed.
+    """
+
+    def __init__(self, dispatch=None, batch_size=None,
+                 poll_interval_seconds=None, sweep_interval_seconds=None):
+        if dispatch is None:
+            dispatch = lambda task_run: task_run.run()
+        self.dispatch = dispatch
+        self.batch_size = self._get_setting(
+            batch_size, 'SCHEDULER_EVENT_BATCH_SIZE')
+        self.poll_interval_seconds = self._get_setting(
+            poll_interval_seconds, 'SCHEDULER_POLL_INTERVAL_SECONDS')
+        self.sweep_interval_seconds = self._get_setting(
+            sweep_interval_seconds, 'SCHEDULER_SWEEP_INTERVAL_SECONDS')
+        self._last_sweep = None
+
+    def _get_setting(self, value, setting_name):
+        if value is None:
+            return getattr(settings, setting_name)
+        return value
+
+    def run_forever(self):
+        while True:
+            try:
+                if self._is_sweep_due():
+                    self.sweep()
+                event_count = self.process_events()
+            except Exception as e:
+                logger.exception(e)
+                event_count = 0
+            if event_count == 0:
+                # Queue is empty, or failing. Wait before polling again.
+                time.sleep(self.poll_interval_seconds)
+
+    def _is_sweep_due(self):
+        return self._last_sweep is None or \
+            time.time() - self._last_sweep >= self.sweep_interval_seconds
+
+    def process_events(self):
+        """Evaluate the StepRuns affected by the oldest pending events and
+        dispatch any TaskRuns that become ready. Returns the number of events
+        processed.
+        """
+        with transaction.atomic():
+            events = list(SchedulerEvent.get_pending(self.batch_size))
+            if not events:
+                return 0
+            step_run_ids_by_event = {}
+            step_runs = {}
+            for event in events:
+                step_run_ids_by_event[event._id] = set()
+                for step_run in self._get_affected_step_runs(event):
+                    step_run_ids_by_event[event._id].add(step_run._id)
+                    step_runs[step_run._id] = step_run
+            workflow_runs = {}
+            for step_run in step_runs.values():
+                step_run.update_status()
+                workflow_runs[step_run.workflow_run._id] = step_run.workflow_run
+            for workflow_run in workflow_runs.values():
+                workflow_run.update_status_from_step_runs()
+            task_runs = self._get_ready_task_runs(step_runs.keys())
+        # Dispatch outside of the transaction so that TaskRuns that finish
+        # immediately see a consistent database.
+        dispatched_step_run_ids = []
+        for task_run in task_runs:
+            self.dispatch(task_run)
+            dispatched_step_run_ids.append(task_run.steprun._id)
+        self._mark_processed(
+            events, step_run_ids_by_event, dispatched_step_run_ids)
+        logger.debug('Processed %s scheduler events, dispatched %s TaskRuns'
+                     % (len(events), len(task_runs)))
+        return len(events)
+
+    def _get_affected_step_runs(self, event):
+        if event.event_type == SchedulerEvent.WORKFLOW_RUN_CREATED:
+            step_runs = StepRun.objects.filter(
+                workflow_run___id=event.target_id)
+        elif event.event_type == SchedulerEvent.DATA_OBJECT_ADDED:
+            step_runs = StepRun.objects.filter(
+                step_run_inputs__subchannel__channel___id=event.target_id)
+        elif event.event_type == SchedulerEvent.TASK_RUN_RESULT:
+            step_runs = StepRun.objects.filter(
+                task_runs___id=event.target_id)
+        else:
+            logger.error('Unknown scheduler event type "%s"'
+                         % event.event_type)
+            return []
+        return step_runs.filter(status__in=ACTIVE_STEP_RUN_STATUSES).distinct()
+
+    def _get_ready_task_runs(self, step_run_ids):
+        if not step_run_ids:
+            return []
+        return list(TaskRun.objects.filter(
+            steprun___id__in=step_run_ids, status='ready_to_run'))
+
+    def _mark_processed(self, events, step_run_ids_by_event,
+                        dispatched_step_run_ids):
+        now = timezone.now()
+        for event in events:
+            dispatch_count = len([step_run_id for step_run_id
+                                  in dispatched_step_run_ids
+                                  if step_run_id in step_run_ids_by_event[event._id]])
+            SchedulerEvent.objects.filter(_id=event._id).update(
+                status='processed',
+                datetime_processed=now,
+                dispatch_count=dispatch_count)
+
+    def sweep(self):
+        """Re-evaluate every running WorkflowRun and dispatch every ready
+        TaskRun, as the polling loop used to do on every iteration.
+        """
+        self._last_sweep = time.time()
+        logger.debug('Running scheduler safety sweep')
+        TaskRun.expire_leases()
+        WorkflowRun.update_status_for_all()
+        for task_run in TaskRun.objects.filter(status='ready_to_run'):
+            self.dispatch(task_run)
+        self.purge_processed_events()
+
+    def purge_processed_events(self):
+        cutoff = timezone.now() - datetime.timedelta(
+            seconds=settings.SCHEDULER_EVENT_RETENTION_SECONDS)
+        SchedulerEvent.objects.filter(
+            status='processed', datetime_processed__lt=cutoff).delete()
+
+    @classmethod
+    def get_metrics(cls, count=1000):
+        """Summarize the most recently processed events. Latency is the time
+        from an event being recorded, e.g. a TaskRun result being submitted,
+        to the dispatch of the TaskRuns it made ready.
+        """
+        events = SchedulerEvent.objects.filter(status='processed')\
+            .order_by('-datetime_processed')[:count]
+        latencies_by_type = {}
+        counts_by_type = {}
+        for event in events:
+            counts_by_type[event.event_type] = \
+                counts_by_type.get(event.event_type, 0) + 1
+            if event.dispatch_count > 0:
+                latency = event.datetime_processed - event.datetime_created
+                latencies_by_type.setdefault(event.event_type, []).append(
+                    latency.total_seconds())
+        pending = SchedulerEvent.get_pending()
+        oldest_pending = pending.first()
+        if oldest_pending is None:
+            oldest_pending_age_seconds = None
+        else:
+            oldest_pending_age_seconds = (
+                timezone.now() - oldest_pending.datetime_created).total_seconds()
+        metrics = {
+            'pending_events': pending.count(),
+            'oldest_pending_event_age_seconds': oldest_pending_age_seconds,
+            'events': {},
+        }
+        for (event_type, event_count) in counts_by_type.iteritems():
+            latencies = sorted(latencies_by_type.get(event_type, []))
+            metrics['events'][event_type] = {
+                'processed': event_count,
+                'dispatched': len(latencies),
+                'dispatch_latency_seconds': cls._summarize(latencies),
+            }
+        return metrics
+
+    @classmethod
+    def _summarize(cls, sorted_values):
+        if not sorted_values:
+            return None
+        def percentile(p):
+            return sorted_values[
+                min(len(sorted_values)-1, int(p*len(sorted_values)))]
+        return {
+            'mean': sum(sorted_values)/len(sorted_values),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'max': sorted_values[-1],
+        }
@@ -7,22 +7,30 @@ angular
 FileListController.$inject = ['$scope', '$http', 'Data', '$state'];
 
 function FileListController($scope, $http, Data, $state){
-    $http.get('/api/file_data_objects')
-	.success(function(response) {
-	    Data.files = response['file_data_objects'];
-	    $scope.files = Data.files;
-	    
-	    $scope.files.forEach(function(file) {
-		$http.get('/api/file_data_objects/' + file._id + '/data_source_records/')
-		    .then(function(response){
-			file['data_source_records'] = response['data']['data_source_records'];
-		    });
-		$http.get('/api/file_data_objects/' + file._id + '/file_storage_locations/')
-		    .then(function(response){
-			file['file_storage_locations'] = response['data']['file_storage_locations'];
-		    });
+    Data.files = [];
+    $scope.files = Data.files;
+    $scope.nextCursor = null;
+    $scope.loadMore = function() {
+	var params = {fields: '_id,file_name,file_contents.hash_value'};
+	if ($scope.nextCursor) {
+	    params.cursor = $scope.nextCursor;
+	}
+	$http.get('/api/file_data_objects/', {params: params})
+	    .success(function(response) {
+		$scope.nextCursor = response['next_cursor'];
+		response['file_data_objects'].forEach(function(file) {
+		    Data.files.push(file);
+		    $http.get('/api/file_data_objects/' + file._id + '/data_source_records/')
+			.then(function(response){
+			    file['data_source_records'] = response['data']['data_source_records'];
+			});
+		    $http.get('/api/file_data_objects/' + file._id + '/file_storage_locations/')
+			.then(function(response){
+			    file['file_storage_locations'] = response['data']['file_storage_locations'];
+			});
+		});
 	    });
-	});
+    };
+    $scope.loadMore();
     $scope.$state = $state;
 };
-
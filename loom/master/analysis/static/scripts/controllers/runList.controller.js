@@ -7,9 +7,19 @@ angular
 RunListController.$inject = ['$scope', '$http', 'Data', '$state'];
 
 function RunListController($scope, $http, Data, $state) {
-    $http.get('/api/workflow_runs').success(function(response) {
-	Data.workflow_runs = response['workflow_runs'];
-	$scope.workflow_runs = Data.workflow_runs;
-    });
+    Data.workflow_runs = [];
+    $scope.workflow_runs = Data.workflow_runs;
+    $scope.nextCursor = null;
+    $scope.loadMore = function() {
+	var params = {fields: '_id,workflow.workflow_name,status,datetime_created,datetime_updated'};
+	if ($scope.nextCursor) {
+	    params.cursor = $scope.nextCursor;
+	}
+	$http.get('/api/workflow_runs/', {params: params}).success(function(response) {
+	    $scope.nextCursor = response['next_cursor'];
+	    Array.prototype.push.apply(Data.workflow_runs, response['workflow_runs']);
+	});
+    };
+    $scope.loadMore();
     $scope.$state = $state;
 };
@@ -7,9 +7,19 @@ angular
 WorkflowListController.$inject = ['$scope', '$http', 'Data', '$state'];
 
 function WorkflowListController($scope, $http, Data, $state){
-    $http.get('/api/workflows').success(function(response) {
-	Data.workflows = response['workflows'];
-	$scope.workflows = Data.workflows;
-    });
+    Data.workflows = [];
+    $scope.workflows = Data.workflows;
+    $scope.nextCursor = null;
+    $scope.loadMore = function() {
+	var params = {fields: '_id,workflow_name'};
+	if ($scope.nextCursor) {
+	    params.cursor = $scope.nextCursor;
+	}
+	$http.get('/api/workflows/', {params: params}).success(function(response) {
+	    $scope.nextCursor = response['next_cursor'];
+	    Array.prototype.push.apply(Data.workflows, response['workflows']);
+	});
+    };
+    $scope.loadMore();
     $scope.$state = $state;
 };
@@ -15,6 +15,12 @@ class TaskManagerFactory:
     CLUSTER = 'ELASTICLUSTER'
     GOOGLE_CLOUD = 'GOOGLE_CLOUD'
     DUMMY = 'DUMMY'
+    # Long-lived worker agents lease TaskRuns from the server
+    WORKER_POOL = 'WORKER_POOL'
+
+    @classmethod
+    def uses_leases(cls):
+        return settings.WORKER_TYPE == cls.WORKER_POOL
 
     @classmethod
     def get_task_manager(cls, test=False):
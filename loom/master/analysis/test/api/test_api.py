@@ -1,14 +1,20 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+import gzip
 import json
 import os
 import requests
+import StringIO
 import sys
 import time
 
 from django.conf import settings
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
 
-from analysis.models import WorkflowRun
+from analysis.models import FileDataObject, FileStorageLocation, TaskRun, \
+    TaskRunLocation, Worker, WorkflowRun
+from analysis.scheduler import Scheduler
 from loom.common import fixtures
 from loom.common.testserver import TestServer
 
@@ -56,7 +62,7 @@ class TestLoomRun(TestCase):
         # Test index
         r = requests.get(self.test_server.server_url+'/api/file_storage_locations')
         r.raise_for_status()
-        ids = map(lambda x:x['_id'], r.json()['file_storage_locations'])
+        ids = map(lambda x:x['_id'], json.loads(r.content)['file_storage_locations'])
         self.assertTrue(id in ids)
 
         # Test update
@@ -68,3 +74,326 @@ class TestLoomRun(TestCase):
         self.assertEqual(r.json()['file_path'], '/new/file/path')
 
     """
+
+
+class TestBulkCreate(TestCase):
+
+    def testCreateDataObjects(self):
+        structs = [fixtures.file_struct, fixtures.file_struct_2,
+                   fixtures.file_struct]
+        r = self.client.post('/api/data_objects/bulk/', json.dumps(structs),
+                             content_type='application/json')
+        self.assertEqual(r.status_code, 201)
+        objects = json.loads(r.content)['objects']
+        self.assertEqual([o['file_name'] for o in objects],
+                         [s['file_name'] for s in structs])
+        self.assertEqual(objects[0]['_id'], objects[2]['_id'])
+        self.assertEqual(FileDataObject.objects.count(), 2)
+
+    def testCreateDataObjectsGzipped(self):
+        structs = [fixtures.file_struct, fixtures.file_struct_2]
+        buffer = StringIO.StringIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as f:
+            f.write(json.dumps(structs))
+        r = self.client.post('/api/data_objects/bulk/', buffer.getvalue(),
+                             content_type='application/json',
+                             HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(FileDataObject.objects.count(), 2)
+
+    @override_settings(MAX_DECOMPRESSED_REQUEST_BYTES=1000)
+    def testNegCreateDataObjectsGzipTooLarge(self):
+        buffer = StringIO.StringIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as f:
+            f.write(' '*100000)
+        r = self.client.post('/api/data_objects/bulk/', buffer.getvalue(),
+                             content_type='application/json',
+                             HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(r.status_code, 413)
+        self.assertEqual(FileDataObject.objects.count(), 0)
+
+    def testNegCreateDataObjectsGzipInvalid(self):
+        r = self.client.post('/api/data_objects/bulk/', 'not gzip',
+                             content_type='application/json',
+                             HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(r.status_code, 400)
+
+    def testNegCreateDataObjectsInvalid(self):
+        r = self.client.post('/api/data_objects/bulk/',
+                             json.dumps(fixtures.file_struct),
+                             content_type='application/json')
+        self.assertEqual(r.status_code, 400)
+
+    def testStorageLocationsByFiles(self):
+        file = FileDataObject.create(fixtures.file_struct)
+        file_2 = FileDataObject.create(fixtures.file_struct_2)
+        r = self.client.post('/api/file_storage_locations/bulk/',
+                             json.dumps([fixtures.server_storage_location_struct]),
+                             content_type='application/json')
+        self.assertEqual(r.status_code, 201)
+        r = self.client.post('/api/file_data_objects/file_storage_locations/',
+                             json.dumps([file._id, file_2._id]),
+                             content_type='application/json')
+        self.assertEqual(r.status_code, 200)
+        locations = json.loads(r.content)['file_storage_locations']
+        self.assertEqual(
+            locations[file._id][0]['file_path'],
+            fixtures.server_storage_location_struct['file_path'])
+        self.assertEqual(locations[file_2._id], [])
+
+    def testStorageLocationsByFilesWithAlias(self):
+        FileStorageLocation.create(fixtures.server_storage_location_struct)
+        file = FileDataObject.create({
+            'file_name': 'file_with_new_hash.txt',
+            'file_contents': {'hash_value': 'abcd1234', 'hash_function': 'blake2b'}
+        })
+        r = self.client.post('/api/file_contents_aliases/bulk/',
+                             json.dumps([{'file_contents': file.file_contents.to_struct(),
+                                          'alias': fixtures.file_contents_struct}]),
+                             content_type='application/json')
+        self.assertEqual(r.status_code, 201)
+        r = self.client.post('/api/file_data_objects/file_storage_locations/',
+                             json.dumps([file._id]),
+                             content_type='application/json')
+        locations = json.loads(r.content)['file_storage_locations']
+        self.assertEqual(
+            locations[file._id][0]['file_path'],
+            fixtures.server_storage_location_struct['file_path'])
+
+    def testNegStorageLocationsByFilesNotFound(self):
+        r = self.client.post('/api/file_data_objects/file_storage_locations/',
+                             json.dumps(['missing']),
+                             content_type='application/json')
+        self.assertEqual(r.status_code, 404)
+
+
+class TestIndex(TestCase):
+
+    def _create_files(self, count):
+        files = []
+        for i in range(count):
+            struct = dict(fixtures.file_struct, file_name='file%s.txt' % i)
+            files.append(FileDataObject.create(struct))
+        return files
+
+    def _get(self, url, **params):
+        r = self.client.get(url, params)
+        self.assertEqual(r.status_code, 200)
+        return json.loads(r.content)
+
+    def _get_all_pages(self, url, key, **params):
+        items = []
+        pages = 0
+        cursor = None
+        while True:
+            if cursor is not None:
+                params['cursor'] = cursor
+            page = self._get(url, **params)
+            items.extend(page[key])
+            pages += 1
+            cursor = page['next_cursor']
+            if cursor is None:
+                return (items, pages)
+
+    def testPagination(self):
+        files = self._create_files(5)
+        (items, pages) = self._get_all_pages(
+            '/api/file_data_objects/', 'file_data_objects', limit=2)
+        self.assertEqual(pages, 3)
+        self.assertEqual([item['_id'] for item in items],
+                         sorted(file._id for file in files))
+
+    def testPaginationByDatetimeCreated(self):
+        worker_ids = [Worker.create({'worker_name': 'worker%s' % i, 'cores': 1})._id
+                      for i in range(3)]
+        (items, pages) = self._get_all_pages('/api/workers/', 'workers', limit=1)
+        self.assertEqual([item['_id'] for item in items],
+                         [str(worker_id) for worker_id in worker_ids])
+
+    def testFields(self):
+        self._create_files(2)
+        items = self._get('/api/file_data_objects/',
+                          fields='file_name,file_contents.hash_value')['file_data_objects']
+        self.assertEqual(items[0].keys(), ['file_name', 'file_contents'])
+        self.assertEqual(items[0]['file_contents'],
+                         {'hash_value': fixtures.file_struct['file_contents']['hash_value']})
+
+    def testCount(self):
+        self._create_files(3)
+        self.assertEqual(self._get('/api/file_data_objects/', count='true'), {'count': 3})
+        self.assertEqual(self._get('/api/file_data_objects/', q='file1.txt', count='true'),
+                         {'count': 1})
+
+    def testNegInvalidCursor(self):
+        r = self.client.get('/api/file_data_objects/', {'cursor': 'invalid'})
+        self.assertEqual(r.status_code, 400)
+
+
+class TestVerifyIds(TestCase):
+
+    def _get(self, url, status_code=200, **params):
+        r = self.client.get(url, params)
+        self.assertEqual(r.status_code, status_code)
+        return json.loads(r.content)
+
+    def testVerifyIds(self):
+        for i in range(3):
+            FileDataObject.create(dict(fixtures.file_struct, file_name='file%s' % i))
+        models = self._get('/api/controls/verify/')['models']
+        self.assertIn('analysis.dataobject', models)
+        page = self._get('/api/controls/verify/', model='analysis.dataobject', limit=2)
+        self.assertEqual(page['mismatches'], [])
+        page = self._get('/api/controls/verify/', model='analysis.dataobject', limit=2,
+                         cursor=page['next_cursor'])
+        self.assertIsNone(page['next_cursor'])
+
+    def testNegUnknownModel(self):
+        self._get('/api/controls/verify/', 400, model='analysis.workflowrun')
+
+
+class TestConditionalGet(TestCase):
+
+    def testImmutableNotModified(self):
+        file = FileDataObject.create(fixtures.file_struct)
+        url = '/api/file_data_objects/%s' % file._id
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r['ETag'], '"%s"' % file._id)
+        self.assertIn('immutable', r['Cache-Control'])
+        # The ETag is the _id, so the database is not needed
+        with self.assertNumQueries(0):
+            r = self.client.get(url, HTTP_IF_NONE_MATCH='"other", %s' % r['ETag'])
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.content, '')
+
+    def testInstanceNotModifiedUntilUpdated(self):
+        worker = Worker.create({'worker_name': 'worker1', 'cores': 1})
+        url = '/api/workers/%s' % worker._id
+        r = self.client.get(url)
+        etag = r['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(r['Cache-Control'], 'no-cache')
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+        worker.heartbeat()
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+
+    def testNegNotFound(self):
+        r = self.client.get('/api/file_data_objects/missing', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(r.status_code, 404)
+
+
+@override_settings(WORKER_TYPE='WORKER_POOL')
+class TestTaskRunLease(TestCase):
+
+    def setUp(self):
+        self._create_workflow_run()
+        self.worker_id = self._post('/api/workers/', {
+            'worker_name': 'worker1', 'cores': 8, 'memory': '16G'
+        }, 201)['_id']
+
+    def _create_workflow_run(self):
+        workflow = fixtures.straight_pipe_workflow_struct
+        WorkflowRun.create({
+            'workflow': workflow,
+            'workflow_run_inputs': [
+                {
+                    'workflow_input': workflow['workflow_inputs'][0],
+                    'data_object': fixtures.straight_pipe_workflow_input_file_struct
+                }
+            ]
+        })
+        Scheduler().process_events()
+
+    def _post(self, url, data, status_code=200):
+        r = self.client.post(url, json.dumps(data),
+                             content_type='application/json')
+        self.assertEqual(r.status_code, status_code)
+        return json.loads(r.content)
+
+    def _lease(self, count=2, cores=8):
+        return self._post('/api/task_runs/lease/', {
+            'worker_id': self.worker_id, 'count': count, 'cores': cores
+        })['leases']
+
+    def testLease(self):
+        # The scheduler leaves the ready TaskRun for a worker
+        self.assertEqual(TaskRun.objects.get().status, 'ready_to_run')
+        leases = self._lease()
+        self.assertEqual(len(leases), 1)
+        self.assertEqual(leases[0]['resources']['cores'], 1)
+        self.assertEqual(TaskRun.objects.get().status, 'running')
+        self.assertEqual(self._lease(), [])
+
+    def testNegLeaseDoesNotFit(self):
+        self.assertEqual(self._lease(cores=0), [])
+
+    def testLeaseSubtractsLeasedMemory(self):
+        # Each TaskRun requests 1GB
+        self._create_workflow_run()
+        self.worker_id = self._post('/api/workers/', {
+            'worker_name': 'worker2', 'cores': 8, 'memory': '1G'
+        }, 201)['_id']
+        self.assertEqual(len(self._lease()), 1)
+        self.assertEqual(self._lease(), [])
+        self.assertEqual(TaskRun.objects.filter(status='ready_to_run').count(), 1)
+
+    def testLeaseDoesNotRewriteWorker(self):
+        worker = Worker.objects.get(_id=self.worker_id)
+        # A heartbeat that arrives after the Worker was loaded
+        heartbeat = timezone.now() + timedelta(minutes=1)
+        Worker.objects.filter(_id=self.worker_id).update(datetime_heartbeat=heartbeat)
+        TaskRun.objects.get()._add_task_run_location(worker=worker)
+        self.assertEqual(Worker.objects.get(_id=self.worker_id).datetime_heartbeat,
+                         heartbeat)
+        self.assertEqual(TaskRun.objects.get().active_task_run_location.worker._id,
+                         worker._id)
+
+    def testHeartbeat(self):
+        location_id = self._lease()[0]['task_run_location_id']
+        response = self._post('/api/workers/%s/heartbeat/' % self.worker_id, {
+            'task_run_location_ids': [location_id, 'f'*32]
+        })
+        self.assertEqual(response['lost_task_run_location_ids'], ['f'*32])
+
+    def testResult(self):
+        lease = self._lease()[0]
+        output = lease['task_run']['task_run_outputs'][0]
+        self._post('/api/task_runs/%s/result/' % lease['task_run']['_id'], {
+            'task_run_location_id': lease['task_run_location_id'],
+            'outputs': [{'_id': output['_id'], 'data_object': fixtures.file_struct}]
+        })
+        self.assertEqual(TaskRun.objects.get().status, 'completed')
+
+    def testExpiredLease(self):
+        lease = self._lease()[0]
+        TaskRunLocation.objects.filter(_id=lease['task_run_location_id'])\
+            .update(lease_expires=timezone.now())
+        self.assertEqual(TaskRun.expire_leases(), 1)
+        self.assertEqual(TaskRun.objects.get().status, 'ready_to_run')
+        response = self._post('/api/workers/%s/heartbeat/' % self.worker_id, {
+            'task_run_location_ids': [lease['task_run_location_id']]
+        })
+        self.assertEqual(response['lost_task_run_location_ids'],
+                         [lease['task_run_location_id']])
+        output = lease['task_run']['task_run_outputs'][0]
+        self._post('/api/task_runs/%s/result/' % lease['task_run']['_id'], {
+            'task_run_location_id': lease['task_run_location_id'],
+            'outputs': [{'_id': output['_id'], 'data_object': fixtures.file_struct}]
+        }, 409)
+        self.assertEqual(len(self._lease()), 1)
+
+    def testResultCache(self):
+        self.testResult()
+        r = self.client.get('/api/result_cache/')
+        self.assertEqual(r.status_code, 200)
+        response = json.loads(r.content)
+        self.assertEqual(response['result_cache']['misses'], 1)
+        self.assertEqual(len(response['entries']), 1)
+        task_definition_id = response['entries'][0]['task_definition_id']
+        response = self._post('/api/result_cache/invalidate/', {
+            'task_definition_id': task_definition_id
+        })
+        self.assertEqual(response['invalidated'], 1)
@@ -1,8 +1,12 @@
+from django.apps import apps
 from django.test import TestCase
+from django.test.utils import override_settings
+import importlib
 import uuid
 
 from analysis.exceptions import *
 from analysis.models import *
+from universalmodels.exceptions import InvalidInputError
 from loom.common import fixtures
 
 from .common import UniversalModelTestMixin
@@ -31,6 +35,16 @@ class TestDataObjectArray(TestCase, UniversalModelTestMixin):
         self.roundTripJson(file_array)
         self.roundTripStruct(file_array)
 
+    @override_settings(UNIVERSALMODELS_STRUCT_CACHE_SIZE=0)
+    def testFileArrayToStructsQueryCount(self):
+        # Rendering cost should not depend on the number of files in the array
+        file_array = DataObjectArray.create(fixtures.file_array_struct)
+        file_array = DataObjectArray.objects.get(_id=file_array._id)
+        self.assertEqual(DataObjectArray.to_structs([file_array]),
+                         [file_array.to_struct()])
+        with self.assertNumQueries(4):
+            DataObjectArray.to_structs([file_array])
+
     def testJsonArray(self):
         json_array = DataObjectArray.create(fixtures.json_array_struct)
         self.assertEqual(json_array.data_objects.count(), len(fixtures.json_array_struct['data_objects']))
@@ -59,6 +73,59 @@ class TestDataObjectArray(TestCase, UniversalModelTestMixin):
             heterogeneous_array = DataObjectArray.create(fixtures.heterogeneous_array_struct)
 
 
+class TestConcreteType(TestCase):
+
+    def testConcreteTypeIsSetOnCreate(self):
+        file = FileDataObject.create(fixtures.file_struct)
+        data_object = DataObject.objects.get(_id=file._id)
+        self.assertEqual(data_object._concrete_type, 'analysis.filedataobject')
+
+    def testConcreteTypeIsNotRendered(self):
+        file = FileDataObject.create(fixtures.file_struct)
+        self.assertNotIn('_concrete_type', file.to_struct())
+
+    def testNegConcreteTypeInput(self):
+        struct = dict(fixtures.file_struct)
+        struct['_concrete_type'] = 'analysis.stringdataobject'
+        with self.assertRaises(InvalidInputError):
+            FileDataObject.create(struct)
+
+    def testDowncastIsOneQuery(self):
+        location = FileStorageLocation.create(
+            fixtures.server_storage_location_struct)
+        base_location = FileStorageLocation.objects.get(_id=location._id)
+        with self.assertNumQueries(1):
+            downcast_location = base_location.downcast()
+        self.assertIsInstance(downcast_location, ServerStorageLocation)
+
+    def testDowncastMany(self):
+        file_array = DataObjectArray.create(fixtures.file_array_struct)
+        string = StringDataObject.create({'string_value': 'text'})
+        ids = [file_array._id, string._id] + \
+              [o._id for o in file_array.data_objects.all()]
+        data_objects = list(DataObject.objects.filter(_id__in=ids))
+        # One query for each of DataObjectArray, StringDataObject,
+        # and FileDataObject
+        with self.assertNumQueries(3):
+            downcast_objects = DataObject.downcast_many(data_objects)
+        self.assertEqual([o._id for o in downcast_objects],
+                         [o._id for o in data_objects])
+        self.assertEqual([o.__class__ for o in downcast_objects],
+                         [o.downcast().__class__ for o in data_objects])
+
+    def testBackfill(self):
+        file = FileDataObject.create(fixtures.file_struct)
+        string = StringDataObject.create({'string_value': 'text'})
+        DataObject.objects.update(_concrete_type='')
+        migration = importlib.import_module(
+            'analysis.migrations.0002_concrete_type')
+        migration.backfill_concrete_type(apps, None)
+        self.assertEqual(DataObject.objects.get(_id=file._id)._concrete_type,
+                         'analysis.filedataobject')
+        self.assertEqual(DataObject.objects.get(_id=string._id)._concrete_type,
+                         'analysis.stringdataobject')
+
+
 class TestFileStorageLocation(TestCase, UniversalModelTestMixin):
 
     def testFileStorageLocation(self):
@@ -74,6 +141,45 @@ class TestFileStorageLocation(TestCase, UniversalModelTestMixin):
         self.assertEqual(uuid.UUID(str(storage_location._id)), uuid.UUID(str(retrieved_storage_location._id)))
 
 
+class TestFileContentsAlias(TestCase):
+
+    def setUp(self):
+        self.alias_struct = {
+            'hash_value': 'abcd1234',
+            'hash_function': 'blake2b',
+        }
+        self.file = FileDataObject.create({
+            'file_name': 'file_with_new_hash.txt',
+            'file_contents': self.alias_struct
+        })
+
+    def _add_alias(self):
+        return FileContentsAlias.create({
+            'file_contents': self.file.file_contents.to_struct(),
+            'alias': fixtures.file_contents_struct
+        })
+
+    def testNoAlias(self):
+        FileStorageLocation.create(fixtures.server_storage_location_struct)
+        self.assertFalse(self.file.is_available())
+
+    def testAliasFindsStorageLocation(self):
+        storage_location = FileStorageLocation.create(fixtures.server_storage_location_struct)
+        self._add_alias()
+        self.assertTrue(self.file.is_available())
+        self.assertEqual(uuid.UUID(str(FileStorageLocation.get_by_file(self.file).get()._id)),
+                         uuid.UUID(str(storage_location._id)))
+
+    def testAliasIsSymmetric(self):
+        self._add_alias()
+        FileStorageLocation.create({
+            'file_contents': self.alias_struct,
+            'file_path': '/absolute/path/to/my/file.txt',
+            'host_url': 'localhost',
+        })
+        self.assertTrue(FileDataObject.create(fixtures.file_struct).is_available())
+
+
 class TestServerStorageLocation(TestCase, UniversalModelTestMixin):
 
     def testServerStorageLocation(self):
@@ -0,0 +1,100 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from analysis.models import *
+from analysis.scheduler import Scheduler
+from loom.common import fixtures
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+        self.dispatched = []
+        self.scheduler = Scheduler(dispatch=self._dispatch)
+
+    def _dispatch(self, task_run):
+        self.dispatched.append(task_run._id)
+        task_run.dummy_run()
+        # Make the outputs available, as an upload from a worker would
+        for output in task_run.task_run_outputs.all():
+            ServerStorageLocation.create({
+                'file_contents': output.data_object.downcast().file_contents.to_struct(),
+                'file_path': '/absolute/path/to/%s' % output._id,
+                'host_url': 'localhost'
+            })
+
+    def _run_workflow(self, use_result_cache=True):
+        workflow = fixtures.straight_pipe_workflow_struct
+        workflow_run = WorkflowRun.create({
+            'workflow': workflow,
+            'workflow_run_inputs': [
+                {
+                    'workflow_input': workflow['workflow_inputs'][0],
+                    'data_object': fixtures.straight_pipe_workflow_input_file_struct
+                }
+            ],
+            'use_result_cache': use_result_cache
+        })
+        while self.scheduler.process_events():
+            pass
+        return WorkflowRun.objects.get(_id=workflow_run._id)
+
+    def _get_task_runs(self, workflow_run):
+        return [step_run.task_runs.get() for step_run in workflow_run.step_runs.all()]
+
+    def testRepeatedWorkflowRunUsesCache(self):
+        first_run = self._run_workflow()
+        self.assertEqual(len(self.dispatched), 2)
+        self.dispatched = []
+
+        second_run = self._run_workflow()
+        self.assertEqual(self.dispatched, [])
+        self.assertEqual(second_run.status, 'completed')
+        for (task_run, cached_task_run) in zip(self._get_task_runs(second_run),
+                                               self._get_task_runs(first_run)):
+            self.assertEqual(task_run.status, 'completed')
+            self.assertEqual(task_run.result_cache_status, 'hit')
+            self.assertEqual(task_run.task_run_outputs.get().data_object._id,
+                             cached_task_run.task_run_outputs.get().data_object._id)
+
+        stats = TaskRun.get_result_cache_stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+        # Hits do not add entries of their own
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(
+            sum(entry.hit_count for entry in ResultCacheEntry.objects.all()), 2)
+
+    def testWorkflowRunCanOptOut(self):
+        self._run_workflow()
+        self.dispatched = []
+        workflow_run = self._run_workflow(use_result_cache=False)
+        self.assertEqual(len(self.dispatched), 2)
+        for task_run in self._get_task_runs(workflow_run):
+            self.assertIsNone(task_run.result_cache_status)
+
+    @override_settings(RESULT_CACHE_ENABLED=False)
+    def testCacheCanBeDisabled(self):
+        self._run_workflow()
+        self.dispatched = []
+        self._run_workflow()
+        self.assertEqual(len(self.dispatched), 2)
+
+    def testUnavailableOutputsAreNotReused(self):
+        self._run_workflow()
+        FileStorageLocation.objects.all().delete()
+        self.dispatched = []
+        workflow_run = self._run_workflow()
+        self.assertEqual(len(self.dispatched), 2)
+        for task_run in self._get_task_runs(workflow_run):
+            self.assertEqual(task_run.result_cache_status, 'miss')
+
+    def testInvalidate(self):
+        workflow_run = self._run_workflow()
+        task_definition_id = self._get_task_runs(workflow_run)[1].task_definition._id
+        self.assertEqual(ResultCacheEntry.invalidate(task_definition_id), 1)
+        self.dispatched = []
+        self._run_workflow()
+        # Only the second step is run again
+        self.assertEqual(len(self.dispatched), 1)
+        self.assertEqual(ResultCacheEntry.invalidate(), 2)
@@ -7,6 +7,7 @@ import sys
 from loom.common import fixtures
 from loom.common.fixtures.workflows import hello_world
 from .common import UniversalModelTestMixin
+from universalmodels.exceptions import InvalidInputError
 
 
 class TestWorkflowRunModels(TestCase, UniversalModelTestMixin):
@@ -21,6 +22,10 @@ class TestWorkflowRunModels(TestCase, UniversalModelTestMixin):
         self.roundTripJson(o)
         self.roundTripStruct(o)
 
+    def testWorkflowRunToStructs(self):
+        o = WorkflowRun.create(fixtures.workflow_run_struct)
+        self.assertEqual(WorkflowRun.to_structs([o]), [o.to_struct()])
+
 class TestWorkflowRunEndToEnd(TestCase, UniversalModelTestMixin):
     
     def testStraightPipeSuccessfulRun(self):
@@ -388,7 +393,137 @@ class TestStepRun(TestCase, UniversalModelTestMixin):
 
         with self.assertRaises(MissingInputsError):
             inputs = self.assertIsNone(workflow_run.step_runs.all()[1]._get_task_inputs())
-    
+
+    def _create_straight_pipe_run(self):
+        workflow = fixtures.straight_pipe_workflow_struct
+        return WorkflowRun.create({
+            'workflow': workflow,
+            'workflow_run_inputs': [
+                {
+                    'workflow_input': workflow['workflow_inputs'][0],
+                    'data_object': fixtures.straight_pipe_workflow_input_file_struct
+                }
+            ]
+        })
+
+    def testCounters(self):
+        workflow_run = self._create_straight_pipe_run()
+        step_run_a = workflow_run.step_runs.all()[0]
+        step_run_b = workflow_run.step_runs.all()[1]
+        self.assertEqual(step_run_a.nonempty_input_count, 1)
+        self.assertEqual(step_run_a.closed_input_count, 0)
+
+        step_run_a.update_status()
+        # The only input was popped, and its channel is closed
+        self.assertEqual(step_run_a.nonempty_input_count, 0)
+        self.assertEqual(step_run_a.closed_input_count, 1)
+        self.assertEqual(step_run_a.outstanding_task_run_count, 1)
+
+        step_run_a.task_runs.first().dummy_run()
+        step_run_a.refresh_counters()
+        step_run_b.refresh_counters()
+        self.assertEqual(step_run_a.task_runs.first().status, 'completed')
+        self.assertEqual(step_run_a.outstanding_task_run_count, 0)
+        self.assertEqual(step_run_b.nonempty_input_count, 1)
+
+        step_run_a.update_status()
+        self.assertEqual(step_run_a.status, 'completed')
+
+    def testUpdateStatusCreatesTaskRunForEachQueuedInput(self):
+        step_run = self._create_straight_pipe_run().step_runs.first()
+        subchannel = step_run.step_run_inputs.first().subchannel
+        for file_struct in [fixtures.file_struct, fixtures.file_struct_2]:
+            subchannel.add_data_object(FileDataObject.create(file_struct))
+        step_run.refresh_counters()
+        step_run.update_status()
+        self.assertEqual(step_run.task_runs.count(), 3)
+        self.assertEqual(step_run.outstanding_task_run_count, 3)
+        self.assertEqual(step_run.nonempty_input_count, 0)
+
+    def testUpdateStatusCorrectsDriftedNonemptyInputCount(self):
+        step_run = self._create_straight_pipe_run().step_runs.first()
+        step_run.update_status()
+        self.assertEqual(step_run.task_runs.count(), 1)
+        # The counter says there is data, but the Subchannel is empty
+        step_run.increment_counters(nonempty_input_count=1)
+        step_run.update_status()
+        self.assertEqual(step_run.task_runs.count(), 1)
+        self.assertEqual(step_run.nonempty_input_count, 0)
+
+    def testUpdateStatusAfterInputsWereTaken(self):
+        step_run = self._create_straight_pipe_run().step_runs.first()
+        # Loaded before the inputs are taken, so its counters are stale
+        stale_step_run = StepRun.objects.get(_id=step_run._id)
+        step_run.update_status()
+        stale_step_run.update_status()
+        self.assertEqual(step_run.task_runs.count(), 1)
+        with self.assertRaises(MissingInputsError):
+            stale_step_run._get_task_inputs()
+
+    def testCountersAreNotInStruct(self):
+        step_run = self._create_straight_pipe_run().step_runs.first()
+        self.assertNotIn('nonempty_input_count', step_run.to_struct())
+        with self.assertRaises(InvalidInputError):
+            step_run.update({'nonempty_input_count': 5})
+
+    def testUpdateDoesNotOverwriteCounters(self):
+        step_run = self._create_straight_pipe_run().step_runs.first()
+        stale_step_run = StepRun.objects.get(_id=step_run._id)
+        step_run.increment_counters(outstanding_task_run_count=2)
+        stale_step_run.update({'status': 'running'})
+        step_run.refresh_counters()
+        self.assertEqual(step_run.outstanding_task_run_count, 2)
+
+
+class TestSubchannel(TestCase):
+
+    def setUp(self):
+        self.channel = Channel.create({'channel_name': 'x'})
+        self.subchannel = Subchannel.create({'channel_name': 'x'})
+        self.channel.subchannels.add(self.subchannel)
+        self.data_objects = [
+            StringDataObject.create({'string_value': str(i)})
+            for i in range(3)]
+
+    def testPopIsFirstInFirstOut(self):
+        for data_object in self.data_objects:
+            self.subchannel.add_data_object(data_object)
+        self.assertEqual(self.subchannel.get_pending_count(), 3)
+        self.assertEqual(self.subchannel.pop()._id, self.data_objects[0]._id)
+        self.assertEqual(
+            [data_object._id for data_object in self.subchannel.pop_many(5)],
+            [data_object._id for data_object in self.data_objects[1:]])
+        self.assertTrue(self.subchannel.is_empty())
+        self.assertIsNone(self.subchannel.pop())
+
+    def testStructListsQueuedDataObjects(self):
+        for data_object in [self.data_objects[0], self.data_objects[0], self.data_objects[1]]:
+            self.subchannel.add_data_object(data_object)
+        self.subchannel.pop()
+        struct = self.subchannel.to_struct()
+        self.assertEqual(
+            [data_object['_id'] for data_object in struct['data_objects']],
+            [self.data_objects[0]._id, self.data_objects[1]._id])
+        self.assertEqual(Subchannel.to_structs([self.subchannel]), [struct])
+        self.assertEqual(
+            Subchannel.to_structs([self.subchannel], fields=['channel_name']),
+            [{'channel_name': 'x'}])
+        # data_objects is read-only
+        self.assertEqual(Subchannel.create(struct).get_pending_count(), 0)
+
+    def testDuplicatesAreQueued(self):
+        self.subchannel.add_data_object(self.data_objects[0])
+        self.subchannel.add_data_object(self.data_objects[0])
+        self.assertEqual(len(self.subchannel.pop_many(2)), 2)
+
+    def testStaleInstancesShareCursor(self):
+        for data_object in self.data_objects:
+            self.subchannel.add_data_object(data_object)
+        stale_subchannel = Subchannel.objects.get(_id=self.subchannel._id)
+        self.subchannel.pop()
+        self.assertEqual(stale_subchannel.pop()._id, self.data_objects[1]._id)
+
+
 """
 class TestWorkflowRunMethods(TestCase):
 
@@ -0,0 +1,78 @@
+from django.test import TestCase
+
+from analysis.models import *
+from analysis.scheduler import Scheduler
+from loom.common import fixtures
+
+
+class TestScheduler(TestCase):
+
+    def setUp(self):
+        self.dispatched = []
+        self.scheduler = Scheduler(dispatch=self._dispatch)
+
+    def _dispatch(self, task_run):
+        self.dispatched.append(task_run._id)
+        task_run.dummy_run()
+
+    def _create_workflow_run(self):
+        workflow = fixtures.straight_pipe_workflow_struct
+        return WorkflowRun.create({
+            'workflow': workflow,
+            'workflow_run_inputs': [
+                {
+                    'workflow_input': workflow['workflow_inputs'][0],
+                    'data_object': fixtures.straight_pipe_workflow_input_file_struct
+                }
+            ]
+        })
+
+    def _process_all_events(self):
+        while self.scheduler.process_events():
+            pass
+
+    def testWorkflowRunCreatedIsQueued(self):
+        workflow_run = self._create_workflow_run()
+        event_types = [event.event_type for event in SchedulerEvent.get_pending()]
+        self.assertIn(SchedulerEvent.WORKFLOW_RUN_CREATED, event_types)
+        self.assertIn(SchedulerEvent.DATA_OBJECT_ADDED, event_types)
+
+    def testProcessEventsDispatchesFirstStep(self):
+        workflow_run = self._create_workflow_run()
+        self.scheduler.process_events()
+        step_runs = workflow_run.step_runs.all()
+        self.assertEqual(step_runs[0].status, 'running')
+        self.assertEqual(step_runs[1].status, 'waiting')
+        self.assertEqual(self.dispatched,
+                         [step_runs[0].task_runs.first()._id])
+
+    def testResultsDispatchNextStep(self):
+        workflow_run = self._create_workflow_run()
+        self._process_all_events()
+        step_runs = workflow_run.step_runs.all()
+        self.assertEqual(len(self.dispatched), 2)
+        self.assertEqual(self.dispatched[1],
+                         step_runs[1].task_runs.first()._id)
+        self.assertEqual(SchedulerEvent.get_pending().count(), 0)
+
+    def testUnaffectedStepRunsAreSkipped(self):
+        workflow_run = self._create_workflow_run()
+        self._process_all_events()
+        other_workflow_run = self._create_workflow_run()
+        SchedulerEvent.get_pending().exclude(
+            event_type=SchedulerEvent.WORKFLOW_RUN_CREATED).delete()
+        self.dispatched = []
+        self.scheduler.process_events()
+        # Only the new WorkflowRun's first step is evaluated
+        self.assertEqual(self.dispatched,
+                         [other_workflow_run.step_runs.first().task_runs.first()._id])
+
+    def testMetrics(self):
+        self._create_workflow_run()
+        self._process_all_events()
+        metrics = Scheduler.get_metrics()
+        self.assertEqual(metrics['pending_events'], 0)
+        result_metrics = metrics['events'][SchedulerEvent.DATA_OBJECT_ADDED]
+        self.assertEqual(result_metrics['dispatched'], 2)
+        self.assertGreaterEqual(
+            result_metrics['dispatch_latency_seconds']['max'], 0)
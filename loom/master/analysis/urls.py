@@ -9,6 +9,11 @@ urlpatterns = patterns(
     url(r'^servertime/$', 'analysis.views.servertime'),
     url(r'^controls/update/$', 'analysis.views.update_tasks'),
     url(r'^controls/run/$', 'analysis.views.run_tasks'),
+    url(r'^controls/verify/$', 'analysis.views.verify_ids'),
+    url(r'^controls/scheduler/$', 'analysis.views.scheduler_metrics'),
+    url(r'^controls/struct_cache/$', 'analysis.views.struct_cache_stats'),
+    url(r'^result_cache/$', 'analysis.views.result_cache'),
+    url(r'^result_cache/invalidate/$', 'analysis.views.invalidate_result_cache'),
 )    
 
 model_classes = [
@@ -22,12 +27,28 @@ model_classes = [
     Step,
     StepRun,
     TaskRun,
+    Worker,
 ]
 
+bulk_model_classes = [
+    DataObject,
+    FileContentsAlias,
+    FileStorageLocation,
+]
+
+for cls in bulk_model_classes:
+    urlpatterns.append(url(r'^%s/bulk/$' % cls.get_class_name(plural=True), 'analysis.views.create_many', {'model_class': cls}))
+
+urlpatterns.append(url(r'^%s/lease/$' % TaskRun.get_class_name(plural=True), 'analysis.views.lease_task_runs'))
+
 for cls in model_classes:
     urlpatterns.append(url(r'^%s/$' % cls.get_class_name(plural=True), 'analysis.views.create_or_index', {'model_class': cls}))
     urlpatterns.append(url(r'^%s/(?P<id>[a-zA-Z0-9_\-]+)$' % cls.get_class_name(plural=True), 'analysis.views.show_or_update', {'model_class': cls}))
 
+urlpatterns.append(url(r'^%s/file_storage_locations/$' % FileDataObject.get_class_name(plural=True), 'analysis.views.storage_locations_by_files'))
 urlpatterns.append(url(r'^%s/(?P<id>[a-zA-Z0-9_\-]+)/file_storage_locations/$' % FileDataObject.get_class_name(plural=True), 'analysis.views.storage_locations_by_file'))
 urlpatterns.append(url(r'^%s/(?P<id>[a-zA-Z0-9_\-]+)/data_source_records/$' % FileDataObject.get_class_name(plural=True), 'analysis.views.data_source_records_by_file'))
+urlpatterns.append(url(r'^%s/(?P<id>[a-zA-Z0-9_\-]+)/result/$' % TaskRun.get_class_name(plural=True), 'analysis.views.task_run_result'))
+urlpatterns.append(url(r'^%s/(?P<id>[a-zA-Z0-9_\-]+)/error/$' % TaskRun.get_class_name(plural=True), 'analysis.views.task_run_error'))
+urlpatterns.append(url(r'^%s/(?P<id>[a-zA-Z0-9_\-]+)/heartbeat/$' % Worker.get_class_name(plural=True), 'analysis.views.worker_heartbeat'))
 urlpatterns.append(url(r'^/$', 'analysis.views.browser'))
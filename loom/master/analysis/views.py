@@ -1,12 +1,21 @@
+import hashlib
+import json
 import logging
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import JsonResponse
+from django.http import HttpResponseNotModified, JsonResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
-from analysis.models import WorkflowRun, TaskRun, FileDataObject
+from django.utils.http import parse_etags, quote_etag
+from analysis.models import WorkflowRun, TaskRun, FileDataObject, \
+    FileContents, FileStorageLocation, DataSourceRecord, TaskRunLocation, Worker, \
+    ResultCacheEntry
+from analysis.scheduler import Scheduler
+from universalmodels import graph, pagination, structcache, verification
+from universalmodels.models import ImmutableModel
+import universalmodels.exceptions
 
 logger = logging.getLogger('loom')
 
@@ -17,32 +26,114 @@ class Helper:
         data_json = request.body
         try:
             model = model_class.create(data_json)
-            return JsonResponse({"message": "created %s" % model_class.get_class_name(), "_id": str(model._id), "object": model.to_struct()}, status=201)
+            return JsonResponse({"message": "created %s" % model_class.get_class_name(), "_id": str(model._id), "object": model_class.to_structs([model])[0]}, status=201)
+        except Exception as e:
+            logger.error('Failed to create %s with data "%s". %s' % (model_class, data_json, e.message))
+            return JsonResponse({"message": e.message}, status=400)
+
+    @classmethod
+    def create_many(cls, request, model_class):
+        data_json = request.body
+        try:
+            models = model_class.create_many(data_json)
+            return JsonResponse({"message": "created %s %s" % (len(models), model_class.get_class_name(plural=True)), "objects": model_class.to_structs(models)}, status=201)
         except Exception as e:
             logger.error('Failed to create %s with data "%s". %s' % (model_class, data_json, e.message))
             return JsonResponse({"message": e.message}, status=400)
 
     @classmethod
     def index(cls, request, model_class):
+        """Returns one page of models, with the cursor for the next page.
+        Query parameters:
+          q       name or ID to match
+          limit   page size, up to API_INDEX_MAX_PAGE_SIZE
+          cursor  next_cursor from the previous page
+          fields  comma-separated dotted paths of the fields to render
+          count   if "true", return only the number of matching models
+        """
         query_string = request.GET.get('q')
         if query_string is None:
             model_list = model_class.objects.all()
         else:
             model_list = model_class.get_by_name_or_id(query_string)
+        if request.GET.get('count') == 'true':
+            return JsonResponse({'count': model_list.count()}, status=200)
+        try:
+            limit = min(int(request.GET.get('limit', settings.API_INDEX_PAGE_SIZE)),
+                        settings.API_INDEX_MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError('limit must be at least 1')
+            (models, next_cursor) = pagination.get_page(
+                model_list, limit, cursor=request.GET.get('cursor'))
+            fields = request.GET.get('fields')
+            if fields is not None:
+                fields = fields.split(',')
+            structs = model_class.to_structs(models, fields=fields)
+        except (ValueError, universalmodels.exceptions.InvalidCursorError,
+                universalmodels.exceptions.InvalidInputError) as e:
+            return JsonResponse({"message": str(e)}, status=400)
         return JsonResponse(
             {
-                model_class.get_class_name(plural=True):
-                [model.to_struct() for model in model_list]
+                model_class.get_class_name(plural=True): structs,
+                'next_cursor': next_cursor,
             },
             status=200)
 
     @classmethod
     def show(cls, request, id, model_class):
+        """Responses carry an ETag, and a request with a matching
+        If-None-Match receives 304 Not Modified. The _id of an
+        ImmutableModel is a hash of its contents, so its ETag is the _id and
+        a match needs no query. InstanceModels have a weak ETag from the
+        latest datetime_updated of the models rendered.
+        """
+        immutable = issubclass(model_class, ImmutableModel)
+        if immutable and cls._etag_matches(request, quote_etag(id)):
+            return cls._not_modified(quote_etag(id), immutable)
         try:
             model = model_class.get_by_id(id)
         except ObjectDoesNotExist:
             return JsonResponse({"message": "Not Found"}, status=404)
-        return JsonResponse(model.to_struct(), status=200)
+        serializer = graph.GraphSerializer([model])
+        struct = serializer.serialize()[0]
+        if immutable:
+            etag = quote_etag(str(model._id))
+        else:
+            etag = cls._get_weak_etag(model, serializer)
+        if cls._etag_matches(request, etag):
+            return cls._not_modified(etag, immutable)
+        response = JsonResponse(struct, status=200)
+        cls._set_cache_headers(response, etag, immutable)
+        return response
+
+    @classmethod
+    def _get_weak_etag(cls, model, serializer):
+        (datetime_updated, model_count) = serializer.get_version()
+        version = '%s %s %s' % (model._id, datetime_updated, model_count)
+        return 'W/' + quote_etag(hashlib.md5(version).hexdigest())
+
+    @classmethod
+    def _etag_matches(cls, request, etag):
+        # GET uses the weak comparison, so "W/" prefixes are ignored
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if not if_none_match:
+            return False
+        return parse_etags(etag)[0] in parse_etags(if_none_match)
+
+    @classmethod
+    def _not_modified(cls, etag, immutable):
+        response = HttpResponseNotModified()
+        cls._set_cache_headers(response, etag, immutable)
+        return response
+
+    @classmethod
+    def _set_cache_headers(cls, response, etag, immutable):
+        response['ETag'] = etag
+        if immutable:
+            response['Cache-Control'] = 'public, max-age=%s, immutable' % (365*24*60*60)
+        else:
+            # Cached copies must be revalidated before use
+            response['Cache-Control'] = 'no-cache'
 
     @classmethod
     def update(cls, request, id, model_class):
@@ -50,7 +141,7 @@ class Helper:
         data_json = request.body
         try:
             model.update(data_json)
-            return JsonResponse({"message": "updated %s" % model_class.get_class_name(), "_id": str(model._id), "object": model.to_struct()}, status=201)
+            return JsonResponse({"message": "updated %s" % model_class.get_class_name(), "_id": str(model._id), "object": model_class.to_structs([model])[0]}, status=201)
         except Exception as e:
             logger.error('Failed to update %s with data "%s". %s' % (model_class, data_json, e.message))
             return JsonResponse({"message": e.message}, status=400)
@@ -70,6 +161,9 @@ def workerinfo(request):
         'FILE_ROOT_FOR_WORKER': settings.FILE_ROOT_FOR_WORKER,
         'WORKER_LOGFILE': settings.WORKER_LOGFILE,
         'LOG_LEVEL': settings.LOG_LEVEL,
+        'WORKER_MOUNT_INPUTS': settings.WORKER_MOUNT_INPUTS,
+        'WORKER_CACHE_DIR': settings.WORKER_CACHE_DIR,
+        'WORKER_CACHE_MAX_GB': settings.WORKER_CACHE_MAX_GB,
         }
     return JsonResponse({'workerinfo': workerinfo})
 
@@ -83,6 +177,8 @@ def filehandlerinfo(request):
         'STEP_RUNS_DIR': settings.STEP_RUNS_DIR,
         'BUCKET_ID': settings.BUCKET_ID,
         'PROJECT_ID': settings.PROJECT_ID,
+        'HASH_FUNCTION': settings.HASH_FUNCTION,
+        'ALIAS_HASH_FUNCTIONS': settings.ALIAS_HASH_FUNCTIONS,
         }
     return JsonResponse({'filehandlerinfo': filehandlerinfo})
 
@@ -108,7 +204,122 @@ def storage_locations_by_file(request, id):
         file = FileDataObject.get_by_id(id)
     except ObjectDoesNotExist:
         return JsonResponse({"message": "Not Found"}, status=404)
-    return JsonResponse({"file_storage_locations": [o.to_struct() for o in file.file_contents.file_storage_locations.all()]}, status=200)
+    return JsonResponse({"file_storage_locations": FileStorageLocation.to_structs(FileStorageLocation.get_by_file(file))}, status=200)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def create_many(request, model_class):
+    return Helper.create_many(request, model_class)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def storage_locations_by_files(request):
+    """Look up storage locations for a list of file IDs given as JSON in the
+    request body. Returns {file_id: [locations]}.
+    """
+    try:
+        file_ids = json.loads(request.body)
+        files = dict(FileDataObject.objects.filter(_id__in=file_ids)\
+                     .values_list('_id', 'file_contents_id'))
+    except Exception as e:
+        return JsonResponse({"message": e.message}, status=400)
+    missing_ids = set(file_ids).difference(files.keys())
+    if missing_ids:
+        return JsonResponse({"message": "Not Found: %s" % ', '.join(sorted(missing_ids))}, status=404)
+    # Also return locations of the same contents under other hash functions
+    equivalent_ids = FileContents.get_equivalent_ids_by_contents(set(files.values()))
+    locations = list(FileStorageLocation.objects.filter(
+        file_contents_id__in=set.union(set(), *equivalent_ids.values())))
+    structs_by_contents = {}
+    for (location, struct) in zip(locations, FileStorageLocation.to_structs(locations)):
+        structs_by_contents.setdefault(location.file_contents_id, []).append(struct)
+    locations_by_contents = dict(
+        (contents_id, [struct for equivalent_id in equivalent_ids[contents_id]
+                       for struct in structs_by_contents.get(equivalent_id, [])])
+        for contents_id in equivalent_ids)
+    return JsonResponse({"file_storage_locations": dict((file_id, locations_by_contents.get(files[file_id], [])) for file_id in file_ids)}, status=200)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def lease_task_runs(request):
+    """Assign ready TaskRuns to a worker. The request gives "worker_id",
+    the number of TaskRuns wanted as "count", and "cores" available.
+    """
+    try:
+        data = json.loads(request.body)
+        worker = Worker.get_by_id(data['worker_id'])
+        count = int(data.get('count', 1))
+        cores = int(data.get('cores', worker.cores))
+    except ObjectDoesNotExist:
+        return JsonResponse({"message": "Not Found"}, status=404)
+    except Exception as e:
+        return JsonResponse({"message": e.message}, status=400)
+    worker.heartbeat()
+    leased = TaskRun.lease(worker, count, cores)
+    task_run_structs = TaskRun.to_structs([task_run for (task_run, location) in leased])
+    leases = []
+    for ((task_run, location), task_run_struct) in zip(leased, task_run_structs):
+        resources = task_run.get_requested_resources()
+        leases.append({
+            "task_run": task_run_struct,
+            "task_run_location_id": str(location._id),
+            "resources": resources.to_struct() if resources is not None else None,
+        })
+    return JsonResponse({"leases": leases}, status=200)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def worker_heartbeat(request, id):
+    """Renew the leases listed in "task_run_location_ids". Returns those no
+    longer held by the worker, which it should stop working on.
+    """
+    try:
+        worker = Worker.get_by_id(id)
+    except ObjectDoesNotExist:
+        return JsonResponse({"message": "Not Found"}, status=404)
+    try:
+        location_ids = json.loads(request.body).get('task_run_location_ids', [])
+    except Exception as e:
+        return JsonResponse({"message": e.message}, status=400)
+    worker.heartbeat()
+    lost_ids = TaskRunLocation.renew_leases(worker, location_ids)
+    return JsonResponse({"lost_task_run_location_ids": lost_ids}, status=200)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def task_run_result(request, id):
+    """Accept results from the holder of a TaskRun lease, given as
+    "task_run_location_id" and "outputs", a list of {"_id", "data_object"}.
+    """
+    try:
+        task_run = TaskRun.get_by_id(id)
+    except ObjectDoesNotExist:
+        return JsonResponse({"message": "Not Found"}, status=404)
+    try:
+        data = json.loads(request.body)
+        location_id = data['task_run_location_id']
+        for output in data['outputs']:
+            if not task_run.submit_result(output['_id'], output['data_object'], location_id):
+                return JsonResponse({"message": "TaskRunLocation %s is not active" % location_id}, status=409)
+    except Exception as e:
+        logger.error('Failed to submit result for TaskRun %s. %s' % (id, e.message))
+        return JsonResponse({"message": e.message}, status=400)
+    return JsonResponse({"message": "accepted"}, status=200)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def task_run_error(request, id):
+    try:
+        task_run = TaskRun.get_by_id(id)
+    except ObjectDoesNotExist:
+        return JsonResponse({"message": "Not Found"}, status=404)
+    try:
+        location_id = json.loads(request.body)['task_run_location_id']
+    except Exception as e:
+        return JsonResponse({"message": e.message}, status=400)
+    if task_run.error(location_id) is False:
+        return JsonResponse({"message": "TaskRunLocation %s is not active" % location_id}, status=409)
+    return JsonResponse({"message": "accepted"}, status=200)
 
 @require_http_methods(["GET"])
 def data_source_records_by_file(request, id):
@@ -116,7 +327,76 @@ def data_source_records_by_file(request, id):
         file = FileDataObject.get_by_id(id)
     except ObjectDoesNotExist:
         return JsonResponse({"message": "Not Found"}, status=404)
-    return JsonResponse({"data_source_records": [o.to_struct() for o in file.data_source_records.all()]}, status=200)
+    return JsonResponse({"data_source_records": DataSourceRecord.to_structs(file.data_source_records.all())}, status=200)
+
+@require_http_methods(["GET"])
+def verify_ids(request):
+    """Checks one page of stored immutable objects against the hash of their
+    contents. A full scan, as made by "loom verify", takes one request per
+    page. Query parameters:
+      model   label of the model class to check, from "models"
+      limit   page size, up to API_INDEX_MAX_PAGE_SIZE
+      cursor  next_cursor from the previous page
+    Without "model", returns the labels of the model classes to check.
+    """
+    label = request.GET.get('model')
+    if label is None:
+        return JsonResponse({"models": [
+            Model._get_concrete_type_label()
+            for Model in verification.get_root_immutable_model_classes()]}, status=200)
+    try:
+        limit = min(int(request.GET.get('limit', settings.API_INDEX_PAGE_SIZE)),
+                    settings.API_INDEX_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+        (mismatches, next_cursor) = verification.find_id_mismatches_in_page(
+            verification.get_model_class(label), limit, cursor=request.GET.get('cursor'))
+    except (ValueError, universalmodels.exceptions.InvalidCursorError,
+            universalmodels.exceptions.InvalidInputError) as e:
+        return JsonResponse({"message": str(e)}, status=400)
+    for mismatch in mismatches:
+        logger.error('Id mismatch on %(model)s %(_id)s. Contents hash to '\
+                     '%(calculated_id)s.' % mismatch)
+    return JsonResponse({"mismatches": mismatches, "next_cursor": next_cursor}, status=200)
+
+@require_http_methods(["GET"])
+def scheduler_metrics(request):
+    return JsonResponse({"scheduler": Scheduler.get_metrics()}, status=200)
+
+@require_http_methods(["GET"])
+def struct_cache_stats(request):
+    """Hit rates of the cache of rendered ImmutableModels in this server
+    process, for tuning LOOM_STRUCT_CACHE_SIZE.
+    """
+    return JsonResponse({"struct_cache": structcache.get_struct_cache().get_stats()}, status=200)
+
+@require_http_methods(["GET"])
+def result_cache(request):
+    """Hit and miss counts for the result cache, and its entries, optionally
+    filtered by "task_definition_id".
+    """
+    entries = ResultCacheEntry.objects.order_by('-datetime_created')\
+        .select_related('task_definition', 'task_run')
+    task_definition_id = request.GET.get('task_definition_id')
+    if task_definition_id is not None:
+        entries = entries.filter(task_definition___id=task_definition_id)
+    return JsonResponse({
+        "result_cache": TaskRun.get_result_cache_stats(),
+        "entries": [entry.get_summary() for entry in entries]
+    }, status=200)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def invalidate_result_cache(request):
+    """Delete cache entries for "task_definition_id", or all entries if
+    it is not given.
+    """
+    try:
+        data = json.loads(request.body or '{}')
+    except Exception as e:
+        return JsonResponse({"message": e.message}, status=400)
+    count = ResultCacheEntry.invalidate(data.get('task_definition_id'))
+    return JsonResponse({"invalidated": count}, status=200)
 
 @csrf_exempt
 @require_http_methods(["GET"])
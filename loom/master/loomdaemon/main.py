@@ -16,7 +16,8 @@ MANAGE_EXECUTABLE = os.path.abspath(
         )
     )
 
-SLEEP_TIME_SECONDS = 1
+# Wait before restarting the scheduler if it exits
+RESTART_DELAY_SECONDS = 5
 
 class App():
    
@@ -25,22 +26,19 @@ class App():
         self.logger = loom_daemon_logger.get_logger(logfile, loglevel)
 
     def run(self):
+        # The scheduler is a long-running process that reacts to events
+        # recorded by the server. Restart it if it exits.
         while True:
-            cmd1 = [sys.executable,
+            cmd = [sys.executable,
                    MANAGE_EXECUTABLE,
-                   'update_tasks']
-            cmd2 = [sys.executable,
-                   MANAGE_EXECUTABLE,
-                   'run_tasks']
+                   'run_scheduler']
             if self.logfile:
-                cmd1.append('--logfile')
-                cmd1.append(self.logfile)
-                cmd2.append('--logfile')
-                cmd2.append(self.logfile)
-            self.logger.info('Running job queues')
-            retcode = subprocess.call(cmd1)
-            retcode = subprocess.call(cmd2)
-            time.sleep(SLEEP_TIME_SECONDS)
+                cmd.append('--logfile')
+                cmd.append(self.logfile)
+            self.logger.info('Starting scheduler')
+            retcode = subprocess.call(cmd)
+            self.logger.error('Scheduler exited with return code %s' % retcode)
+            time.sleep(RESTART_DELAY_SECONDS)
 
 if __name__=='__main__':
     App().run()
@@ -49,6 +49,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'analysis.middleware.GzipRequestMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -154,13 +155,42 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Models returned per page by index endpoints, by default and at most
+API_INDEX_PAGE_SIZE = int(os.getenv('LOOM_API_INDEX_PAGE_SIZE', 100))
+API_INDEX_MAX_PAGE_SIZE = int(os.getenv('LOOM_API_INDEX_MAX_PAGE_SIZE', 1000))
+# Gzipped request bodies are rejected with 413 if they expand beyond this
+MAX_DECOMPRESSED_REQUEST_BYTES = int(os.getenv('LOOM_MAX_DECOMPRESSED_REQUEST_MB', 256))*1024*1024
+
 WORKER_TYPE = os.getenv('WORKER_TYPE', 'LOCAL')
+# With WORKER_TYPE=WORKER_POOL, a TaskRun leased by a worker is offered to
+# others if no heartbeat renews the lease within this time
+WORKER_LEASE_SECONDS = int(os.getenv('LOOM_WORKER_LEASE_SECONDS', 120))
+# Mount inputs read-only into task containers from where they are stored,
+# instead of linking or copying them into the working dir. Only used where
+# workers can read the file server's paths directly, as with LOCAL.
+WORKER_MOUNT_INPUTS = os.getenv('LOOM_WORKER_MOUNT_INPUTS', 'true').lower() != 'false'
+# Inputs downloaded by workers are kept in this directory on each worker
+# node, to be shared by later tasks on the node. Hardlinks from the cache
+# into working dirs need it on the same filesystem as FILE_ROOT_FOR_WORKER.
+# The cache is not used if this is unset.
+WORKER_CACHE_DIR = os.getenv('LOOM_WORKER_CACHE_DIR')
+WORKER_CACHE_MAX_GB = float(os.getenv('LOOM_WORKER_CACHE_MAX_GB', 100))
 MASTER_URL_FOR_WORKER = os.getenv('MASTER_URL_FOR_WORKER', 'http://127.0.0.1:8000')
 FILE_SERVER_FOR_WORKER = os.getenv('FILE_SERVER_FOR_WORKER', socket.getfqdn())
 FILE_ROOT = os.getenv('FILE_ROOT', os.path.join(os.getenv('HOME'),'working_dir'))
 FILE_ROOT_FOR_WORKER = os.getenv('FILE_ROOT_FOR_WORKER')
 
 FILE_SERVER_TYPE = os.getenv('FILE_SERVER_TYPE')
+# Hash function that clients use to identify FileContents, e.g. md5, blake2b,
+# or md5-tree, which hashes chunks of a file on several cores. Hashes
+# listed in LOOM_ALIAS_HASH_FUNCTIONS are calculated in the same pass, so
+# files stored before a change of HASH_FUNCTION are still found. On Python 2,
+# blake2b and blake2b-tree need the pyblake2 package on every client and
+# worker, installed with "pip install loomengine[blake2]".
+HASH_FUNCTION = os.getenv('LOOM_HASH_FUNCTION', 'md5')
+ALIAS_HASH_FUNCTIONS = [hash_function for hash_function
+                        in os.getenv('LOOM_ALIAS_HASH_FUNCTIONS', '').split(',')
+                        if hash_function]
 IMPORT_DIR = os.getenv('IMPORT_DIR')
 STEP_RUNS_DIR = os.getenv('STEP_RUNS_DIR')
 BUCKET_ID = os.getenv('BUCKET_ID')
@@ -173,6 +203,28 @@ WORKER_DISK_TYPE = os.getenv('WORKER_DISK_TYPE')
 WORKER_DISK_SIZE = os.getenv('WORKER_DISK_SIZE')
 WORKER_DISK_MOUNT_POINT = os.getenv('WORKER_DISK_MOUNT_POINT')
 
+# Fraction of reads on which ImmutableModel ids are checked against a hash of
+# their contents. Stored ids are trusted by default. 'loom verify' runs a
+# full scan.
+UNIVERSALMODELS_ID_VERIFICATION_RATE = float(os.getenv('LOOM_ID_VERIFICATION_RATE', 0.0))
+
+# Rendered ImmutableModels kept in each server process. If
+# LOOM_STRUCT_CACHE_BACKEND names a cache in CACHES, entries are also shared
+# between processes through it.
+UNIVERSALMODELS_STRUCT_CACHE_SIZE = int(os.getenv('LOOM_STRUCT_CACHE_SIZE', 10000))
+UNIVERSALMODELS_STRUCT_CACHE_BACKEND = os.getenv('LOOM_STRUCT_CACHE_BACKEND') or None
+
+# The scheduler reacts to events recorded in the database, and falls back on
+# a full sweep of running work at a low frequency.
+SCHEDULER_EVENT_BATCH_SIZE = int(os.getenv('LOOM_SCHEDULER_EVENT_BATCH_SIZE', 100))
+SCHEDULER_POLL_INTERVAL_SECONDS = float(os.getenv('LOOM_SCHEDULER_POLL_INTERVAL_SECONDS', 0.2))
+SCHEDULER_SWEEP_INTERVAL_SECONDS = float(os.getenv('LOOM_SCHEDULER_SWEEP_INTERVAL_SECONDS', 60))
+SCHEDULER_EVENT_RETENTION_SECONDS = int(os.getenv('LOOM_SCHEDULER_EVENT_RETENTION_SECONDS', 24*60*60))
+
+# Reuse outputs of completed TaskRuns with the same TaskDefinition. A
+# WorkflowRun can also opt out with "use_result_cache": false.
+RESULT_CACHE_ENABLED = os.getenv('LOOM_RESULT_CACHE_ENABLED', 'true').lower() != 'false'
+
 # Graph Models settings to generate model schema plots
 GRAPH_MODELS = {
     'include_models': include_models,
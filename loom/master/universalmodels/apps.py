@@ -0,0 +1,20 @@
+import django
+from django.apps import AppConfig
+
+
+class UniversalModelsConfig(AppConfig):
+
+    name = 'universalmodels'
+    verbose_name = 'Universal Models'
+
+    def ready(self):
+        """Compile field classification for every universal model once all
+        models are loaded, so that serialization does not repeat that work,
+        and the registry of subclasses used to choose the model to create.
+        """
+        from universalmodels import plans
+        from universalmodels.models import _BaseModel
+        plans.build_plans(
+            [model for model in django.apps.apps.get_models()
+             if issubclass(model, _BaseModel)])
+        plans.get_subclass_registry()
@@ -66,3 +66,6 @@ class IllegalRelationError(Error):
 
 class UnsupportedFieldTypeError(Error):
     pass
+
+class InvalidCursorError(Error):
+    pass
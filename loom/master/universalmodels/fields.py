@@ -12,3 +12,32 @@ from django.db.models import IntegerField
 from django.db.models import TextField
 from django.db.models import UUIDField
 from jsonfield import JSONField
+
+
+class ConcreteTypeField(CharField):
+    """Records the most derived class of a multitable model instance as
+    "app_label.model_name", so the instance can be downcast with a single
+    query. It is set automatically on save, is not included in structs or
+    ids, and cannot be given as input.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', 255)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('default', '')
+        kwargs.setdefault('editable', False)
+        super(ConcreteTypeField, self).__init__(*args, **kwargs)
+
+
+class CounterField(IntegerField):
+    """A denormalized count maintained by the model itself, e.g. the number
+    of items waiting in a queue. Counters are only changed in the database
+    with increment_counters, never by create or update, so that saving a
+    model with a stale value cannot overwrite a concurrent increment. They
+    are not included in structs or ids, and cannot be given as input.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('default', 0)
+        kwargs.setdefault('editable', False)
+        super(CounterField, self).__init__(*args, **kwargs)
@@ -0,0 +1,333 @@
+"""Renders models as python structures, loading related models a level of the
+relation tree at a time instead of one query per model.
+"""
+
+import uuid
+
+from . import plans
+from .exceptions import *
+
+
+# Stay below the SQLite limit on the number of query parameters
+MAX_QUERY_PARAMETERS = 500
+
+
+def _pk_key(value):
+    """Normalize a primary key so that values read from a related field and
+    from the related model compare equal.
+    """
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    return value
+
+def chunks(values, size=MAX_QUERY_PARAMETERS):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i+size]
+
+def get_by_pks(model_class, pks):
+    """Returns {pk_key: model} for all models of model_class with the given
+    primary keys.
+    """
+    models = {}
+    for chunk in chunks(pks):
+        for model in model_class.objects.filter(pk__in=chunk):
+            models[_pk_key(model.pk)] = model
+    return models
+
+def downcast_models(models):
+    """Returns the list of models, each replaced by an instance of its most
+    derived class. Models with a ConcreteTypeField cost one query per
+    concrete subclass. Others cost one query per candidate subclass for each
+    level of inheritance. Neither depends on the number of models.
+    """
+    models = list(models)
+    _downcast_by_concrete_type(models)
+    _downcast_by_probing(models)
+    return models
+
+def _downcast_by_concrete_type(models):
+    indices_by_class = {}
+    for (i, model) in enumerate(models):
+        ConcreteModel = model._get_concrete_model_class()
+        if ConcreteModel is not None and ConcreteModel is not model.__class__:
+            indices_by_class.setdefault(ConcreteModel, []).append(i)
+    for (ConcreteModel, indices) in indices_by_class.iteritems():
+        found = get_by_pks(ConcreteModel, [models[i].pk for i in indices])
+        for i in indices:
+            try:
+                models[i] = found[_pk_key(models[i].pk)]
+            except KeyError:
+                raise ConcreteModel.DoesNotExist(
+                    "%s with _id %s was not found"
+                    % (ConcreteModel.__name__, models[i].pk))
+
+def _downcast_by_probing(models):
+    """Downcast models that do not record their concrete type by querying
+    each subclass table.
+    """
+    pending = set(i for (i, model) in enumerate(models)
+                  if model._get_concrete_model_class() is None)
+    while pending:
+        indices_by_class = {}
+        for i in pending:
+            indices_by_class.setdefault(models[i].__class__, []).append(i)
+        for (model_class, indices) in indices_by_class.iteritems():
+            pks = [models[i].pk for i in indices]
+            derived = {}
+            for field in model_class._get_plan().derived_class_fields:
+                for (key, model) in get_by_pks(
+                        field.related_model, pks).iteritems():
+                    if key in derived:
+                        raise Error("Multiple subclass instances exist for "\
+                                    "model %s. There should only be one."
+                                    % derived[key])
+                    derived[key] = model
+            for i in indices:
+                model = derived.get(_pk_key(models[i].pk))
+                if model is None:
+                    # Already downcast as far as possible
+                    pending.remove(i)
+                else:
+                    models[i] = model
+
+
+def parse_fields(fields):
+    """Parse a list of dotted field paths, e.g. ['_id', 'workflow.name'],
+    into a projection tree, {'_id': {}, 'workflow': {'name': {}}}. A field
+    with no subfields listed is rendered in full.
+    """
+    projection = {}
+    for path in fields:
+        node = projection
+        for name in path.strip().split('.'):
+            if not name:
+                raise InvalidInputError('Invalid field "%s"' % path)
+            node = node.setdefault(name, {})
+    return projection
+
+
+class GraphSerializer(object):
+    """Renders a list of models as python structures, identical to calling
+    to_struct on each one.
+
+    Nested structures are rendered once per model, so a child shared by
+    several parents is represented by the same dict in each of them. Treat
+    the output as read-only.
+
+    With verify_ids=False, ImmutableModel ids are not checked against their
+    contents, regardless of settings.
+
+    ImmutableModels found in the struct cache are not expanded, so none of
+    their children are loaded. With use_cache=False, everything is read
+    from the database.
+
+    With fields, a list of dotted field paths, only those fields are
+    rendered and related models outside of them are never loaded. Fields
+    that a model does not have are ignored, since models in one list may
+    be of different subclasses. Projected structs are partial, so their ids
+    are not verified.
+
+    Fields in DERIVED_STRUCT_FIELDS are rendered by each model, so they
+    cost whatever _render_derived_field costs, once per model.
+    """
+
+    def __init__(self, models, verify_ids=True, fields=None, use_cache=True):
+        self.models = list(models)
+        self.verify_ids = verify_ids
+        self.use_cache = use_cache
+        if fields is None:
+            self.projection = None
+        else:
+            self.projection = parse_fields(fields)
+        # (model class, pk) -> downcast model instance
+        self._nodes = {}
+        # (node key, projection token) -> {field name: node key or list of node keys}
+        self._children = {}
+        self._structs = {}
+        # node key -> struct from the struct cache
+        self._cached_structs = {}
+
+    def serialize(self):
+        roots = self._add_nodes(downcast_models(self.models))
+        level = [(key, self.projection) for key in roots]
+        while level:
+            level = self._load_children(level)
+        return [self._render(key, self.projection) for key in roots]
+
+    def get_version(self):
+        """Returns (latest datetime_updated, number of models) over every
+        InstanceModel loaded by serialize, including nested ones, whose
+        update does not change the datetime_updated of their parents. The
+        datetime is None if none of the models are InstanceModels.
+        """
+        datetimes = [model.datetime_updated for model in self._nodes.values()
+                     if getattr(model, 'datetime_updated', None) is not None]
+        return (max(datetimes) if datetimes else None, len(datetimes))
+
+    def _add_nodes(self, models):
+        """Register models as nodes. Returns the keys of all models, in
+        order, and leaves only new nodes to be expanded.
+        """
+        keys = []
+        for model in models:
+            key = self._get_key(model)
+            if key not in self._nodes:
+                self._nodes[key] = model
+            keys.append(key)
+        return keys
+
+    def _get_key(self, model):
+        return (model.__class__, _pk_key(model.pk))
+
+    def _get_token(self, projection):
+        # Projections are subtrees of self.projection, which outlives them
+        if projection is None:
+            return None
+        return id(projection)
+
+    def _get_child_projection(self, projection, field_name):
+        if projection is None or not projection[field_name]:
+            return None
+        return projection[field_name]
+
+    def _get_struct_fields(self, model_class, projection):
+        return [field_plan for field_plan in model_class._get_plan().struct_fields
+                if projection is None or field_plan.name in projection]
+
+    def _load_children(self, level):
+        """Load children of every (node key, projection) in 'level'. Returns
+        the pairs that have not been seen before, which form the next level.
+        """
+        new_entries = []
+        entries_by_group = {}
+        projections = {}
+        for (key, projection) in level:
+            entry = (key, self._get_token(projection))
+            if entry in self._children:
+                continue
+            if projection is None and self._load_cached_struct(key):
+                continue
+            self._children[entry] = {}
+            projections[entry[1]] = projection
+            entries_by_group.setdefault((key[0], entry[1]), []).append(entry)
+        for ((model_class, token), entries) in entries_by_group.iteritems():
+            projection = projections[token]
+            for field_plan in self._get_struct_fields(model_class, projection):
+                child_projection = self._get_child_projection(projection, field_plan.name)
+                if field_plan.kind == plans.X_TO_ONE:
+                    child_keys = self._load_x_to_one(entries, field_plan)
+                elif field_plan.kind == plans.X_TO_MANY:
+                    child_keys = self._load_x_to_many(entries, field_plan)
+                else:
+                    continue
+                new_entries.extend((child_key, child_projection) for child_key in child_keys)
+        return new_entries
+
+    def _load_cached_struct(self, key):
+        """True if the struct of this node is in the struct cache, in which
+        case its children are not needed.
+        """
+        if not self.use_cache:
+            return False
+        if key not in self._cached_structs:
+            struct = self._nodes[key]._get_cached_struct()
+            if struct is None:
+                return False
+            self._cached_structs[key] = struct
+        return True
+
+    def _load_x_to_one(self, entries, field_plan):
+        attname = field_plan.field.attname
+        related_pks = {}
+        for entry in entries:
+            related_pk = getattr(self._nodes[entry[0]], attname)
+            if related_pk is not None:
+                related_pks[entry] = _pk_key(related_pk)
+        related = self._get_downcast_by_pks(
+            field_plan.related_model, set(related_pks.values()))
+        new_keys = []
+        for entry in entries:
+            if entry not in related_pks:
+                self._children[entry][field_plan.name] = None
+                continue
+            child_key = related[related_pks[entry]]
+            self._children[entry][field_plan.name] = child_key
+            new_keys.append(child_key)
+        return new_keys
+
+    def _load_x_to_many(self, entries, field_plan):
+        field = field_plan.field
+        through = field.rel.through
+        from_name = field.m2m_field_name()
+        to_name = field.m2m_reverse_field_name()
+        children_pks = dict((entry[0][1], []) for entry in entries)
+        for chunk in chunks(children_pks.keys()):
+            rows = through.objects.filter(**{from_name+'__in': chunk})\
+                .order_by(field.sort_value_field_name)\
+                .values_list(from_name, to_name)
+            for (from_pk, to_pk) in rows:
+                children_pks[_pk_key(from_pk)].append(_pk_key(to_pk))
+        all_children_pks = set()
+        for pks in children_pks.values():
+            all_children_pks.update(pks)
+        related = self._get_downcast_by_pks(
+            field_plan.related_model, all_children_pks)
+        new_keys = []
+        for entry in entries:
+            child_keys = [related[pk] for pk in children_pks[entry[0][1]]]
+            self._children[entry][field_plan.name] = child_keys
+            new_keys.extend(child_keys)
+        return new_keys
+
+    def _get_downcast_by_pks(self, model_class, pks):
+        """Returns {pk_key: node key} for the given primary keys of
+        model_class, after downcasting and registering each model as a node.
+        """
+        models = get_by_pks(model_class, pks).values()
+        models = downcast_models(models)
+        return dict((_pk_key(model.pk), key) for (model, key)
+                    in zip(models, self._add_nodes(models)))
+
+    def _render(self, key, projection):
+        if projection is None and key in self._cached_structs:
+            return self._cached_structs[key]
+        entry = (key, self._get_token(projection))
+        struct = self._structs.get(entry)
+        if struct is not None:
+            return struct
+        model = self._nodes[key]
+        children = self._children[entry]
+        struct = {}
+        for field_plan in self._get_struct_fields(model.__class__, projection):
+            child_projection = self._get_child_projection(projection, field_plan.name)
+            if field_plan.kind == plans.X_TO_MANY:
+                field_struct = [self._render(child_key, child_projection) for child_key
+                                in children[field_plan.name]]
+            elif field_plan.kind == plans.X_TO_ONE:
+                child_key = children[field_plan.name]
+                if child_key is None:
+                    field_struct = None
+                else:
+                    field_struct = self._render(child_key, child_projection)
+            elif field_plan.kind == plans.NONRELATION:
+                field_struct = field_plan.converter(
+                    getattr(model, field_plan.name))
+            else:
+                raise UnsupportedFieldTypeError(
+                    'Unsupported field type %s' % field_plan.field.__class__)
+            # Empty values are ignored, as in _BaseModel.to_struct
+            if field_struct in [None, [], '']:
+                continue
+            struct[field_plan.name] = field_struct
+        for field_name in model.DERIVED_STRUCT_FIELDS:
+            if projection is not None and field_name not in projection:
+                continue
+            field_struct = model._render_derived_field(field_name)
+            if field_struct in [None, [], '']:
+                continue
+            struct[field_name] = field_struct
+        if self.verify_ids and projection is None:
+            model._verify_struct(struct)
+        self._structs[entry] = struct
+        return struct
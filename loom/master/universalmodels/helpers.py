@@ -1,4 +1,3 @@
-import copy
 import datetime
 import hashlib
 import json
@@ -8,6 +7,11 @@ from .exceptions import *
 
 
 JSON_DUMP_OPTIONS = {'separators': (',',':'), 'sort_keys': True}
+BLANK_VALUES = [None, [], '']
+
+# json.dumps encodes strings with this (C speedups permitting) when
+# ensure_ascii is set, the default
+_encode_string = json.encoder.encode_basestring_ascii
 
 def struct_to_json(data_struct):
     try:
@@ -61,8 +65,9 @@ class NonserializableTypeConverter(object):
 
     @classmethod
     def convert(cls, obj):
-        if type(obj) in cls.special_type_converters.keys():
-            obj = cls.special_type_converters[type(obj)](obj)
+        converter = cls.special_type_converters.get(type(obj))
+        if converter is not None:
+            obj = converter(obj)
         return obj
     
     @classmethod
@@ -74,8 +79,7 @@ class NonserializableTypeConverter(object):
             for key in obj.keys():
                 obj[key] = cls.convert_struct(obj[key])
         else:
-            if type(obj) in cls.special_type_converters.keys():
-                obj = cls.convert(obj)
+            obj = cls.convert(obj)
         return obj
 
     @classmethod
@@ -97,7 +101,7 @@ class StripBlanks(object):
             cls._branch_from_list(obj.values())
             to_remove = []
             for (key, value) in obj.iteritems():
-                if value in [None, [], '']:
+                if value in BLANK_VALUES:
                     to_remove.append(key)
             for key in to_remove:
                 obj.pop(key)
@@ -117,19 +121,78 @@ class IdCalculator:
     """
 
     def __init__(self, data_struct, id_key):
-        data_struct_copy = copy.deepcopy(data_struct)
-        self._data_struct = self._process_data_struct(data_struct_copy, id_key)
-
-    def _process_data_struct(self, data_struct, id_key):
-        data_struct_without_ids = StripKey.strip_key(data_struct, id_key)
-        data_struct_without_blanks = StripBlanks.strip_blanks(
-            data_struct_without_ids)
-        return data_struct_without_blanks
-        
+        self._data_struct = data_struct
+        self._id_key = id_key
+
     def get_id(self):
-        return self._calculate_id(self._data_struct)
+        hasher = hashlib.sha256()
+        CanonicalJson(self._id_key).write(self._data_struct, hasher.update)
+        return hasher.hexdigest()
 
     @classmethod
-    def _calculate_id(cls, data_struct):
-        data_json = struct_to_json(data_struct)
-        return hashlib.sha256(data_json).hexdigest()
+    def calculate_id_from_canonical_json(cls, canonical_json):
+        return hashlib.sha256(canonical_json).hexdigest()
+
+class CanonicalJson(object):
+    """Renders canonical JSON for a struct: id_key removed at every level,
+    blank values (None, [] or '') dropped from dicts, keys sorted and
+    nonserializable types converted. The output is the same as
+    StripKey, StripBlanks and struct_to_json applied to a copy, but it is
+    produced in one pass without copying or modifying the struct.
+
+    'fragments' maps id() of a dict within the struct to the canonical JSON
+    already computed for that dict, e.g. when the dict was used to create a
+    child model. Fragments are used as-is and not rendered again.
+    """
+
+    _encode = json.JSONEncoder(**JSON_DUMP_OPTIONS).encode
+
+    def __init__(self, id_key, fragments=None):
+        self.id_key = id_key
+        if fragments is None:
+            fragments = {}
+        self.fragments = fragments
+
+    def render(self, obj):
+        chunks = []
+        self.write(obj, chunks.append)
+        return ''.join(chunks)
+
+    def write(self, obj, write):
+        """Pass the canonical JSON for obj to the callable 'write' in
+        chunks, e.g. write=hashlib.sha256().update
+        """
+        if isinstance(obj, dict):
+            fragment = self.fragments.get(id(obj))
+            if fragment is not None:
+                write(fragment)
+            else:
+                self._write_dict(obj, write)
+        elif isinstance(obj, list):
+            write('[')
+            for (i, item) in enumerate(obj):
+                if i:
+                    write(',')
+                self.write(item, write)
+            write(']')
+        elif isinstance(obj, basestring):
+            write(_encode_string(obj))
+        else:
+            write(self._encode(NonserializableTypeConverter.convert(obj)))
+
+    def _write_dict(self, obj, write):
+        # Stripping id_key from children never makes a value blank, so
+        # blanks can be checked before rendering, as in StripBlanks
+        write('{')
+        is_first = True
+        for key in sorted(obj.keys()):
+            value = obj[key]
+            if key == self.id_key or value in BLANK_VALUES:
+                continue
+            if not is_first:
+                write(',')
+            is_first = False
+            write(_encode_string(key))
+            write(':')
+            self.write(value, write)
+        write('}')
@@ -1,3 +1,4 @@
+import collections
 import datetime
 import django
 from django.conf import settings
@@ -6,11 +7,15 @@ from django.db import models
 from django.db import transaction
 from django.utils import timezone
 import json
+import random
 import uuid
 
 from .exceptions import *
 from . import fields
+from . import graph
 from . import helpers
+from . import plans
+from . import structcache
 
 
 if not settings.USE_TZ == True:
@@ -22,6 +27,11 @@ def uuid_str():
 
 class _BaseModel(models.Model):
 
+    # Names of fields that to_struct renders from _render_derived_field
+    # rather than from a model field, e.g. values read from another table.
+    # They are read-only, and ignored in input structs.
+    DERIVED_STRUCT_FIELDS = []
+
     @classmethod
     def get_by_id(cls, _id):
         return cls.objects.get(_id=_id).downcast()
@@ -78,8 +88,8 @@ class _BaseModel(models.Model):
 
         struct = {}
         model = self.downcast()
-        for field in model._get_nonparent_nonbase_fields():
-            field_struct = model.get_field_as_struct(field)
+        for field_plan in model._get_plan().struct_fields:
+            field_struct = model._get_field_plan_as_struct(field_plan)
 
             # Empty values are ignored when rendering a struct. This ensures the
             # intuitive behavior that a model created from
@@ -91,23 +101,73 @@ class _BaseModel(models.Model):
             
             if field_struct in [None, [], '']:
                 continue
-            struct[field] = field_struct
+            struct[field_plan.name] = field_struct
+        for field_name in model.DERIVED_STRUCT_FIELDS:
+            field_struct = model._render_derived_field(field_name)
+            if field_struct in [None, [], '']:
+                continue
+            struct[field_name] = field_struct
         return struct
 
+    def _render_derived_field(self, field_name):
+        """Returns the struct of a field in DERIVED_STRUCT_FIELDS"""
+        raise NotImplementedError
+
+    @classmethod
+    def create_many(cls, data_structs_or_json):
+        """Create a model from each struct in a list, all in one
+        transaction. Returns the models in the same order.
+        """
+        data_structs = cls._any_to_list_of_structs(data_structs_or_json)
+        with transaction.atomic():
+            return [cls.create(data_struct) for data_struct in data_structs]
+
+    @classmethod
+    def _any_to_list_of_structs(cls, data):
+        data_structs = cls._any_to_struct(data)
+        if not isinstance(data_structs, list):
+            raise InvalidInputTypeError(
+                'Expected input of type list, but got %s' % data_structs)
+        return data_structs
+
+    @classmethod
+    def to_structs(cls, models, fields=None):
+        """Render a list of models as python structures. The output is the
+        same as calling to_struct on each model, but related models are
+        fetched in batches rather than one query per model. With fields, a
+        list of dotted field paths, only those fields are rendered.
+        """
+        return graph.GraphSerializer(models, fields=fields).serialize()
+
+    def _verify_struct(self, struct):
+        """Hook for checks on a freshly rendered struct. Used by
+        GraphSerializer, which renders without calling to_struct.
+        """
+        pass
+
+    def _get_cached_struct(self):
+        """Returns the struct of this model if it is cached, otherwise
+        None. Used by GraphSerializer to skip loading the model's children.
+        """
+        return None
+
+    @classmethod
+    def _get_plan(cls):
+        """Returns the SerializationPlan for this model class, which
+        classifies every field once rather than on every call.
+        """
+        return plans.get_plan(cls)
+
+    @classmethod
+    def _get_field_plan(cls, field_name):
+        return cls._get_plan().get_field_plan(field_name)
+
     def _get_nonparent_nonbase_fields(self):
-        valid_fields = []
-        for field in self._meta.get_fields():
-            if self._is_field_a_parent(field.name):
-                pass
-            elif self._is_field_a_base_class(field.name):
-                pass
-            else:
-                valid_fields.append(field.name)
-        return valid_fields
+        return [field_plan.name for field_plan
+                in self._get_plan().struct_fields]
 
     def _is_field_a_base_class(self, field):
-        model = getattr(self, field)
-        return isinstance(self, model.__class__)
+        return self._get_field_plan(field).is_base_class
     
     @classmethod
     def _struct_to_json(cls, data_struct):
@@ -156,33 +216,127 @@ class _BaseModel(models.Model):
         """
         self._verify_dict(data_struct)
         self.unsaved_x_to_many_related_objects = {}
+        # Canonical JSON of immutable children, keyed by id() of their input
+        self._canonical_json_fragments = {}
         for (key, value) in data_struct.iteritems():
+            if key in self.DERIVED_STRUCT_FIELDS:
+                continue
             self._create_or_update_field(key, value)
         self._set_datetime_updated()
-        models.Model.save(self)
+        self._set_concrete_type()
+        self._set_id(data_struct)
+        self._save_without_counters()
         self._save_x_to_many_related_objects()
 
-    def _save_x_to_many_related_objects(self):
+    def _save_without_counters(self):
+        counter_fields = self._get_plan().counter_fields
+        if not counter_fields or self._state.adding:
+            models.Model.save(self)
+            return
+        update_fields = [field.name for field in self._meta.concrete_fields
+                         if not field.primary_key
+                         and field.name not in counter_fields]
+        models.Model.save(self, update_fields=update_fields)
+
+    def increment_counters(self, **deltas):
+        """Add to the given CounterFields in the database, e.g.
+        increment_counters(item_count=-1), and reload all counters on this
+        instance. Call inside a transaction if the reloaded values are used
+        for a decision.
+        """
+        self.__class__.objects.filter(pk=self.pk).update(
+            **dict((name, models.F(name) + delta)
+                   for (name, delta) in deltas.iteritems()))
+        self.refresh_counters()
+
+    def refresh_counters(self, for_update=False):
+        """Reload CounterFields from the database. With for_update=True, the
+        row is also locked until the end of the current transaction, on
+        backends that support it. Others, like sqlite, lock the whole
+        database for writing transactions instead.
+        """
+        counter_fields = self._get_plan().counter_fields
+        if not counter_fields:
+            return
+        if for_update:
+            values = self.__class__.objects.select_for_update()\
+                .filter(pk=self.pk).values(*counter_fields).get()
+            for (name, value) in values.iteritems():
+                setattr(self, name, value)
+        else:
+            self.refresh_from_db(fields=counter_fields)
+
+    def _save_x_to_many_related_objects(self, diff=False):
         """Cannot create one-to-many or many-to-many relations until
         both models are saved, but saving the model before defining
         other fields can raise errors if those fields are required
         (i.e. null=False).
         
         Now that all other fields are added and the model is saved,
-        we add x-to-many relations.
+        we add x-to-many relations. With diff=True, existing relations
+        are changed rather than rewritten.
         """
         while self.unsaved_x_to_many_related_objects:
             (key, children) = self.unsaved_x_to_many_related_objects.\
                               popitem()
             field = getattr(self, key)
+            if diff:
+                self._update_x_to_many_relation(field, children)
+                continue
             field.clear()
             for child in children:
                 field.add(child)
 
+    def _update_x_to_many_relation(self, field, children):
+        """Make the related manager 'field' hold 'children', in order.
+        Relations are sorted, so children can be appended or removed
+        without touching the others. Any other change, such as a new
+        order, rewrites the relation.
+        """
+        new_children = collections.OrderedDict()
+        for child in children:
+            new_children.setdefault(graph._pk_key(child.pk), child)
+        new_pks = new_children.keys()
+        old_pks = [graph._pk_key(pk) for pk in field.values_list('pk', flat=True)]
+        if new_pks == old_pks:
+            return
+        if new_pks[:len(old_pks)] == old_pks:
+            field.add(*new_children.values()[len(old_pks):])
+        elif [pk for pk in old_pks if pk in new_children] == new_pks:
+            field.remove(*[pk for pk in old_pks if pk not in new_children])
+        else:
+            field.clear()
+            field.add(*new_children.values())
+
     def _set_datetime_updated(self):
         # Override if needed in child
         pass
 
+    def _set_id(self, data_struct):
+        # Override if needed in child
+        pass
+
+    def _set_concrete_type(self):
+        field_name = self._get_plan().concrete_type_field
+        if field_name is not None:
+            setattr(self, field_name, self._get_concrete_type_label())
+
+    @classmethod
+    def _get_concrete_type_label(cls):
+        return '%s.%s' % (cls._meta.app_label, cls._meta.model_name)
+
+    def _get_concrete_model_class(self):
+        """Returns the model class recorded in the ConcreteTypeField, or None
+        if the model has no such field or it was never set.
+        """
+        field_name = self._get_plan().concrete_type_field
+        if field_name is None:
+            return None
+        label = getattr(self, field_name)
+        if not label:
+            return None
+        return django.apps.apps.get_model(label)
+
     def _create_or_update_field(self, key, value):
         """Assign the data in 'value' to the field named 'key'
         """
@@ -191,13 +345,18 @@ class _BaseModel(models.Model):
         # an error.
         self._verify_field_is_not_a_parent(key)
         self._verify_relation_is_legal(key)
-        
-        if self._is_x_to_many_field(key):
+
+        kind = self._get_field_plan(key).kind
+        if kind == plans.X_TO_MANY:
             self._create_or_update_x_to_many_field(key, value)
-        elif self._is_x_to_one_field(key):
+        elif kind == plans.X_TO_ONE:
             self._create_or_update_x_to_one_field(key, value)
-        elif self._is_supported_nonrelation_field(key):
+        elif kind == plans.NONRELATION:
             self._create_or_update_nonrelation_field(key, value)
+        elif kind == plans.INTERNAL:
+            raise InvalidInputError(
+                "Field %s of model %s is set automatically and cannot be "\
+                "given as input" % (key, self.__class__.__name__))
         else:
             field = self._meta.get_field(key)
             raise UnsupportedFieldTypeError(
@@ -205,36 +364,19 @@ class _BaseModel(models.Model):
                 % (field.__class__.__name__, key, self))
         
     def _is_x_to_many_field(self, key):
-        field = self._meta.get_field(key)
-        return isinstance(field, fields.OneToManyField) or \
-            isinstance(field, fields.ManyToManyField)
+        return self._get_field_plan(key).kind == plans.X_TO_MANY
 
     def _is_x_to_one_field(self, key):
-        field = self._meta.get_field(key)
-        return isinstance(field, fields.OneToOneField) or \
-            isinstance(field, fields.ForeignKey)
+        return self._get_field_plan(key).kind == plans.X_TO_ONE
 
     def _is_one_to_x_field(self, key):
-        field = self._meta.get_field(key)
-        return isinstance(field, fields.OneToManyField) or \
-            isinstance(field, fields.OneToOneField)
+        return self._get_field_plan(key).is_one_to_x
 
     def _is_json_field(self, key):
-        field = self._meta.get_field(key)
-        return isinstance(field, fields.JSONField)
+        return self._get_field_plan(key).is_json
 
     def _is_supported_nonrelation_field(self, key):
-        SUPPORTED_NONRELATION_FIELD_CLASSES = [
-            fields.BooleanField,
-            fields.CharField,
-            fields.DateTimeField,
-            fields.IntegerField,
-            fields.JSONField,
-            fields.TextField,
-            fields.UUIDField
-        ]
-        field_class = self._meta.get_field(key).__class__
-        return field_class in SUPPORTED_NONRELATION_FIELD_CLASSES
+        return self._get_field_plan(key).kind == plans.NONRELATION
 
     def _create_or_update_x_to_many_field(self, key, valuelist):
         # Cannot create x-to-many relation until model is
@@ -287,9 +429,10 @@ class _BaseModel(models.Model):
                 "field is a parent." % (key, self.__class__.__name__))
 
     def _verify_relation_is_legal(self, key):
-        if self._is_one_to_x_field(key):
-            self._meta.get_field(key).related_model.\
-                _verify_x_to_one_child_is_legal(self.__class__)
+        field_plan = self._get_field_plan(key)
+        if field_plan.is_one_to_x:
+            field_plan.related_model._verify_x_to_one_child_is_legal(
+                self.__class__)
         
     def _verify_list_input(self, key, value):
         if not isinstance(value, list):
@@ -327,6 +470,9 @@ class _BaseModel(models.Model):
         if value.get('_id') is None:
             # No ID found, this is a new model. Create it from scratch.
             child = Model.create(value)
+            canonical_json = getattr(child, '_canonical_json', None)
+            if canonical_json is not None:
+                self._canonical_json_fragments[id(value)] = canonical_json
         else:
             child = Model.objects.get(_id=value.get('_id'))
             if isinstance(child, InstanceModel):
@@ -342,12 +488,14 @@ class _BaseModel(models.Model):
                 
                 # TODO: Allow a model with '_id' and no other fields
                 
-                if value.get('_id') != \
-                   ImmutableModel._calculate_unique_id(value):
+                canonical_json = helpers.CanonicalJson('_id').render(value)
+                if value.get('_id') != helpers.IdCalculator.\
+                   calculate_id_from_canonical_json(canonical_json):
                     raise AttemptedToUpdateImmutableError(
                         "Attempted to update an immutable object. "\
                         "Original: '%s'. Update: '%s'"
                         % (child.to_struct(), value))
+                self._canonical_json_fragments[id(value)] = canonical_json
             else:
                 raise Error(
                     "All model classes must extend ImmutableModel or "\
@@ -394,16 +542,11 @@ class _BaseModel(models.Model):
         fields found in the data object.
         If more than one match are found, rase an exception.
         This works for either an abstract base class or a 
-        multitable base class.
-        """
-        subclass_models = []
-        for Model in django.apps.apps.get_models():
-            if issubclass(Model, AbstractModel):
-                subclass_models.append(Model)
-        matching_models = []
-        for Model in subclass_models:
-            if Model._do_all_fields_match(fields):
-                matching_models.append(Model)
+        multitable base class. Subclasses are looked up in the registry
+        built when the app is ready.
+        """
+        matching_models = plans.get_subclass_registry().get_matching_models(
+            AbstractModel, fields)
         if len(matching_models) == 0:
             raise CouldNotFindSubclassError(
                 "Failed to find a subclass of model %s that matches "\
@@ -412,7 +555,7 @@ class _BaseModel(models.Model):
             raise CouldNotFindUniqueSubclassError(
                 "Failed to find a unique subclass of model %s that "\
                 "matches these fields: %s. Multiple models matched: %s"
-                % (AbstractModel.__name__, fields.keys(), matching_models))
+                % (AbstractModel.__name__, list(fields), matching_models))
         else:
             # Successfully found one match
             return matching_models[0]
@@ -421,12 +564,17 @@ class _BaseModel(models.Model):
     def _do_all_fields_match(cls, fields):
         """Returns true if all candidate fields are found on this model
         """
-        return set(fields).issubset(set(cls._meta.get_all_field_names()))
+        return plans.get_subclass_registry().get_field_names(cls).issuperset(fields)
         
     def downcast(self):
         """ Return the most derived class of this model with the same ID as 
         self. If no derived instances exist, return self.
         """
+        ConcreteModel = self._get_concrete_model_class()
+        if ConcreteModel is not None:
+            if ConcreteModel is self.__class__:
+                return self
+            return ConcreteModel.objects.get(pk=self.pk)
         derived_models = []
         for field in self._get_derived_class_field_names():
             try:
@@ -451,6 +599,14 @@ class _BaseModel(models.Model):
             # Proceed recursively until no more downcasting is possible.
             return derived_models[0].downcast()
 
+    @classmethod
+    def downcast_many(cls, models):
+        """Downcast a list or queryset of models. Returns a list in the same
+        order. Costs one query per concrete subclass found, rather than
+        one or more queries per model.
+        """
+        return graph.downcast_models(models)
+
     def _get_derived_class_field_names(self):
         """This function returns the name of any fields that represent
         derived model classes.
@@ -465,35 +621,28 @@ class _BaseModel(models.Model):
         instantiate an instance of the abstract base class.
         """
 
-        derived_model_fields = []
-        for field in self._meta.get_fields():
-            if isinstance(field, models.fields.related.OneToOneRel) and \
-                    issubclass(field.related_model, self.__class__):
-                derived_model_fields.append(field)
-        return derived_model_fields
+        return self._get_plan().derived_class_fields
 
     def get_field_as_struct(self, field):
         """Returns only the data stored under field as a python structure.
         This is used recursively with to_struct to render a full model and its
         children.
         """
-        if self._is_x_to_many_field(field):
-            return self._get_x_to_many_field_as_struct(field)
-        elif self._is_x_to_one_field(field):
-            return self._get_x_to_one_field_as_struct(field)
-        elif self._is_supported_nonrelation_field(field):
-            return self._get_supported_nonrelation_field_as_struct(field)
+        return self._get_field_plan_as_struct(self._get_field_plan(field))
+
+    def _get_field_plan_as_struct(self, field_plan):
+        if field_plan.kind == plans.X_TO_MANY:
+            return self._get_x_to_many_field_as_struct(field_plan.name)
+        elif field_plan.kind == plans.X_TO_ONE:
+            return self._get_x_to_one_field_as_struct(field_plan.name)
+        elif field_plan.kind == plans.NONRELATION:
+            return field_plan.converter(getattr(self, field_plan.name))
         else:
             raise UnsupportedFieldTypeError(
-                'Unsupported field type %s' % field.__class__)
+                'Unsupported field type %s' % field_plan.field.__class__)
                 
     def _is_field_a_parent(self, field_name):
-        if not self._meta.get_field(field_name).is_relation:
-            # This is a simple property, not a relationship field
-            return False
-        # Relationship fields are defined on the parent, so auto_created==True
-        # indicates that the field points to a child, and self is the parent.
-        return self._meta.get_field(field_name).auto_created
+        return self._get_field_plan(field_name).is_parent
 
     def _get_x_to_many_field_as_struct(self, field):
         """Return the contents of models related by a one-to-many or 
@@ -557,21 +706,41 @@ class InstanceModel(_BaseModel):
 
     def update(self, update_json):
         """Use a JSON or python structure to update an existing model and
-        save it to the database.
+        save it to the database. Only the fields contained in update_json
+        are written, so the cost of an update does not depend on the size
+        of the model's other relations.
         """
         update_struct = self._any_to_struct(update_json)
         self._verify_update_id_matches_model(update_struct.get('_id'))
-        # Start with existing model as a dict and update any fields that
-        # are contained in update_json
         self.validate_patch_input(update_struct)
-        model_struct = self.to_struct()
-        model_struct.update(update_struct)
         # Use a transaction for update of the model and any children
         with transaction.atomic():
-            self._create_or_update_fields(model_struct)
+            self._update_fields(update_struct)
             self.validate_model()
         return self
 
+    def _update_fields(self, update_struct):
+        """Write the fields in update_struct. Columns are saved with
+        update_fields, and x-to-many relations only add and remove the
+        children that changed.
+        """
+        self._verify_dict(update_struct)
+        self.unsaved_x_to_many_related_objects = {}
+        self._canonical_json_fragments = {}
+        update_fields = set(['datetime_updated'])
+        for (key, value) in update_struct.iteritems():
+            if key == '_id':
+                # Already checked against this model
+                continue
+            if key in self.DERIVED_STRUCT_FIELDS:
+                continue
+            self._create_or_update_field(key, value)
+            if self._get_field_plan(key).kind != plans.X_TO_MANY:
+                update_fields.add(key)
+        self._set_datetime_updated()
+        models.Model.save(self, update_fields=update_fields)
+        self._save_x_to_many_related_objects(diff=True)
+
     @classmethod
     def validate_create_input(cls, data_struct):
         """This can be overridden in the model definitions to include a
@@ -609,8 +778,9 @@ class ImmutableModel(_BaseModel):
         it to the database"""
         data_struct = cls._any_to_struct(data_struct_or_json)
         cls.validate_create_input(data_struct)
-        _id = cls._verify_input_id_matches_hash(data_struct)
-        data_struct.update({'_id': _id})
+        # The _id is calculated in _set_id, after children are created,
+        # so that their canonical JSON can be reused.
+        #
         # If inheritance is used, create the model instance using the
         # most derived class that matches the fields in the input.
         Model = cls._select_best_subclass_model_by_fields(data_struct)
@@ -621,6 +791,85 @@ class ImmutableModel(_BaseModel):
             o.validate_model()
         return o
             
+    @classmethod
+    def create_many(cls, data_structs_or_json):
+        """Create models from a list of structs in one transaction. Returns
+        the models in input order.
+
+        Input is deduplicated by _id, so models that already exist or appear
+        more than once are created only once. Models with no relations and no
+        multitable inheritance are inserted with bulk_create.
+        """
+        data_structs = cls._any_to_list_of_structs(data_structs_or_json)
+        ids = [cls._calculate_input_id(data_struct)
+               for data_struct in data_structs]
+        done_ids = cls._get_existing_ids(ids)
+        unsaved_models = collections.OrderedDict()
+        with transaction.atomic():
+            for (_id, data_struct) in zip(ids, data_structs):
+                if _id in done_ids:
+                    continue
+                done_ids.add(_id)
+                Model = cls._select_best_subclass_model_by_fields(data_struct)
+                if Model._can_bulk_create(data_struct):
+                    unsaved_models.setdefault(Model, []).append(
+                        Model._build_unsaved(_id, data_struct))
+                else:
+                    Model.create(data_struct)
+            for (Model, models) in unsaved_models.iteritems():
+                Model.objects.bulk_create(
+                    models, batch_size=graph.MAX_QUERY_PARAMETERS)
+                for model in models:
+                    model.validate_model()
+        models = graph.get_by_pks(cls, set(ids))
+        return graph.downcast_models([models[_id] for _id in ids])
+
+    @classmethod
+    def _calculate_input_id(cls, data_struct):
+        cls._verify_struct_is_dict(data_struct)
+        _id = helpers.IdCalculator(data_struct=data_struct, id_key='_id').get_id()
+        id_from_input = data_struct.get('_id')
+        if id_from_input is not None and id_from_input != _id:
+            raise UniqueIdMismatchError(
+                "The input _id %s is out of sync with the hash of "\
+                "contents %s on model %s"
+                %(id_from_input, data_struct, cls.__name__))
+        return _id
+
+    @classmethod
+    def _verify_struct_is_dict(cls, data_struct):
+        if not isinstance(data_struct, dict):
+            raise InvalidInputTypeError(
+                'Expected input of type dict, but got %s' % data_struct)
+
+    @classmethod
+    def _get_existing_ids(cls, ids):
+        existing_ids = set()
+        for chunk in graph.chunks(set(ids)):
+            existing_ids.update(
+                cls.objects.filter(_id__in=chunk).values_list('_id', flat=True))
+        return existing_ids
+
+    @classmethod
+    def _can_bulk_create(cls, data_struct):
+        """bulk_create does not support multitable inheritance, and
+        related models would have to be created first.
+        """
+        if cls._meta.parents:
+            return False
+        return all([cls._get_field_plan(key).kind == plans.NONRELATION
+                    for key in data_struct.keys()])
+
+    @classmethod
+    def _build_unsaved(cls, _id, data_struct):
+        cls.validate_create_input(data_struct)
+        model = cls()
+        for (key, value) in data_struct.iteritems():
+            model._create_or_update_field(key, value)
+        model._set_concrete_type()
+        model._id = _id
+        return model
+
     @classmethod
     def validate_create_input(cls, data_struct):
         """This can be overridden in the model definitions to include a
@@ -628,17 +877,26 @@ class ImmutableModel(_BaseModel):
         """
         pass
 
-    @classmethod
-    def _verify_input_id_matches_hash(cls, data_struct):
+    def _set_id(self, data_struct):
+        """Set _id to the hash of the input. The canonical JSON of each child
+        created along with this model is reused rather than rendered again,
+        so a large tree is serialized once. The result is kept in
+        _canonical_json for this model's parent.
+        """
+        self._canonical_json = helpers.CanonicalJson(
+            '_id', self._canonical_json_fragments).render(data_struct)
+        _id = helpers.IdCalculator.calculate_id_from_canonical_json(
+            self._canonical_json)
         id_from_input = data_struct.get('_id')
-        _id = cls._calculate_unique_id(data_struct)
         if id_from_input is not None:
             if id_from_input != _id:
                 raise UniqueIdMismatchError(
                     "The input _id %s is out of sync with the hash of "\
                     "contents %s on model %s"
-                    %(id_from_input, data_struct, cls.__name__))
-        return _id
+                    %(id_from_input, data_struct, self.__class__.__name__))
+        self._id = _id
+        structcache.get_struct_cache().set(
+            _id, canonical_json=self._canonical_json)
 
     @classmethod
     def _verify_x_to_one_child_is_legal(cls, parent_class):
@@ -684,20 +942,60 @@ class ImmutableModel(_BaseModel):
             'on Immutable models.' % Child)
 
     def to_struct(self):
-        """Override base model to include an ID verification.
-        """
+        """Override base model to include an ID verification. The struct
+        depends only on the _id, so it is taken from the struct cache when
+        possible, without rendering any children.
+        """
+        verify = self._should_verify_id()
+        if not verify:
+            struct = structcache.get_struct_cache().get_struct(self._id)
+            if struct is not None:
+                return struct
         struct = super(ImmutableModel, self).to_struct()
-        self._verify_unique_id(struct)
+        self._cache_struct(struct, verify)
         return struct
 
+    def _verify_struct(self, struct):
+        self._cache_struct(struct, self._should_verify_id())
+
+    def _get_cached_struct(self):
+        if self._should_verify_id():
+            return None
+        return structcache.get_struct_cache().get_struct(self._id)
+
+    def _cache_struct(self, struct, verify):
+        canonical_json = None
+        if verify:
+            canonical_json = self._verify_unique_id(struct)
+        structcache.get_struct_cache().set(
+            self._id, struct=struct, canonical_json=canonical_json)
+
+    @classmethod
+    def _should_verify_id(cls):
+        """Ids are checked on a fraction of reads given by the setting
+        UNIVERSALMODELS_ID_VERIFICATION_RATE, from 0.0 (trust stored ids) to
+        1.0 (check every time, the default). Reads that are checked do not
+        use the struct cache.
+        """
+        rate = getattr(settings, 'UNIVERSALMODELS_ID_VERIFICATION_RATE', 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+    def _calculate_id_from_struct(self, struct):
+        return helpers.IdCalculator(data_struct=struct, id_key='_id').get_id()
+
     def _verify_unique_id(self, struct):
         """Verify that model contents match the model ID, which is a hash of 
-        the contents.
+        the contents. Returns the canonical JSON of the struct. That of
+        children in the struct cache is not rendered again.
         """
-        if not self._calculate_unique_id(struct) == self._id:
+        canonical_json = helpers.CanonicalJson(
+            '_id', structcache.get_struct_cache().get_fragments(struct)).render(struct)
+        if not helpers.IdCalculator.calculate_id_from_canonical_json(
+                canonical_json) == self._id:
             raise UniqueIdMismatchError(
                 "The _id %s is out of sync with the hash of contents %s "\
                 "on model %s" %(self._id, struct, self.__class__))
+        return canonical_json
 
     class Meta:
         abstract = True
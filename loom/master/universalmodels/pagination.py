@@ -0,0 +1,74 @@
+"""Keyset pagination. A cursor encodes the ordering values of the last model
+on a page, so every page takes the same time, and models created while
+paging are neither skipped nor repeated.
+"""
+
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .exceptions import *
+
+
+def get_order_fields(model_class):
+    field_names = [field.name for field in model_class._meta.get_fields()]
+    if 'datetime_created' in field_names:
+        return ['datetime_created', '_id']
+    return ['_id']
+
+def get_page(queryset, limit, cursor=None):
+    """Returns (models, next_cursor). next_cursor is None on the last page.
+    """
+    order_fields = get_order_fields(queryset.model)
+    queryset = queryset.order_by(*order_fields)
+    if cursor:
+        queryset = queryset.filter(
+            _get_after_filter(order_fields, decode_cursor(cursor, order_fields)))
+    models = list(queryset[:limit+1])
+    if len(models) > limit:
+        models = models[:limit]
+        next_cursor = encode_cursor(models[-1], order_fields)
+    else:
+        next_cursor = None
+    return (models, next_cursor)
+
+def _get_after_filter(order_fields, values):
+    """Q for rows that sort after values, e.g. for (a, b):
+    a > a0 OR (a = a0 AND b > b0)
+    """
+    after = Q()
+    for i in reversed(range(len(order_fields))):
+        greater = Q(**{order_fields[i]+'__gt': values[i]})
+        if i == len(order_fields) - 1:
+            after = greater
+        else:
+            after = greater | (Q(**{order_fields[i]: values[i]}) & after)
+    return after
+
+def encode_cursor(model, order_fields):
+    values = []
+    for field_name in order_fields:
+        value = getattr(model, field_name)
+        if field_name == 'datetime_created':
+            value = value.isoformat()
+        else:
+            value = str(value)
+        values.append(value)
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+def decode_cursor(cursor, order_fields):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise InvalidCursorError('Invalid cursor "%s"' % cursor)
+    if not isinstance(values, list) or len(values) != len(order_fields):
+        raise InvalidCursorError('Invalid cursor "%s"' % cursor)
+    if order_fields[0] == 'datetime_created':
+        if not isinstance(values[0], basestring):
+            raise InvalidCursorError('Invalid cursor "%s"' % cursor)
+        values[0] = parse_datetime(values[0])
+        if values[0] is None:
+            raise InvalidCursorError('Invalid cursor "%s"' % cursor)
+    return values
@@ -0,0 +1,231 @@
+"""Classification of the fields of each model class for to_struct and
+create/update, made once per class instead of on every call.
+"""
+
+import collections
+import django.apps
+from django.db import models
+
+from . import fields
+from . import helpers
+
+
+X_TO_MANY = 'x_to_many'
+X_TO_ONE = 'x_to_one'
+NONRELATION = 'nonrelation'
+# Maintained by universalmodels, e.g. ConcreteTypeField or CounterField
+INTERNAL = 'internal'
+UNSUPPORTED = 'unsupported'
+
+X_TO_MANY_FIELD_CLASSES = (
+    fields.OneToManyField,
+    fields.ManyToManyField,
+)
+
+X_TO_ONE_FIELD_CLASSES = (
+    fields.OneToOneField,
+    fields.ForeignKey,
+)
+
+ONE_TO_X_FIELD_CLASSES = (
+    fields.OneToManyField,
+    fields.OneToOneField,
+)
+
+SUPPORTED_NONRELATION_FIELD_CLASSES = (
+    fields.BooleanField,
+    fields.CharField,
+    fields.DateTimeField,
+    fields.IntegerField,
+    fields.JSONField,
+    fields.TextField,
+    fields.UUIDField,
+)
+
+
+class FieldPlan(collections.namedtuple(
+        'FieldPlan',
+        ['name', 'field', 'kind', 'related_model', 'converter',
+         'is_parent', 'is_base_class', 'is_one_to_x', 'is_json'])):
+    """Precomputed classification of a single model field.
+    """
+
+    @classmethod
+    def create(cls, model_class, field):
+        kind = cls._get_kind(field)
+        is_parent = cls._is_parent(field)
+        if kind == NONRELATION:
+            converter = helpers.NonserializableTypeConverter.convert
+        else:
+            converter = None
+        return cls(
+            name=field.name,
+            field=field,
+            kind=kind,
+            related_model=field.related_model if field.is_relation else None,
+            converter=converter,
+            is_parent=is_parent,
+            is_base_class=cls._is_base_class(model_class, field, kind, is_parent),
+            is_one_to_x=isinstance(field, ONE_TO_X_FIELD_CLASSES),
+            is_json=isinstance(field, fields.JSONField),
+        )
+
+    @classmethod
+    def _get_kind(cls, field):
+        if isinstance(field, (fields.ConcreteTypeField, fields.CounterField)):
+            return INTERNAL
+        elif isinstance(field, X_TO_MANY_FIELD_CLASSES):
+            return X_TO_MANY
+        elif isinstance(field, X_TO_ONE_FIELD_CLASSES):
+            return X_TO_ONE
+        elif field.__class__ in SUPPORTED_NONRELATION_FIELD_CLASSES:
+            return NONRELATION
+        else:
+            return UNSUPPORTED
+
+    @classmethod
+    def _is_parent(cls, field):
+        if not field.is_relation:
+            # This is a simple property, not a relationship field
+            return False
+        # Relationship fields are defined on the parent, so auto_created==True
+        # indicates that the field points to a child, and the model is the
+        # parent.
+        return field.auto_created
+
+    @classmethod
+    def _is_base_class(cls, model_class, field, kind, is_parent):
+        """True if the field points to a model that model_class inherits from,
+        e.g. a multitable pointer to the base class.
+        """
+        if is_parent or kind != X_TO_ONE:
+            return False
+        return issubclass(model_class, field.related_model)
+
+
+class SerializationPlan(object):
+    """Field classification for one model class.
+    """
+
+    def __init__(self, model_class):
+        self.model_class = model_class
+        self._field_plans = {}
+        self.struct_fields = []
+        # Reverse multitable pointers to subclasses, used to downcast
+        self.derived_class_fields = []
+        # Name of the ConcreteTypeField, if the model has one
+        self.concrete_type_field = None
+        # Names of CounterFields, which are excluded when the model is saved
+        self.counter_fields = []
+        for field in model_class._meta.get_fields():
+            field_plan = FieldPlan.create(model_class, field)
+            self._field_plans[field_plan.name] = field_plan
+            if field_plan.kind == INTERNAL:
+                if isinstance(field, fields.ConcreteTypeField):
+                    self.concrete_type_field = field.name
+                elif isinstance(field, fields.CounterField):
+                    self.counter_fields.append(field.name)
+            elif not (field_plan.is_parent or field_plan.is_base_class):
+                self.struct_fields.append(field_plan)
+            if isinstance(field, models.fields.related.OneToOneRel) and \
+                    issubclass(field.related_model, model_class):
+                self.derived_class_fields.append(field)
+
+    def get_field_plan(self, field_name):
+        try:
+            return self._field_plans[field_name]
+        except KeyError:
+            # Not known when the plan was built, e.g. a reverse relation
+            # added by a model registered later. Raises FieldDoesNotExist
+            # if there is no such field.
+            field = self.model_class._meta.get_field(field_name)
+            field_plan = FieldPlan.create(self.model_class, field)
+            self._field_plans[field_name] = field_plan
+            return field_plan
+
+
+_plans = {}
+
+def get_plan(model_class):
+    try:
+        return _plans[model_class]
+    except KeyError:
+        plan = SerializationPlan(model_class)
+        _plans[model_class] = plan
+        return plan
+
+def build_plans(model_classes):
+    """Compile plans ahead of time, normally when the app registry is ready.
+    """
+    for model_class in model_classes:
+        _plans[model_class] = SerializationPlan(model_class)
+
+
+class SubclassRegistry(object):
+    """The concrete model classes that extend each model class, abstract or
+    not, for choosing the model to create from an input struct. Matches are
+    kept by field signature, the set of field names in the input, so a
+    signature seen before is resolved with a dictionary lookup.
+    """
+
+    def __init__(self, model_classes):
+        self.model_classes = list(model_classes)
+        # base class -> concrete subclasses, including itself if concrete
+        self._subclasses = {}
+        # concrete class -> every name accepted by _meta.get_field
+        self._field_names = {}
+        for model_class in self.model_classes:
+            self._field_names[model_class] = frozenset(
+                model_class._meta.get_all_field_names()
+                + model_class.DERIVED_STRUCT_FIELDS)
+            for base_class in model_class.__mro__:
+                if issubclass(base_class, models.Model):
+                    self._subclasses.setdefault(base_class, []).append(model_class)
+        # (base class, field signature) -> matching concrete subclasses
+        self._matches = {}
+
+    def get_subclasses(self, base_class):
+        return self._subclasses.get(base_class, [])
+
+    def get_field_names(self, model_class):
+        try:
+            return self._field_names[model_class]
+        except KeyError:
+            return frozenset(model_class._meta.get_all_field_names()
+                             + getattr(model_class, 'DERIVED_STRUCT_FIELDS', []))
+
+    def get_matching_models(self, base_class, field_names):
+        """Returns the concrete subclasses of base_class that have all of
+        the given fields.
+        """
+        key = (base_class, frozenset(field_names))
+        try:
+            return self._matches[key]
+        except KeyError:
+            pass
+        matches = [model_class for model_class in self.get_subclasses(base_class)
+                   if key[1].issubset(self._field_names[model_class])]
+        if matches:
+            # Signatures without a match are usually bad input, so they are
+            # not kept
+            self._matches[key] = matches
+        return matches
+
+
+_subclass_registry = None
+# The list from django.apps.apps.get_models that the registry was built
+# from. Django replaces it when a model is registered, e.g. by tests.
+_registered_models = None
+
+def get_subclass_registry():
+    """Returns the registry of the models registered so far. It is normally
+    built once, when the app registry is ready.
+    """
+    global _subclass_registry, _registered_models
+    registered_models = django.apps.apps.get_models()
+    if registered_models is not _registered_models:
+        from .models import _BaseModel
+        _subclass_registry = SubclassRegistry(
+            [model for model in registered_models if issubclass(model, _BaseModel)])
+        _registered_models = registered_models
+    return _subclass_registry
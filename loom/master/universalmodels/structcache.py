@@ -0,0 +1,152 @@
+"""A cache of rendered ImmutableModels, whose structs depend only on _id."""
+
+from collections import OrderedDict
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+DEFAULT_MAX_ENTRIES = 10000
+STRUCT = 'struct'
+CANONICAL_JSON = 'canonical_json'
+
+
+class StructCache(object):
+    """A process-local LRU of max_entries, also shared through the Django cache
+    named by backend_alias, if any, e.g. between server processes. Structs are
+    stored as JSON and a new copy is returned on every hit, so callers are free
+    to modify them.
+    """
+
+    def __init__(self, max_entries, backend_alias=None):
+        self.max_entries = max_entries
+        self.backend_alias = backend_alias
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.evictions = 0
+        self.counts = dict((kind, {'hits': 0, 'backend_hits': 0, 'misses': 0})
+                           for kind in [STRUCT, CANONICAL_JSON])
+
+    def _get_backend(self):
+        if self.backend_alias is None:
+            return None
+        # caches holds a connection per thread
+        return caches[self.backend_alias]
+
+    def _get_backend_key(self, kind, _id):
+        return 'universalmodels.%s.%s' % (kind, _id)
+
+    def _get(self, kind, _id):
+        key = (kind, _id)
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+                self.counts[kind]['hits'] += 1
+                return value
+        backend = self._get_backend()
+        if backend is not None:
+            value = backend.get(self._get_backend_key(kind, _id))
+            if value is not None:
+                with self.lock:
+                    self.counts[kind]['backend_hits'] += 1
+                self._set_local(key, value)
+                return value
+        with self.lock:
+            self.counts[kind]['misses'] += 1
+        return None
+
+    def _set(self, kind, _id, value):
+        self._set_local((kind, _id), value)
+        backend = self._get_backend()
+        if backend is not None:
+            # Entries never go stale, so they are kept as long as the
+            # backend allows
+            backend.set(self._get_backend_key(kind, _id), value, None)
+
+    def _set_local(self, key, value):
+        if self.max_entries < 1:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_struct(self, _id):
+        struct_json = self._get(STRUCT, _id)
+        if struct_json is None:
+            return None
+        return json.loads(struct_json)
+
+    def get_canonical_json(self, _id):
+        return self._get(CANONICAL_JSON, _id)
+
+    def set(self, _id, struct=None, canonical_json=None):
+        if struct is not None:
+            self._set(STRUCT, _id, json.dumps(struct, separators=(',', ':')))
+        if canonical_json is not None:
+            self._set(CANONICAL_JSON, _id, canonical_json)
+
+    def get_fragments(self, struct):
+        """Returns {id(child struct): canonical JSON} for the children in
+        struct whose canonical JSON is cached, for use with
+        helpers.CanonicalJson.
+        """
+        fragments = {}
+        for value in struct.values():
+            children = value if isinstance(value, list) else [value]
+            for child in children:
+                if isinstance(child, dict) and child.get('_id') is not None:
+                    canonical_json = self.get_canonical_json(child['_id'])
+                    if canonical_json is not None:
+                        fragments[id(child)] = canonical_json
+        return fragments
+
+    def get_stats(self):
+        with self.lock:
+            stats = {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'evictions': self.evictions,
+                'backend': self.backend_alias,
+            }
+            for (kind, counts) in self.counts.iteritems():
+                kind_stats = dict(counts)
+                lookups = sum(counts.values())
+                if lookups:
+                    kind_stats['hit_rate'] = \
+                        float(counts['hits'] + counts['backend_hits']) / lookups
+                else:
+                    kind_stats['hit_rate'] = None
+                stats[kind] = kind_stats
+        return stats
+
+    def clear(self):
+        """Empty the local cache and reset counters. Entries in a shared
+        backend are left, since other processes use them.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.evictions = 0
+            for counts in self.counts.values():
+                for name in counts:
+                    counts[name] = 0
+
+
+_struct_cache = None
+
+def get_struct_cache():
+    """Returns the StructCache for the current settings"""
+    global _struct_cache
+    max_entries = getattr(settings, 'UNIVERSALMODELS_STRUCT_CACHE_SIZE', DEFAULT_MAX_ENTRIES)
+    backend_alias = getattr(settings, 'UNIVERSALMODELS_STRUCT_CACHE_BACKEND', None)
+    struct_cache = _struct_cache
+    if struct_cache is None or \
+       (struct_cache.max_entries, struct_cache.backend_alias) != (max_entries, backend_alias):
+        struct_cache = StructCache(max_entries, backend_alias)
+        _struct_cache = struct_cache
+    return struct_cache
@@ -1,6 +1,11 @@
 from django.test import TestCase
+from django.utils import timezone
+import copy
+import datetime
+import hashlib
 import uuid
-from universalmodels.helpers import NonserializableTypeConverter
+from universalmodels.helpers import CanonicalJson, IdCalculator, \
+    NonserializableTypeConverter, StripBlanks, StripKey, struct_to_json
 
 class TestNonserializableTypeConverter(TestCase):
 
@@ -22,3 +27,43 @@ class TestNonserializableTypeConverter(TestCase):
         converted_d = NonserializableTypeConverter.convert_struct(d)
         self.assertEqual(str(d['id']), converted_d['id'])
         self.assertEqual(d['name'], converted_d['name'])
+
+
+class TestCanonicalJson(TestCase):
+
+    struct = {
+        '_id': 'x',
+        'name': u'n\xe4me',
+        'blank_string': '',
+        'none': None,
+        'empty_list': [],
+        'empty_dict': {},
+        'time': datetime.datetime(2016, 1, 1, tzinfo=timezone.utc),
+        'uuid': uuid.UUID('ab7e1d9ea6394e4f84c7eb6a54e9c5e5'),
+        'children': [
+            {'_id': 'y', 'b': 1, 'a': [None, 2.5, True]},
+            {'_id': 'z', 'json': {'_id': 'w', 'blank': '', 'keep': False}},
+        ],
+    }
+
+    def testMatchesStripAndSerialize(self):
+        stripped = StripBlanks.strip_blanks(
+            StripKey.strip_key(copy.deepcopy(self.struct), '_id'))
+        self.assertEqual(CanonicalJson('_id').render(self.struct),
+                         struct_to_json(stripped))
+
+    def testIdCalculatorHashesCanonicalJson(self):
+        self.assertEqual(
+            IdCalculator(data_struct=self.struct, id_key='_id').get_id(),
+            hashlib.sha256(CanonicalJson('_id').render(self.struct)).hexdigest())
+
+    def testDoesNotModifyStruct(self):
+        struct = copy.deepcopy(self.struct)
+        CanonicalJson('_id').render(struct)
+        self.assertEqual(struct, self.struct)
+
+    def testFragmentIsReused(self):
+        child = self.struct['children'][0]
+        fragments = {id(child): '"child"'}
+        rendered = CanonicalJson('_id', fragments).render(self.struct)
+        self.assertIn('"children":["child",', rendered)
@@ -1,4 +1,5 @@
 from django.test import TestCase
+from django.test import override_settings
 from django.db import models
 from django.core.exceptions import ValidationError 
 import datetime
@@ -9,6 +10,9 @@ import hashlib
 from universalmodels.models import *
 from universalmodels.test.models import *
 from universalmodels import helpers
+from universalmodels import plans
+from universalmodels import structcache
+from universalmodels import verification
 from django.core.exceptions import FieldDoesNotExist
 
 
@@ -478,6 +482,57 @@ class TestInstanceModelUpdate(TestCase):
         with self.assertRaises(InvalidInputTypeError):
             model.update('{"manytomanychildren": "invalid"}')
 
+    # Update method - partial updates
+
+    def _create_parent(self, n):
+        return SampleInstanceModelParent.create({
+            'name': 'parent',
+            'onetomanychildren': [{'name': 'child%s' % i} for i in range(n)],
+            'manytomanychildren': [{'name': 'child%s' % i} for i in range(n)],
+        })
+
+    def testUpdateQueryCountDoesNotGrowWithChildren(self):
+        small = self._create_parent(2)
+        large = self._create_parent(20)
+        # Savepoint, UPDATE of the changed columns, release
+        with self.assertNumQueries(3):
+            small.update({'name': 'small'})
+        with self.assertNumQueries(3):
+            large.update({'name': 'large'})
+        self.assertEqual(SampleInstanceModelParent.objects.get(_id=large._id).name, 'large')
+        self.assertEqual(large.manytomanychildren.count(), 20)
+
+    def _get_through_ids(self, model):
+        through = SampleInstanceModelParent.manytomanychildren.through
+        return list(through.objects.filter(sampleinstancemodelparent=model)
+                    .order_by('sort_value').values_list('id', flat=True))
+
+    def testUpdateManyToManyAppendKeepsExistingRelations(self):
+        model = self._create_parent(2)
+        children = model.to_struct()['manytomanychildren']
+        through_ids = self._get_through_ids(model)
+        model.update({'manytomanychildren': children + [{'name': 'child2'}]})
+        self.assertEqual([child.name for child in model.manytomanychildren.all()],
+                         ['child0', 'child1', 'child2'])
+        self.assertEqual(self._get_through_ids(model)[:2], through_ids)
+
+    def testUpdateManyToManyRemoveKeepsOthers(self):
+        model = self._create_parent(3)
+        children = model.to_struct()['manytomanychildren']
+        through_ids = self._get_through_ids(model)
+        model.update({'manytomanychildren': [children[0], children[2]]})
+        self.assertEqual([child.name for child in model.manytomanychildren.all()],
+                         ['child0', 'child2'])
+        self.assertEqual(self._get_through_ids(model),
+                         [through_ids[0], through_ids[2]])
+
+    def testUpdateManyToManyNewOrder(self):
+        model = self._create_parent(3)
+        children = model.to_struct()['manytomanychildren']
+        model.update({'manytomanychildren': list(reversed(children))})
+        self.assertEqual([child.name for child in model.manytomanychildren.all()],
+                         ['child2', 'child1', 'child0'])
+
     # Update method - One to One (ForeignKey)
 
     def testUpdateForeignKeyDictInput(self):
@@ -647,5 +702,328 @@ class TestTimeStamps(TestCase):
         self.assertTrue(time2 < model.datetime_updated)
         self.assertTrue(time3 > model.datetime_updated)
 
-        self.assertTrue(time1.isoformat() < model.datetime_created)
-        self.assertTrue(time2.isoformat() > model.datetime_created)
+        # Fields not in the update are left as they are
+        self.assertTrue(time1 < model.datetime_created)
+        self.assertTrue(time2 > model.datetime_created)
+
+
+class TestSerializationPlan(TestCase):
+
+    def testFieldKinds(self):
+        plan = SampleInstanceModelParent._get_plan()
+        self.assertEqual(plan.get_field_plan('name').kind, plans.NONRELATION)
+        self.assertEqual(plan.get_field_plan('onetoonechild').kind, plans.X_TO_ONE)
+        self.assertEqual(plan.get_field_plan('foreignkeychild').kind, plans.X_TO_ONE)
+        self.assertEqual(plan.get_field_plan('onetomanychildren').kind, plans.X_TO_MANY)
+        self.assertEqual(plan.get_field_plan('manytomanychildren').kind, plans.X_TO_MANY)
+
+    def testParentFieldsAreNotRendered(self):
+        plan = SampleInstanceModelChild._get_plan()
+        self.assertTrue(plan.get_field_plan('parent').is_parent)
+        self.assertNotIn('parent', [f.name for f in plan.struct_fields])
+
+    def testBaseClassPointerIsNotRendered(self):
+        plan = Daughter1._get_plan()
+        struct_fields = [f.name for f in plan.struct_fields]
+        self.assertIn('daughter1_name', struct_fields)
+        self.assertNotIn('multitablebasechild_ptr', struct_fields)
+
+    def testSelectingFieldsDoesNotLoadRelations(self):
+        parent = SampleInstanceModelParent.create({
+            'name': 'parent',
+            'onetoonechild': {'name': 'onlychild'},
+            'foreignkeychild': {'name': 'foreignkeychild'}
+        })
+        reloaded_parent = SampleInstanceModelParent.objects.get(_id=parent._id)
+        with self.assertNumQueries(0):
+            reloaded_parent._get_nonparent_nonbase_fields()
+
+    def testSubclassRegistry(self):
+        registry = plans.get_subclass_registry()
+        self.assertEqual(registry.get_subclasses(AbstractBaseChild), [Son1, Son2])
+        self.assertEqual(registry.get_subclasses(MultiTableBaseChild),
+                         [MultiTableBaseChild, Daughter1, Daughter2])
+        self.assertEqual(registry.get_matching_models(AbstractBaseChild, ['name']),
+                         [Son1, Son2])
+        self.assertEqual(registry.get_matching_models(
+            MultiTableBaseChild, ['daughter2_name']), [Daughter2])
+        self.assertEqual(registry.get_matching_models(AbstractBaseChild, ['unknown']), [])
+
+    def testSubclassSelectedBySignature(self):
+        self.assertIs(AbstractBaseChild._select_best_subclass_model_by_fields(
+            {'name': 'x', 'son2detail': 'y'}), Son2)
+        with self.assertRaises(CouldNotFindUniqueSubclassError):
+            AbstractBaseChild._select_best_subclass_model_by_fields({'name': 'x'})
+        with self.assertRaises(CouldNotFindSubclassError):
+            AbstractBaseChild._select_best_subclass_model_by_fields({'unknown': 'x'})
+
+
+class TestGraphSerializer(TestCase):
+
+    def _create_instance_parent(self, n):
+        return SampleInstanceModelParent.create({
+            'name': 'parent',
+            'onetoonechild': {'name': 'onlychild'},
+            'foreignkeychild': {'name': 'foreignkeychild'},
+            'onetomanychildren': [{'name': 'child%s' % i} for i in range(n)],
+            'manytomanychildren': [{'name': 'child%s' % i} for i in range(n)],
+        })
+
+    def testInstanceModelMatchesToStruct(self):
+        parent = self._create_instance_parent(3)
+        self.assertEqual(SampleInstanceModelParent.to_structs([parent]),
+                         [parent.to_struct()])
+
+    def testImmutableModelMatchesToStruct(self):
+        parent = SampleImmutableParent.create({
+            'name': 'parent',
+            'foreignkeychild': {'name': 'foreignkeychild'},
+            'manytomanychildren': [{'name': 'child%s' % i} for i in range(3)],
+        })
+        self.assertEqual(SampleImmutableParent.to_structs([parent]),
+                         [parent.to_struct()])
+
+    def testManyToManyOrderIsPreserved(self):
+        names = ['c', 'a', 'b']
+        parent = SampleInstanceModelParent.create({
+            'name': 'parent',
+            'manytomanychildren': [{'name': name} for name in names],
+        })
+        struct = SampleInstanceModelParent.to_structs([parent])[0]
+        self.assertEqual([child['name'] for child
+                          in struct['manytomanychildren']], names)
+
+    def testMultiTableChildIsDowncast(self):
+        parent1 = ParentOfMultiTable.create({
+            'name': 'parent1', 'child': {'daughter1_name': 'one'}})
+        parent2 = ParentOfMultiTable.create({
+            'name': 'parent2', 'child': {'daughter2_name': 'two'}})
+        structs = ParentOfMultiTable.to_structs(
+            ParentOfMultiTable.objects.filter(_id__in=[parent1._id, parent2._id])
+            .order_by('name'))
+        self.assertEqual(structs, [parent1.to_struct(), parent2.to_struct()])
+
+    def testQueryCountDoesNotGrowWithChildren(self):
+        small = self._create_instance_parent(2)
+        large = self._create_instance_parent(20)
+        small = SampleInstanceModelParent.objects.get(_id=small._id)
+        large = SampleInstanceModelParent.objects.get(_id=large._id)
+        with self.assertNumQueries(6):
+            SampleInstanceModelParent.to_structs([small])
+        with self.assertNumQueries(6):
+            SampleInstanceModelParent.to_structs([large])
+        with self.assertNumQueries(6):
+            SampleInstanceModelParent.to_structs([small, large])
+
+    def testFieldsLimitRenderedFields(self):
+        parent = self._create_instance_parent(2)
+        struct = SampleInstanceModelParent.to_structs(
+            [parent], fields=['name', 'onetomanychildren.name', 'foreignkeychild'])[0]
+        self.assertEqual(struct, {
+            'name': 'parent',
+            'onetomanychildren': [{'name': 'child0'}, {'name': 'child1'}],
+            'foreignkeychild': parent.to_struct()['foreignkeychild'],
+        })
+
+    def testFieldsSkipUnrequestedRelations(self):
+        parent = self._create_instance_parent(2)
+        parent = SampleInstanceModelParent.objects.get(_id=parent._id)
+        # Only the m2m rows and the children they point to are loaded
+        with self.assertNumQueries(2):
+            SampleInstanceModelParent.to_structs(
+                [parent], fields=['_id', 'manytomanychildren.name'])
+
+
+class TestImmutableModelIds(TestCase):
+
+    struct = {
+        'name': 'parent',
+        'foreignkeychild': {'name': 'foreignkeychild'},
+        'manytomanychildren': [{'name': 'child%s' % i} for i in range(3)],
+    }
+
+    def setUp(self):
+        # These tests corrupt models, which must then be read from the
+        # database
+        structcache.get_struct_cache().clear()
+        self.addCleanup(structcache.get_struct_cache().clear)
+
+    def testIdMatchesHashOfInput(self):
+        parent = SampleImmutableParent.create(self.struct)
+        self.assertEqual(parent._id,
+                         ImmutableModel._calculate_unique_id(self.struct))
+        child = parent.manytomanychildren.first()
+        self.assertEqual(child._id,
+                         ImmutableModel._calculate_unique_id({'name': 'child0'}))
+
+    def testChildGivenById(self):
+        child = SampleImmutableChild3.create({'name': 'child'})
+        struct = {'name': 'parent',
+                  'manytomanychildren': [child.to_struct()]}
+        parent = SampleImmutableParent.create(struct)
+        self.assertEqual(parent._id, ImmutableModel._calculate_unique_id(struct))
+
+    def testNegInputIdMismatch(self):
+        struct = dict(self.struct, _id='wrong')
+        with self.assertRaises(UniqueIdMismatchError):
+            SampleImmutableParent.create(struct)
+
+    def _create_corrupted_parent(self):
+        parent = SampleImmutableParent.create(self.struct)
+        SampleImmutableParent.objects.filter(_id=parent._id).update(
+            name='corrupted')
+        return SampleImmutableParent.objects.get(_id=parent._id)
+
+    @override_settings(UNIVERSALMODELS_ID_VERIFICATION_RATE=1.0)
+    def testVerifiedOnRead(self):
+        parent = self._create_corrupted_parent()
+        with self.assertRaises(UniqueIdMismatchError):
+            parent.to_struct()
+        with self.assertRaises(UniqueIdMismatchError):
+            SampleImmutableParent.to_structs([parent])
+
+    @override_settings(UNIVERSALMODELS_ID_VERIFICATION_RATE=0.0)
+    def testTrustedOnRead(self):
+        parent = self._create_corrupted_parent()
+        self.assertEqual(parent.to_struct()['name'], 'corrupted')
+        self.assertEqual(SampleImmutableParent.to_structs([parent]),
+                         [parent.to_struct()])
+
+    def testFindIdMismatches(self):
+        parent = self._create_corrupted_parent()
+        mismatches = verification.find_id_mismatches([SampleImmutableParent])
+        self.assertEqual([m['_id'] for m in mismatches], [parent._id])
+
+    def testFindIdMismatchesInPages(self):
+        parent = self._create_corrupted_parent()
+        SampleImmutableParent.create(dict(self.struct, name='other'))
+        mismatches = []
+        (page, cursor) = verification.find_id_mismatches_in_page(SampleImmutableParent, 1)
+        mismatches.extend(page)
+        self.assertIsNotNone(cursor)
+        (page, cursor) = verification.find_id_mismatches_in_page(
+            SampleImmutableParent, 1, cursor=cursor)
+        mismatches.extend(page)
+        self.assertIsNone(cursor)
+        self.assertEqual([m['_id'] for m in mismatches], [parent._id])
+
+
+class TestStructCache(TestCase):
+
+    struct = {
+        'name': 'parent',
+        'foreignkeychild': {'name': 'foreignkeychild'},
+        'manytomanychildren': [{'name': 'child%s' % i} for i in range(3)],
+    }
+
+    def setUp(self):
+        structcache.get_struct_cache().clear()
+        self.addCleanup(structcache.get_struct_cache().clear)
+
+    def _create_parent(self):
+        parent = SampleImmutableParent.create(self.struct)
+        return SampleImmutableParent.objects.get(_id=parent._id)
+
+    def testGraphSerializerSkipsCachedModels(self):
+        parent = self._create_parent()
+        structs = SampleImmutableParent.to_structs([parent])
+        with self.assertNumQueries(0):
+            self.assertEqual(SampleImmutableParent.to_structs([parent]), structs)
+        stats = structcache.get_struct_cache().get_stats()
+        self.assertEqual(stats['struct']['hits'], 1)
+
+    def testToStructReturnsCopies(self):
+        parent = self._create_parent()
+        struct = parent.to_struct()
+        struct['manytomanychildren'].pop()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(parent.to_struct()['manytomanychildren']), 3)
+
+    def testChildrenAreCached(self):
+        parent = self._create_parent()
+        parent.to_struct()
+        child = parent.manytomanychildren.first()
+        with self.assertNumQueries(0):
+            self.assertEqual(child.to_struct()['name'], child.name)
+
+    @override_settings(UNIVERSALMODELS_ID_VERIFICATION_RATE=1.0)
+    def testVerificationUsesCanonicalJsonOfChildren(self):
+        parent = self._create_parent()
+        parent.to_struct()
+        stats = structcache.get_struct_cache().get_stats()
+        # Cached when the children were created
+        self.assertEqual(stats['canonical_json']['hits'], 4)
+        self.assertEqual(stats['struct']['hits'], 0)
+
+    @override_settings(UNIVERSALMODELS_STRUCT_CACHE_BACKEND='default')
+    def testSharedBackend(self):
+        parent = self._create_parent()
+        struct = parent.to_struct()
+        # As in another process, which has only the shared entries
+        structcache.get_struct_cache().clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(parent.to_struct(), struct)
+        self.assertEqual(structcache.get_struct_cache().get_stats()['struct']['backend_hits'], 1)
+
+    def testLeastRecentlyUsedAreEvicted(self):
+        cache = structcache.StructCache(2)
+        cache.set('a', {'name': 'a'})
+        cache.set('b', {'name': 'b'})
+        cache.get_struct('a')
+        cache.set('c', {'name': 'c'})
+        self.assertIsNone(cache.get_struct('b'))
+        self.assertEqual(cache.get_struct('a'), {'name': 'a'})
+        stats = cache.get_stats()
+        self.assertEqual((stats['entries'], stats['evictions']), (2, 1))
+        self.assertEqual(stats['struct']['hit_rate'], 2.0/3)
+
+
+class TestCreateMany(TestCase):
+
+    def testImmutableModelsAreDeduplicated(self):
+        existing = SampleImmutableChild3.create({'name': 'existing'})
+        structs = [{'name': 'new'}, {'name': 'existing'}, {'name': 'new'}]
+        models = SampleImmutableChild3.create_many(structs)
+        self.assertEqual([model.name for model in models],
+                         ['new', 'existing', 'new'])
+        self.assertEqual(models[1]._id, existing._id)
+        self.assertEqual(models[0]._id, models[2]._id)
+        self.assertEqual(SampleImmutableChild3.objects.count(), 2)
+
+    def testFlatModelsUseBulkCreate(self):
+        structs = [{'name': 'child%s' % i} for i in range(20)]
+        # Look up existing ids, insert, fetch the result, plus a savepoint
+        # and its release for the transaction
+        with self.assertNumQueries(5):
+            models = SampleImmutableChild3.create_many(structs)
+        self.assertEqual([model._id for model in models],
+                         [SampleImmutableChild3.create(struct)._id
+                          for struct in structs])
+
+    def testNestedImmutableModels(self):
+        structs = [{'name': 'parent%s' % i,
+                    'manytomanychildren': [{'name': 'child'}]}
+                   for i in range(3)]
+        models = SampleImmutableParent.create_many(structs)
+        self.assertEqual([model.to_struct() for model in models],
+                         [SampleImmutableParent.create(struct).to_struct()
+                          for struct in structs])
+
+    def testMultiTableModelsAreDowncast(self):
+        models = MultiTableBaseChild.create_many(
+            [{'daughter1_name': 'one'}, {'daughter2_name': 'two'}])
+        self.assertEqual([model.__class__ for model in models],
+                         [Daughter1, Daughter2])
+
+    def testInstanceModels(self):
+        models = SampleInstanceModelChild.create_many(
+            [{'name': 'one'}, {'name': 'one'}])
+        self.assertEqual(len(set([model._id for model in models])), 2)
+
+    def testNegInputIdMismatch(self):
+        with self.assertRaises(UniqueIdMismatchError):
+            SampleImmutableChild3.create_many([{'name': 'x', '_id': 'wrong'}])
+
+    def testNegNotAList(self):
+        with self.assertRaises(InvalidInputTypeError):
+            SampleImmutableChild3.create_many({'name': 'x'})
@@ -0,0 +1,64 @@
+"""A full integrity scan of ImmutableModel ids, which reads normally trust. See
+UNIVERSALMODELS_ID_VERIFICATION_RATE.
+"""
+
+import django.apps
+
+from . import graph
+from . import pagination
+from .exceptions import *
+from .models import ImmutableModel
+
+
+def get_root_immutable_model_classes():
+    """Concrete ImmutableModel classes that do not inherit from another
+    table. Subclass instances are checked through their base class, after
+    downcasting, so each model is checked once.
+    """
+    return [Model for Model in django.apps.apps.get_models()
+            if issubclass(Model, ImmutableModel) and not Model._meta.parents]
+
+def get_model_class(label):
+    """Returns the class from get_root_immutable_model_classes with the
+    given concrete type label, e.g. "analysis.dataobject".
+    """
+    for Model in get_root_immutable_model_classes():
+        if Model._get_concrete_type_label() == label:
+            return Model
+    raise InvalidInputError('No immutable model "%s" to verify' % label)
+
+def find_id_mismatches(model_classes=None, batch_size=graph.MAX_QUERY_PARAMETERS):
+    """Returns a list of {'model', '_id', 'calculated_id'} for every
+    stored model whose _id does not match its contents.
+    """
+    if model_classes is None:
+        model_classes = get_root_immutable_model_classes()
+    mismatches = []
+    for Model in model_classes:
+        cursor = None
+        while True:
+            (page_mismatches, cursor) = find_id_mismatches_in_page(
+                Model, batch_size, cursor=cursor)
+            mismatches.extend(page_mismatches)
+            if cursor is None:
+                break
+    return mismatches
+
+def find_id_mismatches_in_page(Model, limit, cursor=None):
+    """Checks one page of the models of Model, in the order of
+    pagination.get_page. Returns (mismatches, next_cursor).
+    """
+    (models, next_cursor) = pagination.get_page(Model.objects.all(), limit, cursor=cursor)
+    models = graph.downcast_models(models)
+    structs = graph.GraphSerializer(
+        models, verify_ids=False, use_cache=False).serialize()
+    mismatches = []
+    for (model, struct) in zip(models, structs):
+        calculated_id = model._calculate_id_from_struct(struct)
+        if calculated_id != model._id:
+            mismatches.append({
+                'model': model._get_concrete_type_label(),
+                '_id': model._id,
+                'calculated_id': calculated_id,
+            })
+    return (mismatches, next_cursor)
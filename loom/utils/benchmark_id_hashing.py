@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""Compare the time to calculate ImmutableModel ids with the single-pass
+IdCalculator against the previous copy, strip and serialize pipeline.
+Both must produce the same hash.
+
+Usage: python benchmark_id_hashing.py [--sizes 10 1000 100000] [--repeat 3]
+"""
+
+import argparse
+import copy
+import hashlib
+import os
+import sys
+import time
+
+if __name__ == "__main__" and __package__ is None:
+    rootdir=os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+    sys.path.append(rootdir)
+    sys.path.append(os.path.join(rootdir, 'loom', 'master'))
+
+from loom.common import fixtures
+from universalmodels import helpers
+
+
+def legacy_id(data_struct, id_key='_id'):
+    data_struct = copy.deepcopy(data_struct)
+    data_struct = helpers.StripKey.strip_key(data_struct, id_key)
+    data_struct = helpers.StripBlanks.strip_blanks(data_struct)
+    return hashlib.sha256(helpers.struct_to_json(data_struct)).hexdigest()
+
+def single_pass_id(data_struct, id_key='_id'):
+    return helpers.IdCalculator(data_struct=data_struct, id_key=id_key).get_id()
+
+def with_ids_and_blanks(struct, i):
+    # Stored structs carry ids and may have blank fields, both of which
+    # are stripped before hashing
+    struct = copy.deepcopy(struct)
+    struct['_id'] = '%064x' % i
+    struct['unused'] = None
+    return struct
+
+def workflow_struct(size):
+    steps = []
+    for i in range(size):
+        step = with_ids_and_blanks(fixtures.step_1_struct, i)
+        step['step_name'] = 'step%s' % i
+        steps.append(step)
+    workflow = copy.deepcopy(fixtures.workflow_struct)
+    workflow['steps'] = steps
+    return workflow
+
+def data_object_array_struct(size):
+    data_objects = []
+    for i in range(size):
+        file = with_ids_and_blanks(fixtures.file_struct, i)
+        file['file_name'] = 'file%s.txt' % i
+        data_objects.append(file)
+    return {'data_objects': data_objects}
+
+def time_function(function, struct, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = function(struct)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (result, best)
+
+def main():
+    parser = argparse.ArgumentParser(__file__)
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[10, 1000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print '%-18s %8s %12s %12s %8s' % (
+        'struct', 'size', 'legacy (s)', 'new (s)', 'speedup')
+    for (name, make_struct) in [('Workflow', workflow_struct),
+                                ('DataObjectArray', data_object_array_struct)]:
+        for size in args.sizes:
+            struct = make_struct(size)
+            (legacy_hash, legacy_time) = time_function(
+                legacy_id, struct, args.repeat)
+            (new_hash, new_time) = time_function(
+                single_pass_id, struct, args.repeat)
+            if legacy_hash != new_hash:
+                raise Exception('Hash mismatch for %s of size %s: %s != %s'
+                                % (name, size, legacy_hash, new_hash))
+            print '%-18s %8s %12.6f %12.6f %7.1fx' % (
+                name, size, legacy_time, new_time,
+                legacy_time / max(new_time, 1e-9))
+
+
+if __name__=='__main__':
+    main()
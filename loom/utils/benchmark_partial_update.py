@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""Compare the time and number of queries to change the status of a TaskRun
+with the partial update against the previous update, which rendered the
+whole TaskRun, merged the change and wrote every field and relation again.
+Runs against a temporary test database. Query counts are capped at 9000,
+the length of Django's query log.
+
+Usage: python benchmark_partial_update.py [--sizes 1 10 100 1000] [--repeat 5]
+"""
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+if __name__ == "__main__" and __package__ is None:
+    rootdir=os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+    sys.path.append(rootdir)
+    sys.path.append(os.path.join(rootdir, 'loom', 'master'))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'loomserver.settings')
+
+import django
+django.setup()
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from analysis.models import TaskRun
+from loom.common import fixtures
+
+
+def legacy_update(model, update_struct):
+    model_struct = model.to_struct()
+    model_struct.update(update_struct)
+    with transaction.atomic():
+        model._create_or_update_fields(model_struct)
+        model.validate_model()
+
+def partial_update(model, update_struct):
+    model.update(update_struct)
+
+def task_run_struct(size):
+    struct = copy.deepcopy(fixtures.task_run_struct)
+    struct['task_run_inputs'] = [copy.deepcopy(fixtures.task_run_input)
+                                 for i in range(size)]
+    struct['task_run_outputs'] = [copy.deepcopy(fixtures.task_run_output)
+                                  for i in range(size)]
+    return struct
+
+def time_status_changes(function, task_run, repeat):
+    """Returns (best seconds, queries) for one status change"""
+    best = None
+    for i in range(repeat):
+        status = 'running' if i % 2 == 0 else 'ready_to_run'
+        # The query log is bounded, so start each count with it empty
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            function(task_run, {'status': status})
+            elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, len(queries))
+
+def main():
+    parser = argparse.ArgumentParser(__file__)
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[1, 10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    test_database = connection.creation.create_test_db(verbosity=0)
+    try:
+        print '%8s %12s %9s %12s %9s %8s' % (
+            'size', 'legacy (s)', 'queries', 'new (s)', 'queries', 'speedup')
+        for size in args.sizes:
+            task_run = TaskRun.create(task_run_struct(size))
+            (legacy_time, legacy_queries) = time_status_changes(
+                legacy_update, task_run, args.repeat)
+            (new_time, new_queries) = time_status_changes(
+                partial_update, task_run, args.repeat)
+            print '%8s %12.6f %9s %12.6f %9s %7.1fx' % (
+                size, legacy_time, legacy_queries, new_time, new_queries,
+                legacy_time / max(new_time, 1e-9))
+    finally:
+        connection.creation.destroy_test_db(test_database, verbosity=0)
+
+
+if __name__=='__main__':
+    main()
@@ -102,7 +102,7 @@ class _FilePortOutputManager(_AbstractPortOutputManager):
         result_info = self._get_result_info(file_object)
         self._save_result(result_info)
 
-        filehandler_obj = filehandler.FileHandler(self.settings['MASTER_URL'])
+        filehandler_obj = filehandler.FileHandler(self.settings['MASTER_URL'], use_hash_cache=False)
         location = filehandler_obj.get_step_output_location(file_path, file_object=file_object)
         self.logger.debug('Uploading output %s to %s' % (file_path, location))
         filehandler_obj.upload(file_path, location)
@@ -130,7 +130,7 @@ class _FileArrayPortOutputManager(_AbstractPortOutputManager):
         result_info = self._get_result_info(file_array)
         self._save_result(result_info)
 
-        filehandler_obj = filehandler.FileHandler(self.settings['MASTER_URL'])
+        filehandler_obj = filehandler.FileHandler(self.settings['MASTER_URL'], use_hash_cache=False)
         locations = get_locations(file_array, file_paths, filehandler_obj)
         
         for location in locations:
@@ -201,7 +201,7 @@ class OutputManager:
         self._upload_logfiles()
 
     def _upload_logfiles(self):
-        filehandler_obj = filehandler.FileHandler(self.settings['MASTER_URL'])
+        filehandler_obj = filehandler.FileHandler(self.settings['MASTER_URL'], use_hash_cache=False)
         location = filehandler_obj.get_step_output_location(self.settings['STEP_LOGFILE'])
         filehandler_obj.upload(self.settings['STEP_LOGFILE'], location)
         location = filehandler_obj.get_step_output_location(self.settings['STDOUT_LOGFILE'])
@@ -6,17 +6,38 @@ import errno
 import string
 import logging
 import os
-import requests
 import subprocess
+import threading
 import time
 import uuid
 
+from loom.common.exceptions import TaskRunStoppedError
 from loom.common.filehandler import FileHandler
+from loom.common.nodecache import NodeCache
 from loom.common.objecthandler import ObjectHandler
 
+class RunIdFilter(logging.Filter):
+    """Passes only records logged for one TaskRun."""
+
+    def __init__(self, run_id):
+        logging.Filter.__init__(self)
+        self.run_id = run_id
+
+    def filter(self, record):
+        return getattr(record, 'run_id', None) == self.run_id
+
+
 class TaskRunner(object):
 
-    def __init__(self, args=None):
+    # Where inputs that are not copied into the working dir are mounted
+    INPUT_MOUNT_DIR = '/loom_inputs'
+
+    def __init__(self, args=None, workerinfo=None, task_run=None,
+                 filehandler=None, objecthandler=None):
+        """A WorkerAgent runs many TaskRuns in one process, so it passes in
+        the workerinfo, TaskRun, and handlers it already has instead of
+        having each TaskRunner fetch them again.
+        """
         if args is None:
             args = self._get_args()
         self.settings = {
@@ -24,55 +45,126 @@ class TaskRunner(object):
             'RUN_LOCATION_ID': args.run_location_id,
             'MASTER_URL': args.master_url
         }
-        self.settings.update(self._get_additional_settings())
+        if workerinfo is None:
+            workerinfo = self.get_workerinfo(self.settings['MASTER_URL'])
+        self.settings.update(self._get_additional_settings(workerinfo))
         self._init_logger()
-        self._init_filehandler()
-        self._init_objecthandler()
-        self._init_task_run()
-        
+        if filehandler is None:
+            self._init_filehandler()
+        else:
+            self.filehandler = filehandler
+        if objecthandler is None:
+            self._init_objecthandler()
+        else:
+            self.objecthandler = objecthandler
+        if task_run is None:
+            self._init_task_run()
+        else:
+            self.task_run = task_run
+        self.input_mounts = []
+        # stop() may be called from another thread
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.process = None
+        self.container_name = 'loom-%s' % os.path.basename(self.settings['WORKING_DIR'])
+
     def run(self):
         self._prepare_working_directory(self.settings['WORKING_DIR'])
         self._add_logfiles()
 
-        self._download_inputs()
-        
-        with open(self.settings['STDOUT_LOGFILE'], 'w') as stdoutlog:
-            with open(self.settings['STDERR_LOGFILE'], 'w') as stderrlog:
-                process = self._execute(stdoutlog, stderrlog)
-                self._wait_for_process(process)
+        try:
+            self._download_inputs()
+
+            with open(self.settings['STDOUT_LOGFILE'], 'w') as stdoutlog:
+                with open(self.settings['STDERR_LOGFILE'], 'w') as stderrlog:
+                    process = self._execute(stdoutlog, stderrlog)
+                    self._wait_for_process(process)
 
-        self._upload_outputs()
+            self._raise_if_stopped()
+            self._upload_outputs()
+        finally:
+            self._release_cached_inputs()
 
         # self._flag_run_as_complete(self.step_run)
         print "done"
 
+    def stop(self):
+        """Stop working on the TaskRun, e.g. because its lease was lost.
+        The container is killed if it is running, and run raises
+        TaskRunStoppedError instead of uploading outputs.
+        """
+        with self.lock:
+            self.stopped = True
+            process = self.process
+        if process is not None and process.poll() is None:
+            self.logger.info('Killing container %s' % self.container_name)
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call(['docker', 'kill', self.container_name],
+                                stdout=devnull, stderr=devnull)
+
+    def _raise_if_stopped(self):
+        if self.stopped:
+            raise TaskRunStoppedError('TaskRun %s was stopped' % self.settings['RUN_ID'])
+
     def _download_inputs(self):
         if self.task_run.get('task_run_inputs') is None:
             return
         data_object_ids = ['@'+task_run_input['task_definition_input']['data_object']['_id']
                             for task_run_input in self.task_run['task_run_inputs']]
-        self.filehandler.download_files(data_object_ids, target_directory=self.settings['WORKING_DIR'])
+        if self.settings.get('WORKER_MOUNT_INPUTS'):
+            bind_mount = self.filehandler.BIND_MOUNT_FIRST
+        else:
+            bind_mount = self.filehandler.BIND_MOUNT_FALLBACK
+        staged_files = self.filehandler.download_files(
+            data_object_ids, target_directory=self.settings['WORKING_DIR'], bind_mount=bind_mount,
+            cache_holder=self.settings['RUN_ID'])
+        strategy_counts = {}
+        for staged_file in staged_files:
+            strategy_counts[staged_file['strategy']] = strategy_counts.get(staged_file['strategy'], 0) + 1
+            if staged_file['strategy'] == 'bind_mount':
+                self._add_input_mount(staged_file['source_path'], staged_file['local_path'])
+        self.logger.info('Staged %s inputs (%s), %s bytes copied, %s from node cache' % (
+            len(staged_files),
+            ', '.join('%s: %s' % item for item in sorted(strategy_counts.items())),
+            sum(staged_file['bytes_copied'] for staged_file in staged_files),
+            len([staged_file for staged_file in staged_files if staged_file.get('cache_hit')])))
+
+    def _release_cached_inputs(self):
+        # Inputs mounted from the node cache must stay until the task is done
+        if self.filehandler.node_cache is not None:
+            self.filehandler.node_cache.release(self.settings['RUN_ID'])
+
+    def _add_input_mount(self, source_path, local_path):
+        """Mount an input read-only into the container from where it is
+        stored, outside the working dir, and link to it from the working dir.
+        The link is dangling on the host but resolves in the container.
+        """
+        container_path = os.path.join(
+            self.INPUT_MOUNT_DIR, str(len(self.input_mounts)), os.path.basename(local_path))
+        os.symlink(container_path, local_path)
+        self.input_mounts.append((source_path, container_path))
 
     def _upload_outputs(self):
+        self._upload_output_files()
+        self.objecthandler.update_task_run(self.task_run)
+
+    def _upload_output_files(self):
         for task_run_output in self.task_run['task_run_outputs']:
             path = task_run_output['task_definition_output']['path']
             task_run_output['data_object'] = self.filehandler.upload_file_from_local_path(path, source_directory=self.settings['WORKING_DIR'])
-        self.objecthandler.update_task_run(self.task_run)
-        
-    def _get_additional_settings(self):
-        url = self.settings['MASTER_URL'] + '/api/workerinfo'
-        response = requests.get(url)
-        response.raise_for_status()
-        workerinfo = response.json()['workerinfo']
+
+    @classmethod
+    def get_workerinfo(cls, master_url):
+        return ObjectHandler(master_url).get_worker_info()
+
+    def _get_additional_settings(self, workerinfo):
+        workerinfo = dict(workerinfo)
         # TODO generate this path on the server
         workerinfo.update({'WORKING_DIR': os.path.join(workerinfo['FILE_ROOT_FOR_WORKER'], uuid.uuid4().hex)})
         return workerinfo
 
     def _init_task_run(self):
-        url = self.settings['MASTER_URL'] + '/api/task_runs/' + self.settings['RUN_ID']
-        response = requests.get(url)
-        response.raise_for_status()
-        self.task_run = response.json()
+        self.task_run = self.objecthandler.get_task_run(self.settings['RUN_ID'])
         self.logger.debug('Retrieved TaskRun %s' % self.task_run)
         
     def _get_task_run(self):
@@ -100,17 +192,30 @@ class TaskRunner(object):
             'docker',
             'run',
             '--rm',
+            '--name',
+            self.container_name,
             '-v',
             '%s:%s:rw' % (host_dir, container_dir),
+            ]
+        for (source_path, container_path) in self.input_mounts:
+            full_command.extend([
+                '-v',
+                '%s:%s:ro' % (source_path, container_path),
+                ])
+        full_command.extend([
             '-w',
             container_dir,
             docker_image,
             'sh',
             '-c',
             user_command,
-            ]
+            ])
         self.logger.debug(full_command)
-        return subprocess.Popen(full_command, stdout=stdoutlog, stderr=stderrlog)
+        with self.lock:
+            # Do not start a container that stop() would miss
+            self._raise_if_stopped()
+            self.process = subprocess.Popen(full_command, stdout=stdoutlog, stderr=stderrlog)
+        return self.process
 
     def _wait_for_process(self, process, poll_interval_seconds=1, timeout_seconds=86400):
         start_time = datetime.now()
@@ -122,6 +227,7 @@ class TaskRunner(object):
             if returncode is not None:
                 break
             time.sleep(poll_interval_seconds)
+        self._raise_if_stopped()
         if returncode == 0:
             return
         else:
@@ -155,18 +261,46 @@ class TaskRunner(object):
         return parser
 
     def _init_filehandler(self):
-        self.filehandler = FileHandler(self.settings['MASTER_URL'], logger=self.logger)
+        # Outputs are written once to a new working dir and never uploaded
+        # again, so caching their hashes would only churn the hash cache
+        self.filehandler = FileHandler(self.settings['MASTER_URL'], logger=self.logger,
+                                       use_hash_cache=False,
+                                       node_cache=self.get_node_cache(self.settings))
+
+    @classmethod
+    def get_node_cache(cls, workerinfo):
+        if not workerinfo.get('WORKER_CACHE_DIR'):
+            return None
+        return NodeCache(workerinfo['WORKER_CACHE_DIR'],
+                         int(workerinfo['WORKER_CACHE_MAX_GB'] * 1024**3))
 
     def _init_objecthandler(self):
         self.objecthandler = ObjectHandler(self.settings['MASTER_URL'])
         
     def _init_logger(self):
-        self.logger = logging.getLogger("LoomWorker")
-        self.logger.setLevel(self.settings['LOG_LEVEL'])
+        # A WorkerAgent runs several TaskRuns at once in one process. They
+        # share one logger, and log through an adapter that tags each record
+        # with the RUN_ID, so that each handler only takes records of its own
+        # TaskRun. Loggers are never freed, so there is not one per TaskRun.
+        logger = logging.getLogger("LoomWorker")
+        logger.setLevel(self.settings['LOG_LEVEL'])
+        self.logger = logging.LoggerAdapter(logger, {'run_id': self.settings['RUN_ID']})
+        self.log_handlers = []
+        self._add_log_handler(self._init_handler())
+
+    def _add_log_handler(self, handler):
         formatter = logging.Formatter('%(levelname)s [%(asctime)s] %(message)s')
-        handler = self._init_handler()
         handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        handler.addFilter(RunIdFilter(self.settings['RUN_ID']))
+        self.logger.logger.addHandler(handler)
+        self.log_handlers.append(handler)
+
+    def close(self):
+        """Close this TaskRun's log handlers"""
+        for handler in self.log_handlers:
+            self.logger.logger.removeHandler(handler)
+            handler.close()
+        self.log_handlers = []
         
     def _init_handler(self):
         if self.settings.get('WORKER_LOGFILE') is None:
@@ -182,10 +316,7 @@ class TaskRunner(object):
         self.settings.update({'STDOUT_LOGFILE': os.path.join(self.settings['WORKING_DIR'], 'stdout_log.txt')})
         self.settings.update({'STDERR_LOGFILE': os.path.join(self.settings['WORKING_DIR'], 'stderr_log.txt')})
         
-        formatter = logging.Formatter('%(levelname)s [%(asctime)s] %(message)s')
-        handler = logging.FileHandler(self.settings['STEP_LOGFILE'])
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        self._add_log_handler(logging.FileHandler(self.settings['STEP_LOGFILE']))
 
 # pip entrypoint requires a function with no arguments 
 def main():
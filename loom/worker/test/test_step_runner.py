@@ -2,6 +2,7 @@
 
 from datetime import datetime
 import json
+import logging
 import os
 import requests
 import shutil
@@ -14,8 +15,51 @@ from loom.common import fixtures
 from loom.common.testserver import TestServer
 from loom.worker.task_runner import TaskRunner
 
-class TestTaskRunner(unittest.TestCase):
-    pass
+class TaskRunArgs(object):
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.run_location_id = None
+        self.master_url = 'http://127.0.0.1:8000'
+
+
+class TestTaskRunnerLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.workerinfo = {
+            'LOG_LEVEL': 'INFO',
+            'FILE_ROOT_FOR_WORKER': self.tmp_dir,
+            'WORKER_LOGFILE': os.path.join(self.tmp_dir, 'worker.log'),
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_task_runner(self, run_id):
+        return TaskRunner(args=TaskRunArgs(run_id), workerinfo=self.workerinfo,
+                          task_run={}, filehandler=object(), objecthandler=object())
+
+    def testStepLogfilesOnlyHaveTheirOwnTaskRun(self):
+        task_runners = [self._create_task_runner(run_id) for run_id in ['run1', 'run2']]
+        for task_runner in task_runners:
+            os.makedirs(task_runner.settings['WORKING_DIR'])
+            task_runner._add_logfiles()
+        for task_runner in task_runners:
+            task_runner.logger.info('Message from %s' % task_runner.settings['RUN_ID'])
+            task_runner.close()
+        for task_runner in task_runners:
+            with open(task_runner.settings['STEP_LOGFILE']) as f:
+                lines = f.readlines()
+            self.assertEqual(len(lines), 1)
+            self.assertIn('Message from %s' % task_runner.settings['RUN_ID'], lines[0])
+
+    def testLoggersAreShared(self):
+        logger_count = len(logging.Logger.manager.loggerDict)
+        for i in range(3):
+            self._create_task_runner('run%s' % i).close()
+        self.assertLessEqual(len(logging.Logger.manager.loggerDict), logger_count + 1)
+        self.assertEqual(logging.getLogger('LoomWorker').handlers, [])
 
     """
     def setUp(self):
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+"""A long-lived process that leases TaskRuns from the master and runs them."""
+
+import argparse
+import logging
+import multiprocessing
+import socket
+import threading
+import time
+
+from loom.common.exceptions import TaskRunStoppedError
+from loom.common.filehandler import FileHandler
+from loom.common.objecthandler import ObjectHandler
+from loom.worker.task_runner import TaskRunner
+
+
+class LeaseArgs(object):
+
+    def __init__(self, run_id, run_location_id, master_url):
+        self.run_id = run_id
+        self.run_location_id = run_location_id
+        self.master_url = master_url
+
+
+class LeasedTaskRunner(TaskRunner):
+    """Runs a leased TaskRun and reports the outputs to the master with the
+    lease's TaskRunLocation ID, so that results from an expired lease are
+    rejected.
+    """
+
+    def _upload_outputs(self):
+        self._upload_output_files()
+        outputs = [{'_id': task_run_output['_id'],
+                    'data_object': task_run_output['data_object']}
+                   for task_run_output in self.task_run['task_run_outputs']]
+        self.objecthandler.submit_task_run_result(
+            self.settings['RUN_ID'], self.settings['RUN_LOCATION_ID'], outputs)
+
+
+class WorkerAgent(object):
+    """Leases are kept alive by a heartbeat. If the master reports that a lease
+    was lost, the TaskRun has been reassigned and its results would be
+    rejected, so its container is killed and its capacity freed.
+    """
+
+    def __init__(self, args=None):
+        if args is None:
+            args = self._get_args()
+        self.master_url = args.master_url
+        self.cores = args.cores
+        self.max_tasks = args.max_tasks or args.cores
+        self.poll_interval = args.poll_interval
+        self.heartbeat_interval = args.heartbeat_interval
+        self.workerinfo = TaskRunner.get_workerinfo(self.master_url)
+        self._init_logger()
+        # TaskRuns share the filehandler, and so share one node cache. Their
+        # outputs are never uploaded again, so their hashes are not cached.
+        self.filehandler = FileHandler(self.master_url, logger=self.logger,
+                                       use_hash_cache=False,
+                                       node_cache=TaskRunner.get_node_cache(self.workerinfo))
+        self.objecthandler = ObjectHandler(self.master_url)
+        self.worker = self.objecthandler.post_worker({
+            'worker_name': args.name,
+            'cores': args.cores,
+            'memory': args.memory,
+            'disk_space': args.disk_space,
+        })
+        self.logger.info('Registered worker %s with ID %s'
+                         % (self.worker['worker_name'], self.worker['_id']))
+        # Active leases, as {task_run_location_id: cores}
+        self.leases = {}
+        # TaskRunners of active leases, as {task_run_location_id: task_runner}
+        self.task_runners = {}
+        self.lock = threading.Lock()
+
+    def run(self):
+        heartbeat = threading.Thread(target=self._heartbeat_forever)
+        heartbeat.daemon = True
+        heartbeat.start()
+        while True:
+            try:
+                leased_count = self._lease_and_start()
+            except Exception as e:
+                self.logger.exception(e)
+                leased_count = 0
+            if leased_count == 0:
+                time.sleep(self.poll_interval)
+
+    def _get_free_capacity(self):
+        with self.lock:
+            free_cores = self.cores - sum(self.leases.values())
+            free_slots = self.max_tasks - len(self.leases)
+        return (free_cores, free_slots)
+
+    def _lease_and_start(self):
+        (free_cores, free_slots) = self._get_free_capacity()
+        if free_cores <= 0 or free_slots <= 0:
+            return 0
+        leases = self.objecthandler.lease_task_runs(
+            self.worker['_id'], free_slots, free_cores)
+        for lease in leases:
+            cores = self._get_cores(lease)
+            with self.lock:
+                self.leases[lease['task_run_location_id']] = cores
+            thread = threading.Thread(target=self._run_task, args=(lease,))
+            thread.daemon = True
+            thread.start()
+        return len(leases)
+
+    def _get_cores(self, lease):
+        resources = lease.get('resources') or {}
+        try:
+            return int(resources.get('cores') or 1)
+        except ValueError:
+            return 1
+
+    def _run_task(self, lease):
+        task_run = lease['task_run']
+        location_id = lease['task_run_location_id']
+        task_runner = None
+        try:
+            task_runner = LeasedTaskRunner(
+                args=LeaseArgs(task_run['_id'], location_id, self.master_url),
+                workerinfo=self.workerinfo,
+                task_run=task_run,
+                filehandler=self.filehandler,
+                objecthandler=self.objecthandler)
+            with self.lock:
+                if location_id not in self.leases:
+                    # Lost before it started
+                    return
+                self.task_runners[location_id] = task_runner
+            task_runner.run()
+        except TaskRunStoppedError:
+            self.logger.info('Stopped TaskRun %s after losing its lease'
+                             % task_run['_id'])
+        except Exception as e:
+            self.logger.exception(e)
+            try:
+                self.objecthandler.post_task_run_error(task_run['_id'], location_id)
+            except Exception as e:
+                self.logger.exception(e)
+        finally:
+            if task_runner is not None:
+                task_runner.close()
+            with self.lock:
+                self.leases.pop(location_id, None)
+                self.task_runners.pop(location_id, None)
+
+    def _heartbeat_forever(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self.lock:
+                location_ids = self.leases.keys()
+            try:
+                lost_ids = self.objecthandler.post_worker_heartbeat(
+                    self.worker['_id'], location_ids)
+            except Exception as e:
+                self.logger.exception(e)
+                continue
+            for location_id in lost_ids:
+                self._stop_lost_lease(location_id)
+
+    def _stop_lost_lease(self, location_id):
+        """The TaskRun was reassigned and its results would be rejected,
+        so stop it and free its capacity. The lease is no longer renewed.
+        """
+        with self.lock:
+            if self.leases.pop(location_id, None) is None:
+                return
+            task_runner = self.task_runners.pop(location_id, None)
+        self.logger.warning('Lost lease on TaskRunLocation %s' % location_id)
+        if task_runner is not None:
+            try:
+                task_runner.stop()
+            except Exception as e:
+                self.logger.exception(e)
+
+    def _init_logger(self):
+        self.logger = logging.getLogger("LoomWorkerAgent")
+        self.logger.setLevel(self.workerinfo['LOG_LEVEL'])
+        formatter = logging.Formatter('%(levelname)s [%(asctime)s] %(message)s')
+        handler = logging.StreamHandler()
+        handler.setFormatter(formatter)
+        self.logger.addHandler(handler)
+
+    def _get_args(self):
+        parser = self.get_parser()
+        return parser.parse_args()
+
+    @classmethod
+    def get_parser(self):
+        parser = argparse.ArgumentParser(__file__)
+        parser.add_argument('--master_url',
+                            '-u',
+                            required=True,
+                            help='URL of the Loom master server')
+        parser.add_argument('--name',
+                            default=socket.gethostname(),
+                            help='Name to register the worker under. '\
+                            'Defaults to the hostname.')
+        parser.add_argument('--cores',
+                            type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='Number of cores available for TaskRuns')
+        parser.add_argument('--memory',
+                            help='Memory available for TaskRuns, e.g. "8GB"')
+        parser.add_argument('--disk_space',
+                            help='Disk space available for TaskRuns')
+        parser.add_argument('--max_tasks',
+                            type=int,
+                            help='Maximum number of TaskRuns to run at '\
+                            'once. Defaults to the number of cores.')
+        parser.add_argument('--poll_interval',
+                            type=float,
+                            default=2,
+                            help='Seconds to wait before asking for more '\
+                            'work when none was available')
+        parser.add_argument('--heartbeat_interval',
+                            type=float,
+                            default=30,
+                            help='Seconds between lease renewals')
+        return parser
+
+# pip entrypoint requires a function with no arguments
+def main():
+    WorkerAgent().run()
+
+if __name__=='__main__':
+    main()
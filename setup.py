@@ -132,6 +132,10 @@ setup(
     #     'dev': ['check-manifest'],
     #     'test': ['coverage'],
     # },
+    extras_require={
+        # The blake2b and blake2b-tree hash functions on Python 2
+        'blake2': ['pyblake2>=0.9.3'],
+    },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these
@@ -153,6 +157,7 @@ setup(
          'console_scripts': [
              'loom=loom.client.main:main',
              'loom-taskrunner=loom.worker.task_runner:main',
+             'loom-worker=loom.worker.worker_agent:main',
          ],
      },
 )